@@ -15,3 +15,5 @@ admin.site.register(PDCommunicationLog)
 admin.site.register(PDLegalAction)
 admin.site.register(PDPenaltiesChargesConfig)
 admin.site.register(LoanAccountReceivable)
+admin.site.register(EODRun)
+admin.site.register(EODCheckpoint)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LmsappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LMSapp'
+
+    def ready(self):
+        from . import waterfall  # Connects the signals that clear the waterfall cache
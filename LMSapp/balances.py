@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery, Sum
+from . import eod, postings
+from .models import Account, AccountBalanceSnapshot, Ledger, LoanAccount, LoanAccountBalanceSnapshot
+
+# Balances as of a date. The EOD balance snapshot stage records every Account's and LoanAccount's balance at the end
+# of the business day; the balance as of a later day is its latest snapshot plus the ledger rows posted since, so a
+# trial balance or statement reads a few days of ledger rows however many years of history there are. An owner
+# without a snapshot yet is worked back from its current balance instead. Ledger rows count on their value_date, the
+# business date they were posted for, so an EOD run finishing after midnight or catching up still posts to its day.
+
+CENT = Decimal('0.01')
+LOANS = postings.LEDGER_ROLES['loans']
+
+
+# Ledger rows of the days after `after` up to and including `upto`
+def in_window(queryset, after=None, upto=None):
+    if after is not None:
+        queryset = queryset.filter(value_date__gt=after)
+    if upto is not None:
+        queryset = queryset.filter(value_date__lte=upto)
+    return queryset
+
+
+class Balances(ABC):
+    model = None
+    snapshot_model = None
+    owner_field = None
+
+    # {owner_id: balance change} of the ledger rows of the days in (after, upto]; ids None reads every owner
+    @abstractmethod
+    def movements(self, ids, after=None, upto=None):
+        pass
+
+    # Ledger rows of one owner of the days in (after, upto], in posting order, as dicts with their balance change
+    @abstractmethod
+    def entries(self, owner_id, after, upto):
+        pass
+
+    def owners(self, ids=None):
+        return self.model.objects.all() if ids is None else self.model.objects.filter(pk__in=ids)
+
+    # {owner_id: balance} at the end of day, from each owner's latest snapshot on or before day
+    def as_of(self, day, ids=None):
+        latest = self.snapshot_model.objects.filter(
+            **{self.owner_field: OuterRef('pk')}, snapshot_date__lte=day).order_by('-snapshot_date')
+        rows = self.owners(ids).annotate(
+            last_snapshot_date=Subquery(latest.values('snapshot_date')[:1]),
+            last_snapshot_balance=Subquery(latest.values('balance')[:1]),
+        ).values_list('pk', 'balance', 'last_snapshot_date', 'last_snapshot_balance')
+
+        # Owners are grouped by the date of their latest snapshot, so each group's delta is read with one query
+        groups = {}
+        for owner_id, balance, snapshot_date, snapshot_balance in rows:
+            start = balance if snapshot_date is None else snapshot_balance
+            groups.setdefault(snapshot_date, {})[owner_id] = start
+
+        balances = {}
+        for snapshot_date, group in groups.items():
+            scope = None if ids is None else list(group)
+            if snapshot_date is None:
+                later = self.movements(scope, after=day)
+                changes = {owner_id: -change for owner_id, change in later.items()}
+            elif snapshot_date < day:
+                changes = self.movements(scope, after=snapshot_date, upto=day)
+            else:
+                changes = {}
+            for owner_id, balance in group.items():
+                balances[owner_id] = (balance + changes.get(owner_id, 0)).quantize(CENT)
+        return balances
+
+    # {owner_id: balance} at the end of day, worked back from the current balances, which are locked while they are
+    # read so that no posting lands between them and the ledger rows
+    def closing_balances(self, day, ids):
+        current = dict(self.owners(ids).select_for_update().values_list('pk', 'balance'))
+        later = self.movements(list(current), after=day)
+        return {owner_id: (balance - later.get(owner_id, 0)).quantize(CENT) for owner_id, balance in current.items()}
+
+    # Records the closing balances of day of the owners in ids that have no snapshot for day yet
+    def snapshot(self, day, ids):
+        taken = self.snapshot_model.objects.filter(snapshot_date=day, **{f'{self.owner_field}_id__in': ids})
+        taken = set(taken.values_list(f'{self.owner_field}_id', flat=True))
+        balances = self.closing_balances(day, [owner_id for owner_id in ids if owner_id not in taken])
+        self.snapshot_model.objects.bulk_create([
+            self.snapshot_model(**{f'{self.owner_field}_id': owner_id}, snapshot_date=day, balance=balance)
+            for owner_id, balance in balances.items()
+        ])
+        return len(balances)
+
+    # Opening balance, ledger rows with the running balance, and closing balance of one owner from from_date to
+    # to_date, both included
+    def statement(self, owner_id, from_date, to_date):
+        opening = self.as_of(from_date - timedelta(days=1), [owner_id]).get(owner_id, Decimal('0.00'))
+        balance = opening
+        entries = []
+        for entry in self.entries(owner_id, from_date - timedelta(days=1), to_date):
+            balance = (balance + entry.pop('change')).quantize(CENT)
+            entries.append({**entry, 'balance': balance})
+        return {'from': from_date, 'to': to_date, 'opening_balance': opening, 'closing_balance': balance,
+                'entries': entries}
+
+
+class AccountBalances(Balances):
+    model = Account
+    snapshot_model = AccountBalanceSnapshot
+    owner_field = 'account'
+
+    def movements(self, ids, after=None, upto=None):
+        rows = in_window(Ledger.objects.all(), after, upto)
+        movements = {}
+        for field, side in (('debit_account', 'debit'), ('credit_account', 'credit')):
+            sided = rows if ids is None else rows.filter(**{f'{field}_id__in': ids})
+            totals = sided.values_list(field, f'{field}__account_type').annotate(total=Sum('amount')).order_by()
+            for account_id, account_type, total in totals:
+                change = signed_change(account_type, side, total)
+                movements[account_id] = movements.get(account_id, 0) + change
+        return movements
+
+    def entries(self, owner_id, after, upto):
+        rows = Ledger.objects.filter(Q(debit_account_id=owner_id) | Q(credit_account_id=owner_id))
+        rows = in_window(rows, after, upto)
+        account_type = Account.objects.values_list('account_type', flat=True).get(pk=owner_id)
+        return [
+            {'id': ledger_id, 'transaction': transaction_id, 'value_date': value_date, 'entry_date': entry_date,
+             'description': description,
+             'debit': amount if debit_id == owner_id else None, 'credit': amount if credit_id == owner_id else None,
+             'change': (signed_change(account_type, 'debit', amount) if debit_id == owner_id else 0)
+             + (signed_change(account_type, 'credit', amount) if credit_id == owner_id else 0)}
+            for ledger_id, transaction_id, value_date, entry_date, description, debit_id, credit_id, amount
+            in rows.order_by('value_date', 'entry_date', 'pk').values_list(
+                'pk', 'transaction_id', 'value_date', 'entry_date', 'transaction__description', 'debit_account_id',
+                'credit_account_id', 'amount')
+        ]
+
+
+# LoanAccount balances move with the loans ledger account legs of the journals posted for the loan account
+class LoanAccountBalances(Balances):
+    model = LoanAccount
+    snapshot_model = LoanAccountBalanceSnapshot
+    owner_field = 'loan_account'
+
+    def movements(self, ids, after=None, upto=None):
+        rows = in_window(Ledger.objects.filter(transaction__loan_account__isnull=False), after, upto)
+        if ids is not None:
+            rows = rows.filter(transaction__loan_account_id__in=ids)
+        totals = rows.values_list('transaction__loan_account').annotate(
+            debits=Sum('amount', filter=Q(debit_account__account_type=LOANS)),
+            credits=Sum('amount', filter=Q(credit_account__account_type=LOANS)),
+        ).order_by()
+        return {loan_account_id: (debits or 0) - (credits or 0) for loan_account_id, debits, credits in totals}
+
+    def entries(self, owner_id, after, upto):
+        rows = in_window(Ledger.objects.filter(transaction__loan_account_id=owner_id), after, upto).filter(
+            Q(debit_account__account_type=LOANS) | Q(credit_account__account_type=LOANS))
+        return [
+            {'id': ledger_id, 'transaction': transaction_id, 'value_date': value_date, 'entry_date': entry_date,
+             'description': description,
+             'debit': amount if debit_type == LOANS else None, 'credit': amount if credit_type == LOANS else None,
+             'change': (amount if debit_type == LOANS else 0) - (amount if credit_type == LOANS else 0)}
+            for ledger_id, transaction_id, value_date, entry_date, description, debit_type, credit_type, amount
+            in rows.order_by('value_date', 'entry_date', 'pk').values_list(
+                'pk', 'transaction_id', 'value_date', 'entry_date', 'transaction__description',
+                'debit_account__account_type', 'credit_account__account_type', 'amount')
+        ]
+
+
+def signed_change(account_type, side, amount):
+    grows = 'credit' if account_type in postings.CREDIT_NORMAL_TYPES else 'debit'
+    return amount if side == grows else -amount
+
+
+account_balances = AccountBalances()
+loan_account_balances = LoanAccountBalances()
+
+
+# Trial balance at the end of day: each Account's balance in its debit or credit column, and the column totals
+def trial_balance(day):
+    balances = account_balances.as_of(day)
+    rows = []
+    totals = {'debit': Decimal('0.00'), 'credit': Decimal('0.00')}
+    for account_id, account_number, account_name, account_type in Account.objects.order_by(
+            'general_ledger_no', 'account_number').values_list('pk', 'account_number', 'account_name', 'account_type'):
+        balance = balances.get(account_id, Decimal('0.00'))
+        # A debit balance is a positive balance of a debit-normal account or a negative one of a credit-normal account
+        debit_normal = account_type not in postings.CREDIT_NORMAL_TYPES
+        column = 'debit' if (balance >= 0) == debit_normal else 'credit'
+        totals[column] += abs(balance)
+        rows.append({'account': account_id, 'account_number': account_number, 'account_name': account_name,
+                     'account_type': account_type, 'balance': balance,
+                     'debit': abs(balance) if column == 'debit' else None,
+                     'credit': abs(balance) if column == 'credit' else None})
+    return {'date': day, 'accounts': rows, 'total_debit': totals['debit'], 'total_credit': totals['credit']}
+
+
+# EOD stage: snapshots the closing balances of business_date of the shard's loan accounts, batch by batch. The GL
+# accounts are few and shared by every shard, so the first shard snapshots them all in one go. Owners that already
+# have a snapshot for business_date are skipped, so a rerun never snapshots twice.
+def snapshot_balances(business_date, after_id=None, upto_id=None, checkpoint=None, batch_size=None):
+    result = {'accounts': 0, 'loan_accounts': 0}
+    first_shard = after_id is None or not LoanAccount.objects.filter(pk__lte=after_id).exists()
+    if first_shard:
+        with transaction.atomic():
+            account_ids = list(Account.objects.values_list('pk', flat=True))
+            result['accounts'] = account_balances.snapshot(business_date, account_ids)
+            eod.save_checkpoint(checkpoint, eod.resume_after(checkpoint), {'accounts': result['accounts']})
+
+    taken = LoanAccountBalanceSnapshot.objects.filter(loan_account=OuterRef('pk'), snapshot_date=business_date)
+    accounts = eod.in_shard(LoanAccount.objects.exclude(Exists(taken)), 'pk', after_id, upto_id)
+    batches = eod.iter_batches(accounts, [], eod.get_batch_size(batch_size), eod.resume_after(checkpoint))
+    for rows in batches:
+        with transaction.atomic():
+            count = loan_account_balances.snapshot(business_date, [row[0] for row in rows])
+            eod.save_checkpoint(checkpoint, rows[-1][0], {'loan_accounts': count})
+        result['loan_accounts'] += count
+    return result
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import timeit
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+
+from ..models import ReusableLoanCalculator
+from ..schedule_engine import CALCULATION_ERRORS
+from ..serializers import LoanCalculatorSerializer
+from .. import vectorized
+
+# Benchmark and regression suite for the loan calculator, run through `manage.py benchmark_calculator`.
+# Every loan_calculation_method x repayment_schedule combination is timed over realistic tenures, and every
+# schedule is checked against the golden outputs recorded in calculator_golden.json.
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'calculator_golden.json')
+
+LOAN_AMOUNT = Decimal('250000.00')
+INTEREST_RATE = Decimal('12.50')
+REPAYMENT_START_DATE = date(2024, 1, 1)
+
+METHODS = (
+    'reducing_balance', 'flat_rate', 'constant_repayment', 'simple_interest', 'compound_interest',
+    'graduated_repayment', 'balloon_payment', 'bullet_repayment', 'interest_first',
+)
+
+# (tenure, tenure_type) pairs a product would realistically offer for each repayment schedule
+TENURES = {
+    'daily': ((90, 'days'), (365, 'days')),
+    'weekly': ((26, 'weeks'), (104, 'weeks')),
+    'monthly': ((12, 'months'), (60, 'months'), (360, 'months')),
+    'quarterly': ((24, 'months'), (5, 'years')),
+    'halfyearly': ((36, 'months'), (10, 'years')),
+    'annually': ((5, 'years'), (30, 'years')),
+    'one_time': ((6, 'months'),),
+}
+
+# What is benchmarked: the calculator with each engine, and the calculator API serializer
+TARGETS = ('decimal', 'vectorized', 'serializer')
+
+def cases():
+    for method in METHODS:
+        for repayment_schedule, tenures in TENURES.items():
+            for tenure, tenure_type in tenures:
+                yield {
+                    'loan_amount': LOAN_AMOUNT,
+                    'interest_rate': INTEREST_RATE,
+                    'tenure': tenure,
+                    'tenure_type': tenure_type,
+                    'repayment_schedule': repayment_schedule,
+                    'repayment_mode': 'both',
+                    'interest_basis': '365',
+                    'loan_calculation_method': method,
+                    'repayment_start_date': REPAYMENT_START_DATE,
+                }
+
+
+def case_id(inputs):
+    return '{loan_calculation_method}/{repayment_schedule}/{tenure}{tenure_type[0]}'.format(**inputs)
+
+
+def calculate(target, inputs):
+    if target == 'serializer':
+        data = dict(inputs, repayment_start_date=inputs['repayment_start_date'].isoformat())
+        serializer = LoanCalculatorSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.calculate_repayment_schedule(serializer.validated_data)
+    return ReusableLoanCalculator(**inputs, engine=target).calculate_repayment_schedule()
+
+
+# Golden record of one calculation: the totals in clear and a digest of the whole plan, or the error raised
+def golden_record(engine, inputs):
+    try:
+        plan = calculate(engine, inputs)
+    except CALCULATION_ERRORS as error:
+        return {'error': type(error).__name__}
+    return {
+        'installments': len(plan['repayment_plan']),
+        'total_principal': str(plan['total_principal']),
+        'total_interest': str(plan['total_interest']),
+        'total_amount_to_repay': str(plan['total_amount_to_repay']),
+        'digest': plan_digest(plan),
+    }
+
+
+def plan_digest(plan):
+    canonical = json.dumps(plan, default=str, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+# Golden outputs are recorded per engine, since the engines round long schedules differently.
+# The outputs of engines that are not re-recorded are kept.
+def write_golden(engines, path=GOLDEN_PATH):
+    golden = load_json(path) if os.path.exists(path) else {}
+    for engine in engines:
+        golden[engine] = {case_id(inputs): golden_record(engine, inputs) for inputs in cases()}
+    with open(path, 'w') as golden_file:
+        json.dump(golden, golden_file, indent=2, sort_keys=True)
+        golden_file.write('\n')
+    return golden
+
+
+def load_json(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+# Compares every target's output with the golden output of its engine; returns a list of mismatch descriptions
+def check_golden(golden, targets):
+    mismatches = []
+    for target in targets:
+        engine = getattr(settings, 'LOAN_CALCULATOR_ENGINE', 'decimal') if target == 'serializer' else target
+        if engine not in golden:
+            mismatches.append(f"[{target}]: no golden outputs recorded for the {engine} engine")
+            continue
+        for inputs in cases():
+            key = case_id(inputs)
+            expected = golden[engine].get(key)
+            if expected is None:
+                mismatches.append(f"{key} [{target}]: no golden output recorded")
+                continue
+            actual = golden_record(engine if target != 'serializer' else target, inputs)
+            if actual != expected:
+                mismatches.append(f"{key} [{target}]: {describe_mismatch(actual, expected)}")
+    return mismatches
+
+
+def describe_mismatch(actual, expected):
+    if 'error' in actual or 'error' in expected:
+        return f"got {actual.get('error', 'a schedule')}, expected {expected.get('error', 'a schedule')}"
+    for field in ('installments', 'total_principal', 'total_interest', 'total_amount_to_repay'):
+        if actual[field] != expected[field]:
+            return f"{field} {actual[field]}, expected {expected[field]}"
+    return "schedule rows differ from the golden output"
+
+
+# Each timed run loops over the calculation for at least this long, so that timer resolution and scheduling
+# noise average out
+MIN_RUN_SECONDS = 0.02
+
+
+# Times every case for every target. Latency is the per-calculation time of the best of `repeat` runs;
+# allocations are measured in a separate run, since tracing them slows the calculation down.
+def run(targets, repeat=5):
+    results = {}
+    for inputs in cases():
+        for target in targets:
+            key = f"{case_id(inputs)} [{target}]"
+            try:
+                calculate(target, inputs)
+            except CALCULATION_ERRORS:
+                continue  # Combinations the calculator rejects are covered by the golden check only
+
+            timer = timeit.Timer(lambda: calculate(target, inputs))
+            number = 1
+            while timer.timeit(number) < MIN_RUN_SECONDS:
+                number *= 2
+            timings = [seconds / number for seconds in timer.repeat(repeat, number)]
+
+            tracemalloc.start()
+            try:
+                calculate(target, inputs)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            results[key] = {'seconds': min(timings), 'peak_bytes': peak}
+    return results
+
+
+# Cases whose latency grew by more than `threshold` (0.25 = 25%) over the baseline
+def regressions(results, baseline, threshold):
+    slower = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous and result['seconds'] > previous['seconds'] * (1 + threshold):
+            slower.append((key, previous['seconds'], result['seconds']))
+    return slower
+
+
+def available_targets():
+    return [target for target in TARGETS if target != 'vectorized' or vectorized.is_available()]
@@ -0,0 +1,112 @@
+import calendar
+import threading
+from datetime import timedelta
+from functools import lru_cache
+
+# Due-date calendar shared by every repayment schedule. Monthly and longer frequencies step in real calendar
+# months from the repayment start date (Jan 31 -> Feb 29 -> Mar 31), and every due date can be moved to a business
+# day by a pluggable BusinessCalendar. Date sequences are cached per (start date, frequency, calendar) and sliced to
+# the number of installments, so loans starting on the same day share them whatever their tenure. Like
+# schedule_engine, this module has no Django dependency.
+
+# Step between due dates: (days, months)
+FREQUENCY_STEPS = {
+    'daily': (1, 0),
+    'weekly': (7, 0),
+    'monthly': (0, 1),
+    'quarterly': (0, 3),
+    'halfyearly': (0, 6),
+    'annually': (0, 12),
+    'one_time': (0, 0),
+}
+
+DUE_DATE_CACHE_SIZE = 256  # (start date, frequency, calendar) date sequences kept by due_dates()
+DUE_DATE_CACHE_PERIODS = 1200  # Due dates kept per sequence; the dates of longer schedules past it are not cached
+
+# Business-day conventions: move a non-business day to the next business day ('following'), to the previous one
+# ('preceding'), or to the next one unless that falls in the next month, then to the previous one
+# ('modified_following')
+CONVENTIONS = ('following', 'preceding', 'modified_following')
+
+
+# Every day is a business day; subclass it to plug in another calendar
+class BusinessCalendar:
+
+    def is_business_day(self, day):
+        return True
+
+    def adjust(self, day):
+        return day
+
+
+# Weekends and a fixed set of holidays are not business days
+class HolidayCalendar(BusinessCalendar):
+
+    def __init__(self, holidays=(), weekend=(5, 6), convention='following'):
+        if convention not in CONVENTIONS:
+            raise ValueError(f"Invalid business day convention '{convention}'.")
+        self.holidays = frozenset(holidays)
+        self.weekend = frozenset(weekend)  # date.weekday() numbers, Monday is 0
+        self.convention = convention
+
+    def is_business_day(self, day):
+        return day.weekday() not in self.weekend and day not in self.holidays
+
+    def adjust(self, day):
+        if self.is_business_day(day):
+            return day
+        if self.convention == 'preceding':
+            return self._roll(day, -1)
+        following = self._roll(day, 1)
+        if self.convention == 'modified_following' and following.month != day.month:
+            return self._roll(day, -1)
+        return following
+
+    def _roll(self, day, step):
+        for _ in range(366):
+            day += timedelta(days=step)
+            if self.is_business_day(day):
+                return day
+        raise ValueError("The business calendar has no business day within a year.")
+
+
+NO_ADJUSTMENT = BusinessCalendar()
+
+
+def add_months(day, months):
+    month_index = day.month - 1 + months
+    year = day.year + month_index // 12
+    month = month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+# Due date of the period-th installment (1-based), computed directly from the start date so it never drifts
+def due_date(repayment_start_date, repayment_schedule, period, business_calendar=NO_ADJUSTMENT):
+    days, months = FREQUENCY_STEPS[repayment_schedule]
+    steps = period - 1
+    if months:
+        day = add_months(repayment_start_date, months * steps)
+    else:
+        day = repayment_start_date + timedelta(days=days * steps)
+    return business_calendar.adjust(day)
+
+
+# Due dates of the first `count` installments, as a tuple. They are sliced from a sequence shared by every loan with
+# the same start, frequency and calendar, grown to the longest schedule asked for up to DUE_DATE_CACHE_PERIODS.
+def due_dates(repayment_start_date, repayment_schedule, count, business_calendar=NO_ADJUSTMENT):
+    cached = _due_date_sequence(repayment_start_date, repayment_schedule, business_calendar)
+    if len(cached) < min(count, DUE_DATE_CACHE_PERIODS):
+        with _due_date_lock:
+            cached.extend(due_date(repayment_start_date, repayment_schedule, period, business_calendar)
+                          for period in range(len(cached) + 1, min(count, DUE_DATE_CACHE_PERIODS) + 1))
+    dates = tuple(cached[:count])
+    return dates + tuple(due_date(repayment_start_date, repayment_schedule, period, business_calendar)
+                         for period in range(len(dates) + 1, count + 1))
+
+
+_due_date_lock = threading.Lock()  # Sequences are grown by one thread at a time
+
+
+@lru_cache(maxsize=DUE_DATE_CACHE_SIZE)
+def _due_date_sequence(repayment_start_date, repayment_schedule, business_calendar):
+    return []
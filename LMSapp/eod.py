@@ -0,0 +1,661 @@
+import logging
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+from django.utils import timezone
+
+from . import balances, postings, repayments
+from .models import (
+    Account, EODCheckpoint, EODRun, LatePayment, LoanAccount, LoanAccountEntry, LoanAccountReceivable,
+    LoanInterestAccrual, LoanPenaltiesAccrual, PastDueRecord, PDActionWorkflowConfig, PDNextAction,
+    PDPenaltiesChargesConfig, PenaltyAccrual, RepaymentSchedule,
+)
+
+logger = logging.getLogger(__name__)
+
+# End-of-day jobs and their orchestration. Each job walks its rows in keyset-paginated batches (ordered by primary
+# key, so a batch never re-reads a row) and can be restricted to a shard of the loan book, a loan account id range
+# (after_id, upto_id]. run_end_of_day() runs every stage shard by shard, in parallel, through Celery or a local
+# process pool, and records its progress in the EODRun ledger so a crashed run resumes where it stopped. The Celery
+# tasks in tasks.py are thin wrappers around these functions.
+
+CENT = Decimal('0.01')
+DAYS_IN_YEAR = Decimal(365)
+
+
+def get_batch_size(batch_size=None):
+    return batch_size or getattr(settings, 'EOD_BATCH_SIZE', 1000)
+
+
+# Restricts a queryset to the loan accounts of a shard; field is the path to the loan account id
+def in_shard(queryset, field, after_id=None, upto_id=None):
+    if after_id is not None:
+        queryset = queryset.filter(**{f'{field}__gt': after_id})
+    if upto_id is not None:
+        queryset = queryset.filter(**{f'{field}__lte': upto_id})
+    return queryset
+
+
+# Yields the rows of a queryset as lists of value tuples, the primary key first, one batch at a time,
+# starting after the primary key after_pk
+def iter_batches(queryset, fields, batch_size, after_pk=None):
+    last_id = after_pk
+    while True:
+        page = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+        rows = list(page.order_by('pk').values_list('pk', *fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+# Adds counts together; Decimal amounts are kept as strings so they can be stored as JSON
+def merge_counts(totals, counts):
+    merged = dict(totals)
+    for key, value in counts.items():
+        if isinstance(value, (Decimal, str)) or isinstance(merged.get(key), str):
+            merged[key] = str(Decimal(merged.get(key, 0)) + Decimal(value))
+        else:
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+# Records that a stage has written every row up to last_id; called inside the batch's transaction, so the
+# checkpoint never gets ahead of or behind the data. A stage run without a checkpoint is not resumable.
+# gl_deltas are the batch's GL balance deltas from batch_gl_deltas(), kept on the checkpoint until settle_gl_deltas.
+def save_checkpoint(checkpoint, last_id, counts, gl_deltas=None):
+    if checkpoint is None:
+        return
+    checkpoint.last_processed_id = last_id
+    checkpoint.counts = merge_counts(checkpoint.counts, counts)
+    if gl_deltas:
+        checkpoint.gl_deltas = merge_counts(checkpoint.gl_deltas, {str(pk): Decimal(delta)
+                                                                   for pk, delta in gl_deltas.items()})
+    checkpoint.save(update_fields=['last_processed_id', 'counts', 'gl_deltas', 'updated_at'])
+
+
+# Every shard posts to the same few GL accounts, so a stage run from a checkpoint collects their balance deltas
+# instead of updating the shared rows batch by batch: the dict to pass to postings.post_journals. Without a
+# checkpoint, None, and the balances move with each batch.
+def batch_gl_deltas(checkpoint):
+    return {} if checkpoint is not None else None
+
+
+# Applies the GL balance deltas every shard of a stage has collected, with one UPDATE per account, and clears them
+# in the same transaction, so a resumed shard never applies them twice
+def settle_gl_deltas(run, stage):
+    with transaction.atomic():
+        checkpoints = list(run.checkpoints.select_for_update().filter(stage=stage).exclude(gl_deltas={})
+                           .values_list('pk', 'gl_deltas'))
+        totals = {}
+        for _, gl_deltas in checkpoints:
+            for account_id, delta in gl_deltas.items():
+                totals[int(account_id)] = totals.get(int(account_id), 0) + Decimal(delta)
+        postings.apply_balance_deltas(Account, totals)
+        EODCheckpoint.objects.filter(pk__in=[pk for pk, _ in checkpoints]).update(gl_deltas={})
+
+
+def resume_after(checkpoint):
+    return checkpoint.last_processed_id if checkpoint is not None else None
+
+
+# Primary key of the last row of queryset when the stage first ran. It is kept on the checkpoint, so an attempt
+# resumed after a failure stops at the same row instead of taking in the rows created since.
+def last_row_id(queryset, checkpoint):
+    if checkpoint is not None and checkpoint.last_row_id is not None:
+        return checkpoint.last_row_id
+    last_id = queryset.aggregate(last=Max('pk'))['last'] or 0
+    if checkpoint is not None:
+        checkpoint.last_row_id = last_id
+        checkpoint.save(update_fields=['last_row_id', 'updated_at'])
+    return last_id
+
+
+def daily_interest(balance, interest_rate):
+    return (balance * interest_rate / 100 / DAYS_IN_YEAR).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+# Accrues one day of interest on every loan account with an outstanding balance. Accounts that already have an
+# accrual for accrual_date are skipped, so a rerun after a crash never accrues twice; each batch commits its
+# accruals and ledger entries together, with one journal of the batch's total. Returns the number of accounts accrued
+# and the interest accrued.
+def accrue_interest(accrual_date, batch_size=None, after_id=None, upto_id=None, checkpoint=None):
+    already_accrued = LoanInterestAccrual.objects.filter(loan_account=OuterRef('pk'), accrual_date=accrual_date)
+    accounts = LoanAccount.objects.filter(balance__gt=0).exclude(Exists(already_accrued))
+    accounts = in_shard(accounts, 'pk', after_id, upto_id)
+    description = f'Interest accrued for {accrual_date}'
+    ledger = None
+
+    result = {'accounts': 0, 'interest': Decimal('0.00')}
+    batches = iter_batches(accounts, ['balance', 'loan_application__interest_rate'], get_batch_size(batch_size),
+                           resume_after(checkpoint))
+    for rows in batches:
+        # The whole batch's interest is computed in one pass before anything is written
+        amounts = [(account_id, daily_interest(balance, interest_rate)) for account_id, balance, interest_rate in rows]
+        amounts = [(account_id, amount) for account_id, amount in amounts if amount > 0]
+        ledger = ledger or postings.get_ledger_accounts('interest_receivable', 'interest_income')
+
+        with transaction.atomic():
+            LoanInterestAccrual.objects.bulk_create([
+                LoanInterestAccrual(loan_account_id=account_id, accrual_date=accrual_date, interest_amount=amount)
+                for account_id, amount in amounts
+            ])
+            LoanAccountEntry.objects.bulk_create([
+                LoanAccountEntry(loan_account_id=account_id, entry_type='interest', amount=amount,
+                                 entry_date=accrual_date, description=description)
+                for account_id, amount in amounts
+            ])
+            batch_result = {'accounts': len(amounts),
+                            'interest': sum((amount for account_id, amount in amounts), Decimal('0.00'))}
+            gl_deltas = batch_gl_deltas(checkpoint)
+            journal = accrual_journal(ledger, 'interest', description, batch_result, accrual_date)
+            postings.post_journals([journal], gl_deltas)
+            save_checkpoint(checkpoint, rows[-1][0], batch_result, gl_deltas)
+
+        result['accounts'] += batch_result['accounts']
+        result['interest'] += batch_result['interest']
+    return result
+
+
+# Journal of a batch of interest or penalty accruals: the receivable grows by what was accrued, as income
+def accrual_journal(ledger, kind, description, batch_result, value_date):
+    amount = batch_result[kind]
+    journal = postings.Journal(f"{description} on {batch_result['accounts']} loan accounts", value_date=value_date)
+    return journal.debit(ledger[f'{kind}_receivable'], amount).credit(ledger[f'{kind}_income'], amount)
+
+
+# Daily late payment penalty rate; LATE_PAYMENT_PENALTY_RATE is an annual percentage of the overdue installment
+def get_penalty_rate():
+    return Decimal(str(getattr(settings, 'LATE_PAYMENT_PENALTY_RATE', 24))) / 100 / DAYS_IN_YEAR
+
+
+# Accrues one day of late payment penalty on every pending installment more than LATE_PAYMENT_GRACE_DAYS past its
+# due date. As with interest, accounts that already have a penalty accrual for penalty_date are skipped, and each
+# batch of accounts commits its writes together: one LoanPenaltiesAccrual and ledger entry per account, the
+# LatePayment record of each installment, the accounts' accrued_penalty and a journal of the batch's total. Returns
+# the number of accounts and installments penalized and the penalty accrued.
+def accrue_penalties(penalty_date, batch_size=None, after_id=None, upto_id=None, checkpoint=None):
+    overdue_before = penalty_date - timedelta(days=getattr(settings, 'LATE_PAYMENT_GRACE_DAYS', 0))
+    overdue = RepaymentSchedule.objects.filter(status='pending', due_date__lt=overdue_before)
+    already_accrued = LoanPenaltiesAccrual.objects.filter(loan_account=OuterRef('pk'), penalty_date=penalty_date)
+    accounts = (LoanAccount.objects.filter(Exists(overdue.filter(loan_application=OuterRef('loan_application'))))
+                .exclude(Exists(already_accrued)))
+    accounts = in_shard(accounts, 'pk', after_id, upto_id)
+    rate = get_penalty_rate()
+    description = f'Late payment penalty accrued for {penalty_date}'
+    ledger = None
+
+    result = {'accounts': 0, 'installments': 0, 'penalty': Decimal('0.00')}
+    batches = iter_batches(accounts, ['loan_application_id'], get_batch_size(batch_size), resume_after(checkpoint))
+    for rows in batches:
+        account_ids = {application_id: account_id for account_id, application_id in rows}
+        ledger = ledger or postings.get_ledger_accounts('penalty_receivable', 'penalty_income')
+        with transaction.atomic():
+            # The overdue installments of the whole batch are read with one query and penalized in one pass
+            installments = overdue.filter(loan_application_id__in=account_ids).values_list(
+                'pk', 'loan_application_id', 'due_date', 'total_amount')
+            penalties = [
+                (schedule_id, account_ids[application_id], (penalty_date - due_date).days,
+                 (total_amount * rate).quantize(CENT, rounding=ROUND_HALF_UP))
+                for schedule_id, application_id, due_date, total_amount in installments
+            ]
+            penalties = [penalty for penalty in penalties if penalty[3] > 0]
+            account_penalties = {}
+            for _, account_id, _, amount in penalties:
+                account_penalties[account_id] = account_penalties.get(account_id, 0) + amount
+
+            # An installment keeps one pending LatePayment, which grows every day it stays unpaid
+            pending = LatePayment.objects.filter(schedule_id__in=[penalty[0] for penalty in penalties],
+                                                 status='pending')
+            late_payments = {row[1]: (row[0], row[2]) for row in pending.values_list('pk', 'schedule_id',
+                                                                                     'penalty_amount')}
+            new_late_payments, updated_late_payments = [], []
+            for schedule_id, _, days_late, amount in penalties:
+                if schedule_id in late_payments:
+                    late_payment_id, penalty_amount = late_payments[schedule_id]
+                    updated_late_payments.append(LatePayment(pk=late_payment_id, days_late=days_late,
+                                                             penalty_amount=penalty_amount + amount))
+                else:
+                    new_late_payments.append(LatePayment(schedule_id=schedule_id, days_late=days_late,
+                                                         penalty_amount=amount))
+            LatePayment.objects.bulk_create(new_late_payments)
+            LatePayment.objects.bulk_update(updated_late_payments, ['days_late', 'penalty_amount'])
+
+            accrued = LoanAccount.objects.select_for_update().filter(pk__in=account_penalties)
+            LoanAccount.objects.bulk_update([
+                LoanAccount(pk=account_id, accrued_penalty=accrued_penalty + account_penalties[account_id])
+                for account_id, accrued_penalty in accrued.values_list('pk', 'accrued_penalty')
+            ], ['accrued_penalty'])
+            LoanPenaltiesAccrual.objects.bulk_create([
+                LoanPenaltiesAccrual(loan_account_id=account_id, penalty_date=penalty_date, penalty_amount=amount)
+                for account_id, amount in account_penalties.items()
+            ])
+            LoanAccountEntry.objects.bulk_create([
+                LoanAccountEntry(loan_account_id=account_id, entry_type='penalty', amount=amount,
+                                 entry_date=penalty_date, description=description)
+                for account_id, amount in account_penalties.items()
+            ])
+            batch_result = {'accounts': len(account_penalties), 'installments': len(penalties),
+                            'penalty': sum(account_penalties.values(), Decimal('0.00'))}
+            gl_deltas = batch_gl_deltas(checkpoint)
+            journal = accrual_journal(ledger, 'penalty', description, batch_result, penalty_date)
+            postings.post_journals([journal], gl_deltas)
+            save_checkpoint(checkpoint, rows[-1][0], batch_result, gl_deltas)
+
+        for key, value in batch_result.items():
+            result[key] += value
+    return result
+
+
+UNPAID_INSTALLMENT = ('pending', 'partial')  # RepaymentSchedule statuses still owed, partial after an advance payment
+CLOSED_PD_STATUSES = ('Resolved', 'Written-off')  # Every other PastDueRecord status is still being worked
+
+
+# Business date of the last completed EOD run before business_date, or None
+def previous_business_date(business_date):
+    runs = EODRun.objects.filter(status='completed', business_date__lt=business_date)
+    return runs.aggregate(last=Max('business_date'))['last']
+
+
+# Creates a PastDueRecord, with its first PDNextAction, for every pending installment that fell past due since the
+# previous completed EOD run (every one on the first run), so the work grows with the newly overdue installments
+# only. Open records are kept in step with their installments in two set-based UPDATEs: amounts that changed
+# are refreshed and records of paid installments are resolved. Returns the counts of each.
+def detect_delinquencies(business_date, after_id=None, upto_id=None, checkpoint=None):
+    recorded = PastDueRecord.objects.filter(repayment_schedule_id=OuterRef('pk'))
+    overdue = RepaymentSchedule.objects.filter(status__in=UNPAID_INSTALLMENT, due_date__lt=business_date,
+                                               loan_application__loanaccount__isnull=False)
+    previous_date = previous_business_date(business_date)
+    if previous_date is not None:
+        overdue = overdue.filter(due_date__gte=previous_date)
+    overdue = in_shard(overdue.exclude(Exists(recorded)), 'loan_application__loanaccount', after_id, upto_id)
+    transitions = WorkflowTransitions.load()
+    result = {'created': 0, 'actions': 0, 'updated': 0, 'resolved': 0}
+
+    batches = iter_batches(overdue, ['loan_application__loanaccount', 'due_date', 'total_amount'],
+                           get_batch_size(), resume_after(checkpoint))
+    for rows in batches:
+        # The workflow starts at the record's bucket
+        records = [
+            PastDueRecord(loan_account_id=loan_account_id, repayment_schedule_id=schedule_id,
+                          overdue_amount=total_amount, overdue_date=due_date, pd_bucket=bucket,
+                          workflow_status=bucket, status='Active')
+            for schedule_id, loan_account_id, due_date, total_amount in rows
+            for bucket in [PastDueRecord.bucket_for((business_date - due_date).days)]
+        ]
+        with transaction.atomic():
+            PastDueRecord.objects.bulk_create(records)
+            record_ids = dict(PastDueRecord.objects.filter(repayment_schedule_id__in=[row[0] for row in rows])
+                              .values_list('repayment_schedule_id', 'pk'))
+            # The first action is the one the workflow sets for the record's bucket
+            actions = []
+            for record in records:
+                workflow = transitions.get(record.pd_bucket)
+                if workflow is not None:
+                    actions.append(PDNextAction(
+                        pd_record_id_id=record_ids[record.repayment_schedule_id],
+                        next_action_date=business_date + timedelta(days=workflow.action_timeline_days),
+                        next_action_type=workflow.next_action_type,
+                        current_pd_status=record.pd_bucket
+                    ))
+            PDNextAction.objects.bulk_create(actions)
+            batch_result = {'created': len(records), 'actions': len(actions)}
+            save_checkpoint(checkpoint, rows[-1][0], batch_result)
+        result = merge_counts(result, batch_result)
+
+    open_records = in_shard(PastDueRecord.objects.exclude(status__in=CLOSED_PD_STATUSES), 'loan_account_id', after_id,
+                            upto_id)
+    schedule = RepaymentSchedule.objects.filter(pk=OuterRef('repayment_schedule_id'))
+    with transaction.atomic():
+        changed = schedule.filter(status__in=UNPAID_INSTALLMENT).exclude(total_amount=OuterRef('overdue_amount'))
+        refreshed = {
+            'updated': open_records.filter(Exists(changed)).update(
+                overdue_amount=Subquery(schedule.values('total_amount')[:1])),
+            'resolved': open_records.filter(Exists(schedule.filter(status='paid'))).update(status='Resolved'),
+        }
+        save_checkpoint(checkpoint, resume_after(checkpoint), refreshed)
+    return merge_counts(result, refreshed)
+
+
+# Moves the past due records that crossed an aging boundary (31, 61 or 91 days overdue) by business_date into
+# their new bucket, with one indexed UPDATE per bucket. Only the records that change bucket are touched, and a
+# skipped day is caught up on the next run. Returns the number of records moved.
+def age_past_due_records(business_date, after_id=None, upto_id=None, checkpoint=None):
+    records = in_shard(PastDueRecord.objects.exclude(status__in=CLOSED_PD_STATUSES), 'loan_account_id', after_id,
+                       upto_id)
+    result = {'records': 0}
+    with transaction.atomic():
+        # From the oldest bucket down, so a record more than one boundary behind goes straight to its bucket
+        for position in range(len(PastDueRecord.BUCKETS) - 1, 0, -1):
+            start, bucket = PastDueRecord.BUCKETS[position]
+            younger = [name for _, name in PastDueRecord.BUCKETS[:position]]
+            result['records'] += records.filter(
+                pd_bucket__in=younger, overdue_date__lte=business_date - timedelta(days=start)).update(pd_bucket=bucket)
+        save_checkpoint(checkpoint, upto_id, result)
+    return result
+
+
+# Penalty and charge rules indexed by their charge_trigger, in days overdue. charge_trigger is stored as text, so it
+# is parsed once here and compared as a number. A record matches the rule with the highest trigger it has reached.
+class PenaltyRuleIndex:
+
+    def __init__(self, configs):
+        rules = {}
+        for config in configs:
+            try:
+                trigger = int(config.charge_trigger)
+            except (TypeError, ValueError):
+                logger.warning("Ignoring penalty config %s with a non-numeric charge_trigger %r", config.pk,
+                               config.charge_trigger)
+                continue
+            rules.setdefault(trigger, config)  # The oldest rule wins when two share a trigger
+        self.triggers = sorted(rules)
+        self.rules = [rules[trigger] for trigger in self.triggers]
+
+    @classmethod
+    def load(cls):
+        return cls(PDPenaltiesChargesConfig.objects.order_by('pk'))
+
+    def match(self, days_overdue):
+        position = bisect_right(self.triggers, days_overdue)
+        return self.rules[position - 1] if position else None
+
+
+# Charges the matching penalty on every active past due record. The rules are loaded once and matched in memory,
+# and each batch's PenaltyAccrual and LoanAccountReceivable rows are inserted in bulk.
+def apply_pd_penalties(business_date, after_id=None, upto_id=None, checkpoint=None):
+    records = in_shard(PastDueRecord.objects.filter(status='Active'), 'loan_account_id', after_id, upto_id)
+    rules = PenaltyRuleIndex.load()
+    result = {'records': 0, 'penalties': 0}
+
+    batches = iter_batches(records, ['loan_account_id', 'overdue_date'], get_batch_size(), resume_after(checkpoint))
+    for rows in batches:
+        # Days overdue are derived from overdue_date, the stored days_overdue is not maintained
+        matches = [(record_id, loan_account_id, rules.match((business_date - overdue_date).days))
+                   for record_id, loan_account_id, overdue_date in rows]
+        matches = [(record_id, loan_account_id, config) for record_id, loan_account_id, config in matches if config]
+
+        with transaction.atomic():
+            PenaltyAccrual.objects.bulk_create([
+                PenaltyAccrual(pd_record_id_id=record_id, penalty_amount=config.charge_amount,
+                               penalty_date=business_date, penalty_type=config.penalty_type, status='Applied')
+                for record_id, _, config in matches
+            ])
+            # Post to Loan Account Receivables
+            LoanAccountReceivable.objects.bulk_create([
+                LoanAccountReceivable(loan_account_id=loan_account_id, pd_record_id_id=record_id,
+                                      amount_type=config.penalty_type, amount_due=config.charge_amount,
+                                      due_date=business_date, status='Due')
+                for record_id, loan_account_id, config in matches
+            ])
+            batch_result = {'records': len(rows), 'penalties': len(matches)}
+            save_checkpoint(checkpoint, rows[-1][0], batch_result)
+        result = merge_counts(result, batch_result)
+    return result
+
+
+# PD workflow transitions by current PD status, compiled once per run from PDActionWorkflowConfig
+class WorkflowTransitions:
+
+    def __init__(self, configs):
+        self.transitions = {}
+        for config in configs:
+            self.transitions.setdefault(config.current_pd_status, config)  # The oldest config wins
+
+    @classmethod
+    def load(cls):
+        return cls(PDActionWorkflowConfig.objects.order_by('pk'))
+
+    def get(self, current_pd_status):
+        return self.transitions.get(current_pd_status)
+
+
+# Performs the past due actions that are due and schedules the next step of each record's workflow. Each batch
+# completes its actions, moves their records to the next workflow status and creates the next actions in bulk; the
+# record's status (Active, Resolved, Written-off) is left alone. Actions whose status has no workflow are left pending
+# and reported, without stopping the run. Only the actions that exist when the stage first starts are performed, not
+# the next actions it creates.
+def run_pd_actions(business_date, after_id=None, upto_id=None, checkpoint=None):
+    actions = PDNextAction.objects.filter(next_action_date__lte=business_date, action_status='Pending')
+    actions = in_shard(actions, 'pd_record_id__loan_account_id', after_id, upto_id)
+    actions = actions.filter(pk__lte=last_row_id(actions, checkpoint))
+    transitions = WorkflowTransitions.load()
+    result = {'actions': 0, 'unmatched': 0}
+    unmatched_statuses = set()
+
+    batches = iter_batches(actions, ['pd_record_id', 'current_pd_status'], get_batch_size(), resume_after(checkpoint))
+    for rows in batches:
+        # Perform the next action (e.g., send reminder, apply penalty)
+        # Logic to perform the action goes here
+
+        completed, next_statuses, next_actions = [], {}, []
+        for action_id, record_id, current_pd_status in rows:
+            workflow = transitions.get(current_pd_status)
+            if workflow is None:
+                unmatched_statuses.add(current_pd_status)
+                continue
+            completed.append(action_id)
+            next_statuses.setdefault(workflow.next_pd_status, []).append(record_id)
+            next_actions.append(PDNextAction(
+                pd_record_id_id=record_id,
+                next_action_date=business_date + timedelta(days=workflow.action_timeline_days),
+                next_action_type=workflow.next_action_type,
+                current_pd_status=workflow.next_pd_status
+            ))
+
+        with transaction.atomic():
+            PDNextAction.objects.filter(pk__in=completed).update(action_status='Completed')
+            # One UPDATE per workflow status the records move to
+            for next_pd_status, record_ids in next_statuses.items():
+                PastDueRecord.objects.filter(pk__in=record_ids).update(workflow_status=next_pd_status,
+                                                                       updated_at=timezone.now())
+            PDNextAction.objects.bulk_create(next_actions)
+            batch_result = {'actions': len(completed), 'unmatched': len(rows) - len(completed)}
+            save_checkpoint(checkpoint, rows[-1][0], batch_result)
+        result = merge_counts(result, batch_result)
+
+    if unmatched_statuses:
+        logger.warning("No PD workflow for the statuses %s; %d actions were left pending",
+                       ', '.join(map(repr, sorted(unmatched_statuses, key=str))), result['unmatched'])
+    return result
+
+
+# EOD stages, run in this order; every shard of a stage finishes before the next stage starts.
+# Each is called as stage(business_date, after_id, upto_id, checkpoint).
+STAGES = {
+    'interest_accrual': lambda business_date, after_id, upto_id, checkpoint: accrue_interest(
+        business_date, after_id=after_id, upto_id=upto_id, checkpoint=checkpoint),
+    'repayments': lambda business_date, after_id, upto_id, checkpoint: repayments.process_due_repayments(
+        business_date, after_id=after_id, upto_id=upto_id, checkpoint=checkpoint),
+    'repayment_retries': lambda business_date, after_id, upto_id, checkpoint: repayments.process_repayment_retries(
+        business_date, after_id=after_id, upto_id=upto_id, checkpoint=checkpoint),
+    'penalty_accrual': lambda business_date, after_id, upto_id, checkpoint: accrue_penalties(
+        business_date, after_id=after_id, upto_id=upto_id, checkpoint=checkpoint),
+    'pd_detection': detect_delinquencies,
+    'pd_aging': age_past_due_records,
+    'pd_penalties': apply_pd_penalties,
+    'pd_actions': run_pd_actions,
+    'balance_snapshots': lambda business_date, after_id, upto_id, checkpoint: balances.snapshot_balances(
+        business_date, after_id=after_id, upto_id=upto_id, checkpoint=checkpoint),
+}
+
+
+# Loan account id ranges (after_id, upto_id] splitting the loan book into at most `count` shards of equal id span
+def shard_ranges(count):
+    bounds = LoanAccount.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return []
+    after_id, last_id = bounds['first'] - 1, bounds['last']
+    span = last_id - after_id
+    step = -(-span // max(1, min(count, span)))  # Ceiling division
+    return [(start, min(start + step, last_id)) for start in range(after_id, last_id, step)]
+
+
+# One shard and worker per CPU by default, but only one on SQLite: it takes one writer at a time, so concurrent
+# shards fail with 'database is locked'
+def default_parallelism():
+    if connection.vendor == 'sqlite':
+        return 1
+    return os.cpu_count() or 1
+
+
+def get_shard_count(shard_count=None):
+    return shard_count or getattr(settings, 'EOD_SHARDS', None) or default_parallelism()
+
+
+# 'celery' fans shards out as Celery subtasks, 'local' runs them in a process pool on this machine.
+# Without an explicit EOD_EXECUTOR, Celery is used when a broker is configured.
+def get_executor(executor=None):
+    executor = executor or getattr(settings, 'EOD_EXECUTOR', None)
+    if executor is None:
+        executor = 'celery' if getattr(settings, 'CELERY_BROKER_URL', None) else 'local'
+    if executor not in ('celery', 'local'):
+        raise ValueError(f"Invalid EOD executor '{executor}'.")
+    return executor
+
+
+# Returns the EOD run of the business date, creating it with one checkpoint per stage and shard. An unfinished run
+# keeps the shards it was created with, so resuming it covers exactly the same loan accounts.
+def start_run(business_date, shard_count=None):
+    with transaction.atomic():
+        run, created = EODRun.objects.select_for_update().get_or_create(
+            business_date=business_date, defaults={'shard_count': 0})
+        if created:
+            ranges = shard_ranges(get_shard_count(shard_count))
+            run.shard_count = len(ranges)
+            run.save(update_fields=['shard_count'])
+            EODCheckpoint.objects.bulk_create([
+                EODCheckpoint(run=run, stage=stage, after_id=after_id, upto_id=upto_id)
+                for stage in STAGES for after_id, upto_id in ranges
+            ])
+        elif run.status == 'failed':
+            logger.info("Resuming EOD run %s for %s", run.run_id, business_date)
+            run.status = 'running'
+            run.save(update_fields=['status'])
+    return run
+
+
+# Runs one stage on one shard from its checkpoint. A failure is logged and recorded on the checkpoint instead of
+# raised, so the other shards carry on; the result only holds JSON-serializable values, as it travels through the
+# Celery result backend.
+def run_checkpoint(checkpoint_id):
+    checkpoint = EODCheckpoint.objects.select_related('run').get(pk=checkpoint_id)
+    if checkpoint.status != 'completed':
+        try:
+            STAGES[checkpoint.stage](checkpoint.run.business_date, checkpoint.after_id, checkpoint.upto_id, checkpoint)
+        except Exception as error:
+            logger.exception("EOD stage %s failed on loan accounts (%s, %s]", checkpoint.stage, checkpoint.after_id,
+                             checkpoint.upto_id)
+            # Only what the committed batches saved counts
+            checkpoint.refresh_from_db(fields=['last_processed_id', 'counts'])
+            checkpoint.status = 'failed'
+            checkpoint.error = f'{type(error).__name__}: {error}'
+        else:
+            checkpoint.status = 'completed'
+            checkpoint.error = None
+        checkpoint.save(update_fields=['status', 'error', 'updated_at'])
+    return shard_result(checkpoint)
+
+
+def shard_result(checkpoint):
+    return {
+        'checkpoint_id': checkpoint.checkpoint_id,
+        'stage': checkpoint.stage,
+        'after_id': checkpoint.after_id,
+        'upto_id': checkpoint.upto_id,
+        'status': checkpoint.status,
+        'last_processed_id': checkpoint.last_processed_id,
+        'counts': checkpoint.counts,
+        'error': checkpoint.error,
+    }
+
+
+# Sums the counts of a stage's shards and collects the failed ones
+def aggregate_stage(stage, shard_results):
+    totals = {}
+    for shard in shard_results:
+        totals = merge_counts(totals, shard['counts'])
+    return {
+        'stage': stage,
+        'shards': len(shard_results),
+        'completed': sum(shard['status'] == 'completed' for shard in shard_results),
+        'failed': [shard for shard in shard_results if shard['status'] == 'failed'],
+        'totals': totals,
+    }
+
+
+# Summary of every stage the run has started, read back from its checkpoints
+def run_summary(run):
+    checkpoints = {}
+    for checkpoint in run.checkpoints.order_by('after_id'):
+        checkpoints.setdefault(checkpoint.stage, []).append(shard_result(checkpoint))
+    stages = [
+        aggregate_stage(stage, checkpoints[stage]) for stage in STAGES
+        if any(shard['status'] != 'pending' for shard in checkpoints.get(stage, ()))
+    ]
+    return {'run_id': run.run_id, 'business_date': str(run.business_date), 'status': run.status,
+            'shards': run.shard_count, 'stages': stages}
+
+
+def stage_failed(run, stage):
+    return run.checkpoints.filter(stage=stage, status='failed').exists()
+
+
+# Closes the run: completed once every checkpoint is, failed otherwise. Returns its summary.
+def end_run(run):
+    run.status = 'failed' if run.checkpoints.exclude(status='completed').exists() else 'completed'
+    run.finished_at = timezone.now()
+    run.summary = run_summary(run)
+    run.save(update_fields=['status', 'finished_at', 'summary'])
+    return run.summary
+
+
+def pending_checkpoints(run, stage):
+    return list(run.checkpoints.filter(stage=stage).exclude(status='completed').values_list('pk', flat=True))
+
+
+def _init_worker():
+    # Forked workers must open their own database connections
+    connections.close_all()
+
+
+# Runs the stages of an EOD run in a local process pool, skipping the shards its checkpoints mark completed.
+# A stage with failed shards stops the run, since the later stages depend on it.
+def run_end_of_day_locally(run, workers=None):
+    workers = workers or getattr(settings, 'EOD_WORKERS', None) or default_parallelism()
+    pool = None
+    if workers > 1 and run.shard_count > 1:
+        # Connections must not be shared with the forked workers
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=min(workers, run.shard_count), initializer=_init_worker)
+    try:
+        for stage in STAGES:
+            checkpoint_ids = pending_checkpoints(run, stage)
+            list(pool.map(run_checkpoint, checkpoint_ids) if pool else map(run_checkpoint, checkpoint_ids))
+            settle_gl_deltas(run, stage)
+            if stage_failed(run, stage):
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return end_run(run)
+
+
+# Runs every EOD stage for the business date over id-range shards of the loan book, resuming the date's run if it
+# did not complete. The local executor returns the run summary: per stage, its shard count, summed counts and
+# failed shards. The Celery executor returns the AsyncResult of the first stage; the run summary is saved on the
+# EODRun when the last stage ends. A completed run is not run again, its summary is returned.
+def run_end_of_day(business_date, shard_count=None, executor=None, workers=None):
+    run = start_run(business_date, shard_count)
+    if run.status == 'completed':
+        return run.summary
+    if get_executor(executor) == 'celery':
+        from .tasks import start_eod_stage
+        return start_eod_stage(run.run_id, next(iter(STAGES)))
+    return run_end_of_day_locally(run, workers)
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import calculator
+from ...models import ReusableLoanCalculator
+
+
+# Benchmarks the loan calculator and checks it against the golden outputs, e.g.
+#   python manage.py benchmark_calculator --save-baseline calculator_baseline.json
+#   python manage.py benchmark_calculator --baseline calculator_baseline.json --threshold 0.25
+class Command(BaseCommand):
+    help = "Benchmark ReusableLoanCalculator and LoanCalculatorSerializer and check them against golden outputs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', choices=calculator.TARGETS,
+                            help="Only benchmark this target; can be repeated. Defaults to every available one.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per case; the best one is reported.")
+        parser.add_argument('--baseline', help="Baseline JSON to compare latencies with.")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed slowdown over the baseline, as a fraction (0.25 = 25%%).")
+        parser.add_argument('--save-baseline', help="Write this run's results to a baseline JSON.")
+        parser.add_argument('--update-golden', action='store_true',
+                            help="Record the current outputs of the benchmarked engines as the golden outputs.")
+        parser.add_argument('--skip-golden', action='store_true', help="Do not check the golden outputs.")
+
+    def handle(self, *args, **options):
+        targets = options['target'] or calculator.available_targets()
+        failures = []
+
+        if options['update_golden']:
+            engines = [target for target in targets if target in ReusableLoanCalculator.ENGINES]
+            calculator.write_golden(engines)
+            self.stdout.write(f"Recorded the golden outputs of {', '.join(engines)} in {calculator.GOLDEN_PATH}")
+        elif not options['skip_golden']:
+            mismatches = calculator.check_golden(calculator.load_json(calculator.GOLDEN_PATH), targets)
+            for mismatch in mismatches:
+                self.stderr.write(f"MISMATCH {mismatch}")
+            if mismatches:
+                failures.append(f"{len(mismatches)} outputs differ from the golden outputs")
+            else:
+                self.stdout.write("All outputs match the golden outputs.")
+
+        results = calculator.run(targets, repeat=options['repeat'])
+        self.stdout.write(f"{'case':<50} {'ms':>10} {'peak KiB':>10}")
+        for key, result in results.items():
+            self.stdout.write(f"{key:<50} {result['seconds'] * 1000:>10.3f} {result['peak_bytes'] / 1024:>10.1f}")
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved the baseline to {options['save_baseline']}")
+
+        if options['baseline']:
+            slower = calculator.regressions(results, calculator.load_json(options['baseline']),
+                                            options['threshold'])
+            for key, before, after in slower:
+                self.stderr.write(f"SLOWER {key}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms")
+            if slower:
+                failures.append(f"{len(slower)} cases are more than {options['threshold']:.0%} slower than the baseline")
+
+        if failures:
+            raise CommandError('; '.join(failures))
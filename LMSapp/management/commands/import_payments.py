@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from ... import payment_imports
+from ...parsers import CSVParser, NDJSONParser
+
+PARSERS = {'csv': CSVParser, 'ndjson': NDJSONParser}
+
+
+# Posts a bank payment file and prints one NDJSON result per line, e.g.
+#   python manage.py import_payments payments-2025-01-31.csv > results.ndjson
+class Command(BaseCommand):
+    help = "Post a CSV or NDJSON file of loan repayments in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Payment file; the format is taken from its .csv or .ndjson extension.")
+        parser.add_argument('--format', choices=sorted(PARSERS), help="File format, overriding the extension.")
+        parser.add_argument('--encoding', default='utf-8', help="File encoding.")
+        parser.add_argument('--chunk-size', type=int, help="Lines posted per transaction.")
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in PARSERS:
+            raise CommandError(f"Unknown payment file format '{file_format}'; use --format.")
+
+        renderer = JSONRenderer()
+        counts = {'result': 0, 'errors': 0}
+        with open(options['path'], 'rb') as stream:
+            items = PARSERS[file_format]().parse(stream, parser_context={'encoding': options['encoding']})
+            try:
+                for line in payment_imports.import_payments(items, options['chunk_size']):
+                    counts['result' if 'result' in line else 'errors'] += 1
+                    self.stdout.write(renderer.render(line).decode())
+            except ValueError as error:
+                raise CommandError(str(error))
+
+        self.stderr.write(f"Posted {counts['result']} payments, {counts['errors']} lines rejected.")
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from ... import eod
+
+
+# Runs the end-of-day stages over id-range shards of the loan book, or resumes the date's unfinished run, e.g.
+#   python manage.py run_eod --date 2025-01-31 --shards 8 --workers 4
+class Command(BaseCommand):
+    help = "Run the end-of-day jobs in parallel over shards of the loan book."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Business date (YYYY-MM-DD); defaults to today.")
+        parser.add_argument('--shards', type=int, help="Number of loan account id-range shards.")
+        parser.add_argument('--workers', type=int, help="Worker processes of the local executor.")
+        parser.add_argument('--executor', choices=('celery', 'local'), help="Where the shards run.")
+
+    def handle(self, *args, **options):
+        business_date = parse_date(options['date']) if options['date'] else timezone.now().date()
+        if business_date is None:
+            raise CommandError(f"Invalid business date '{options['date']}'.")
+
+        result = eod.run_end_of_day(business_date, options['shards'], options['executor'], options['workers'])
+        if not isinstance(result, dict):
+            self.stdout.write(f"Queued the end-of-day run for {business_date}: {result}")
+            return
+
+        self.stdout.write(json.dumps(result, indent=2))
+        if result['status'] != 'completed':
+            failed = sum(len(stage['failed']) for stage in result['stages'])
+            raise CommandError(f"{failed} shards of end-of-day run {result['run_id']} failed; "
+                               f"run the command again to resume it.")
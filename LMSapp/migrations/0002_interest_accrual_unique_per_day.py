@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='loaninterestaccrual',
+            constraint=models.UniqueConstraint(fields=('loan_account', 'accrual_date'), name='unique_interest_accrual_per_day'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0002_interest_accrual_unique_per_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EODRun',
+            fields=[
+                ('run_id', models.AutoField(primary_key=True, serialize=False)),
+                ('business_date', models.DateField(unique=True)),
+                ('shard_count', models.IntegerField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('summary', models.JSONField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EODCheckpoint',
+            fields=[
+                ('checkpoint_id', models.AutoField(primary_key=True, serialize=False)),
+                ('stage', models.CharField(max_length=50)),
+                ('after_id', models.IntegerField()),
+                ('upto_id', models.IntegerField()),
+                ('last_processed_id', models.IntegerField(blank=True, null=True)),
+                ('counts', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='LMSapp.eodrun')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='eodcheckpoint',
+            constraint=models.UniqueConstraint(fields=('run', 'stage', 'after_id'), name='unique_eod_checkpoint_per_shard'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0003_eod_run_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dueregister',
+            index=models.Index(fields=['loan_account', 'is_paid', 'due_date'], name='due_register_unpaid_idx'),
+        ),
+    ]
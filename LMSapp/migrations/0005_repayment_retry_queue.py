@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0004_due_register_unpaid_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repaymenteodretry',
+            name='try_count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='repaymenteodretry',
+            index=models.Index(fields=['retry_date'], name='repayment_retry_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='repaymenteodretry',
+            constraint=models.UniqueConstraint(fields=('loan_account',), name='unique_repayment_retry_per_account'),
+        ),
+    ]
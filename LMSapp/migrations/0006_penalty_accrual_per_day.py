@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0005_repayment_retry_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='repaymentschedule',
+            index=models.Index(fields=['loan_application', 'status', 'due_date'], name='repayment_schedule_overdue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='loanpenaltiesaccrual',
+            constraint=models.UniqueConstraint(fields=('loan_account', 'penalty_date'), name='unique_penalty_accrual_per_day'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0006_penalty_accrual_per_day'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pastduerecord',
+            name='pd_bucket',
+            field=models.CharField(choices=[('0-30 Days', '0-30 Days'), ('31-60 Days', '31-60 Days'), ('61-90 Days', '61-90 Days'), ('Above 90 Days', 'Above 90 Days')], default='0-30 Days', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='pastduerecord',
+            name='days_overdue',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='pastduerecord',
+            index=models.Index(fields=['pd_bucket', 'overdue_date'], name='pd_record_aging_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0007_past_due_record_aging'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pastduerecord',
+            index=models.Index(fields=['repayment_schedule_id'], name='pd_record_schedule_idx'),
+        ),
+    ]
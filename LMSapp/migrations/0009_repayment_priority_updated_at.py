@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0008_past_due_record_schedule_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='repaymentpriority',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0009_repayment_priority_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanAccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['debit_account', 'entry_date'], name='ledger_debit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['credit_account', 'entry_date'], name='ledger_credit_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['entry_date'], name='ledger_entry_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='loanaccountbalancesnapshot',
+            name='loan_account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='LMSapp.loanaccount'),
+        ),
+        migrations.AddField(
+            model_name='accountbalancesnapshot',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='LMSapp.account'),
+        ),
+        migrations.AddConstraint(
+            model_name='loanaccountbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('loan_account', 'snapshot_date'), name='unique_loan_account_snapshot_per_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='accountbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('account', 'snapshot_date'), name='unique_account_snapshot_per_day'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# GL accounts the posting engine needs, one per account type of postings.LEDGER_ROLES, as
+# (account_type, account_name, general_ledger_no). Interest and penalty income share the internal account.
+LEDGER_ACCOUNTS = [
+    ('loan', 'Loans', 1100),
+    ('interest_accrual', 'Interest Receivable', 1200),
+    ('penalty_accrual', 'Penalty Receivable', 1300),
+    ('repayment', 'Repayments', 1400),
+    ('disbursement', 'Disbursements', 1500),
+    ('internal_suspense', 'Advance Payments', 2100),
+    ('internal', 'Interest and Penalty Income', 4100),
+]
+
+
+# Creates the GL accounts of the types that have none yet; existing accounts are left as they are
+def seed_ledger_accounts(apps, schema_editor):
+    Account = apps.get_model('LMSapp', 'Account')
+    for account_type, account_name, general_ledger_no in LEDGER_ACCOUNTS:
+        if Account.objects.filter(account_type=account_type).exists():
+            continue
+        account_number = f'GL{general_ledger_no:014d}'
+        if Account.objects.filter(account_number=account_number).exists():
+            continue
+        Account.objects.create(account_name=account_name, account_type=account_type,
+                               general_ledger_no=general_ledger_no, account_number=account_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0010_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_ledger_accounts, migrations.RunPython.noop),
+    ]
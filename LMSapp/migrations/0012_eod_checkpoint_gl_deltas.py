@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0011_seed_ledger_accounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eodcheckpoint',
+            name='gl_deltas',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:23
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+import django.utils.timezone
+
+
+# Rows posted before value dates count on the day they were posted. The snapshots split days by that posting time,
+# so they are dropped; balances are worked back from the current ones until the next EOD run snapshots them again.
+def backfill_value_dates(apps, schema_editor):
+    apps.get_model('LMSapp', 'Transaction').objects.update(value_date=TruncDate('transaction_date'))
+    apps.get_model('LMSapp', 'Ledger').objects.update(value_date=TruncDate('entry_date'))
+    apps.get_model('LMSapp', 'AccountBalanceSnapshot').objects.all().delete()
+    apps.get_model('LMSapp', 'LoanAccountBalanceSnapshot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0012_eod_checkpoint_gl_deltas'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ledger',
+            name='ledger_debit_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ledger',
+            name='ledger_credit_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ledger',
+            name='ledger_entry_date_idx',
+        ),
+        migrations.AddField(
+            model_name='ledger',
+            name='value_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='value_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['debit_account', 'value_date'], name='ledger_debit_value_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['credit_account', 'value_date'], name='ledger_credit_value_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['value_date'], name='ledger_value_date_idx'),
+        ),
+        migrations.RunPython(backfill_value_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:51
+
+from django.db import migrations, models
+from django.db.models import F
+
+WORKFLOW_STATUSES = ('0-30 Days', '31-60 Days', '61-90 Days', 'Above 90 Days')
+
+
+# The PD actions job used to write the workflow status into status. Those records are open ones: they get their
+# workflow status back and become Active again. Every other record's workflow starts at its bucket.
+def split_workflow_status(apps, schema_editor):
+    PastDueRecord = apps.get_model('LMSapp', 'PastDueRecord')
+    PastDueRecord.objects.exclude(status__in=WORKFLOW_STATUSES).update(workflow_status=F('pd_bucket'))
+    PastDueRecord.objects.filter(status__in=WORKFLOW_STATUSES).update(workflow_status=F('status'), status='Active')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LMSapp', '0013_ledger_value_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eodcheckpoint',
+            name='last_row_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pastduerecord',
+            name='workflow_status',
+            field=models.CharField(choices=[('0-30 Days', '0-30 Days'), ('31-60 Days', '31-60 Days'), ('61-90 Days', '61-90 Days'), ('Above 90 Days', 'Above 90 Days')], default='0-30 Days', max_length=50),
+        ),
+        migrations.RunPython(split_workflow_status, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,15 @@
 import string
 from datetime import timedelta
 import random
-from decimal import Decimal, getcontext
-from django.db import models
+from decimal import Decimal
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from functools import lru_cache
+from django.utils.dateparse import parse_date
+from django.utils.module_loading import import_string
+from . import calendars, schedule_engine
 
 class Account(models.Model):
     ACCOUNT_TYPES = [
@@ -61,6 +67,7 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=16, decimal_places=2)
     description = models.TextField(null=True, blank=True)
     transaction_date = models.DateTimeField(auto_now_add=True)
+    value_date = models.DateField(default=timezone.localdate)  # Business date the transaction counts on
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
@@ -94,6 +101,12 @@ class DueRegister(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # The EOD repayment collection looks up each loan's unpaid items due by the business date
+        indexes = [
+            models.Index(fields=['loan_account', 'is_paid', 'due_date'], name='due_register_unpaid_idx'),
+        ]
+
 
 class PaidItem(models.Model):
     due_register = models.OneToOneField(DueRegister, on_delete=models.CASCADE)
@@ -108,7 +121,7 @@ class RepaymentPriority(models.Model):
     loan_type = models.CharField(max_length=50)
     priority_order = models.JSONField()  # Example: {"1": "interest", "2": "penalty", "3": "principal"}
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Compiled waterfalls are recompiled when it moves
 
 
 class Company(models.Model):
@@ -208,14 +221,19 @@ class LoanApplication(models.Model):
             raise ValueError("Invalid term_metric value.")
         return int(tenure)
 
+    # Approves the application and writes its repayment schedule in one transaction.
+    # Returns the number of schedule rows written, 0 when the application was already approved.
     def approve_application(self):
+        self.schedules_created = 0
         if self.status != 'approved':
             # Calculate repayment start date
             self.calculate_repayment_start_date()
 
-            self.status = 'approved'
-            self.save()
-            self.generate_repayment_schedule()
+            with transaction.atomic():
+                self.status = 'approved'
+                self.save()
+                self.schedules_created = self.generate_repayment_schedule()
+        return self.schedules_created
 
     def generate_repayment_schedule(self):
         tenure_in_months = self.calculate_tenure()
@@ -236,20 +254,9 @@ class LoanApplication(models.Model):
             repayment_start_date=self.repayment_start_date  # Use the calculated repayment start date
         )
 
-        # Calculate the repayment schedule
-        repayment_plan = calculator.calculate_repayment_schedule()
-
-        # Save each schedule entry in the LoanSchedule model
-        for entry in repayment_plan['repayment_plan']:
-            LoanSchedule.objects.create(
-                application=self,
-                installment_number=entry['period'],
-                due_date=entry['due_date'],
-                principal_amount=entry['principal'],
-                interest_amount=entry['interest'],
-                total_amount=entry['installment'],
-                status='pending'
-            )
+        # Calculate the repayment schedule and save it in bulk
+        schedule = calculator.calculate_schedule()
+        return LoanSchedule.bulk_create_from_schedule(self, schedule)
 
 
 class LoanSchedule(models.Model):
@@ -264,6 +271,77 @@ class LoanSchedule(models.Model):
     class Meta:
         ordering = ['due_date']
 
+    # Fields written from a calculated schedule row
+    SCHEDULE_FIELDS = [
+        'installment_number', 'due_date', 'principal_amount', 'interest_amount', 'total_amount', 'status'
+    ]
+
+    # Saves the rows of a calculated schedule with bulk inserts inside one transaction instead of one INSERT per
+    # installment. Returns the number of rows written.
+    @classmethod
+    def bulk_create_from_schedule(cls, application, schedule, batch_size=None, first_installment_number=1):
+        batch_size = batch_size or getattr(settings, 'LOAN_SCHEDULE_BULK_BATCH_SIZE', 1000)
+        rows = [
+            cls(application=application, **cls.schedule_values(row, first_installment_number))
+            for row in schedule
+        ]
+        with transaction.atomic():
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+
+    # Rewrites the `existing` rows to match a newly calculated schedule with the fewest writes: each calculated row is
+    # matched to the existing row with its installment number, rows that differ are bulk updated, missing ones bulk
+    # inserted and surplus ones deleted, all in one transaction. Paid rows are never rewritten.
+    # Returns the number of rows updated, created and deleted.
+    @classmethod
+    def sync_with_schedule(cls, application, existing, schedule, batch_size=None, first_installment_number=1):
+        batch_size = batch_size or getattr(settings, 'LOAN_SCHEDULE_BULK_BATCH_SIZE', 1000)
+        with transaction.atomic():
+            current = {
+                instance.installment_number: instance
+                for instance in existing.exclude(status='paid').select_for_update().order_by('installment_number')
+            }
+            changed = []
+            created = []
+            for row in schedule:
+                values = cls.schedule_values(row, first_installment_number)
+                instance = current.pop(values['installment_number'], None)
+                if instance is None:
+                    created.append(cls(application=application, **values))
+                elif any(getattr(instance, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(instance, field, value)
+                    changed.append(instance)
+            surplus = [instance.pk for instance in current.values()]
+
+            if changed:
+                cls.objects.bulk_update(changed, cls.SCHEDULE_FIELDS, batch_size=batch_size)
+            if created:
+                cls.objects.bulk_create(created, batch_size=batch_size)
+            for start in range(0, len(surplus), batch_size):
+                cls.objects.filter(pk__in=surplus[start:start + batch_size]).delete()
+
+        return {'updated': len(changed), 'created': len(created), 'deleted': len(surplus)}
+
+    @classmethod
+    def schedule_values(cls, row, first_installment_number=1):
+        return {
+            'installment_number': first_installment_number + row.period - 1,
+            'due_date': row.due_date,
+            'principal_amount': row.principal,
+            'interest_amount': row.interest,
+            'total_amount': row.installment,
+            'status': 'pending',
+        }
+
+    # Principal still to be repaid from a date on, summed by the database
+    @classmethod
+    def remaining_principal(cls, application, from_date):
+        total = cls.objects.filter(application=application, due_date__gte=from_date, status='pending').aggregate(
+            total=models.Sum('principal_amount'))['total']
+        # Some backends (SQLite) sum decimals with extra digits
+        return total.quantize(Decimal('0.01')) if total is not None else Decimal('0.00')
+
 
 class DocumentType(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -389,6 +467,12 @@ class RepaymentSchedule(models.Model):
     status = models.CharField(max_length=20, choices=[('pending', 'Pending'), ('paid', 'Paid')], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # The EOD penalty accrual looks up each loan's pending installments past their due date
+        indexes = [
+            models.Index(fields=['loan_application', 'status', 'due_date'], name='repayment_schedule_overdue_idx'),
+        ]
+
 
 class Reminder(models.Model):
     reminder_id = models.AutoField(primary_key=True)
@@ -576,11 +660,47 @@ class Ledger(models.Model):
     credit_account = models.ForeignKey(Account, related_name='credit_entries', on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=16, decimal_places=2)
     entry_date = models.DateTimeField(auto_now_add=True)
+    value_date = models.DateField(default=timezone.localdate)  # Business date of the transaction, see balances.py
+
+    class Meta:
+        # Balances as of a date add up an account's rows of the days since its last snapshot
+        indexes = [
+            models.Index(fields=['debit_account', 'value_date'], name='ledger_debit_value_date_idx'),
+            models.Index(fields=['credit_account', 'value_date'], name='ledger_credit_value_date_idx'),
+            models.Index(fields=['value_date'], name='ledger_value_date_idx'),
+        ]
 
     def __str__(self):
         return f"Ledger Entry: {self.debit_account.name} -> {self.credit_account.name} : {self.amount}"
 
 
+# Balance of an Account at the end of a business day, written by the EOD balance snapshot stage
+class AccountBalanceSnapshot(models.Model):
+    account = models.ForeignKey(Account, related_name='balance_snapshots', on_delete=models.CASCADE)
+    snapshot_date = models.DateField()
+    balance = models.DecimalField(max_digits=16, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'snapshot_date'], name='unique_account_snapshot_per_day'),
+        ]
+
+
+# Balance of a LoanAccount at the end of a business day, written by the EOD balance snapshot stage
+class LoanAccountBalanceSnapshot(models.Model):
+    loan_account = models.ForeignKey(LoanAccount, related_name='balance_snapshots', on_delete=models.CASCADE)
+    snapshot_date = models.DateField()
+    balance = models.DecimalField(max_digits=16, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['loan_account', 'snapshot_date'],
+                                    name='unique_loan_account_snapshot_per_day'),
+        ]
+
+
 class LoanModification(models.Model):
     modification_id = models.AutoField(primary_key=True)
     loan_application = models.ForeignKey(LoanApplication, on_delete=models.CASCADE, related_name='modifications')
@@ -666,32 +786,40 @@ class LoanModification(models.Model):
             term_metric=self.loan_application.term_metric,
             frequency=self.loan_application.frequency,
             repayment_option=self.loan_application.repayment_option,
-            interest_basis=self.loan_application.interest_basis,
+            interest_basis=getattr(self.loan_application, 'interest_basis', None) or '365',
             status=self.loan_application.status,
             created_at=self.loan_application.created_at,
             updated_at=self.loan_application.updated_at
         )
 
+    # Schedules due on or after this date are the ones a modification recalculates
+    def effective_date(self):
+        return timezone.localdate(self.modification_date) if self.modification_date else timezone.localdate()
+
     def get_remaining_principal(self):
         # Calculate the remaining principal from future schedules
-        future_schedules = LoanSchedule.objects.filter(
-            application=self.loan_application,
-            due_date__gte=models.DateField.auto_now_add
-        ).order_by('due_date')
-
-        return sum(schedule.principal_amount for schedule in future_schedules if schedule.status == 'pending')
-
-    def recalculate_future_schedules(self):
+        return LoanSchedule.remaining_principal(self.loan_application, self.effective_date())
+
+    # Recalculates the schedule from the modification date on. Installments already due or already paid (a paid
+    # installment may fall after the modification date) are kept; the new tail starts after the last of them. In
+    # incremental mode the new tail is matched to the existing rows by installment number and only the rows that
+    # change are written; otherwise every row of the old tail is replaced.
+    # Returns the number of rows updated, created and deleted.
+    def recalculate_future_schedules(self, incremental=None):
+        if incremental is None:
+            incremental = getattr(settings, 'LOAN_MODIFICATION_INCREMENTAL_RECALCULATION', True)
         loan_application = self.loan_application
-        today = models.DateField.auto_now_add
+        today = self.effective_date()
 
-        # Fetch and delete all future schedules
+        # The new installments are numbered on from the ones already due or paid
+        last_installment_number = LoanSchedule.objects.filter(
+            models.Q(due_date__lt=today) | models.Q(status='paid'),
+            application=loan_application
+        ).aggregate(last=models.Max('installment_number'))['last'] or 0
         future_schedules = LoanSchedule.objects.filter(
             application=loan_application,
-            due_date__gte=today
-        ).order_by('due_date')
-
-        future_schedules.delete()
+            installment_number__gt=last_installment_number
+        ).exclude(status='paid')
 
         # Instantiate and use the ReusableLoanCalculator to calculate the new schedule
         calculator = ReusableLoanCalculator(
@@ -702,23 +830,23 @@ class LoanModification(models.Model):
             tenure_type='months',  # Assuming tenure type is always in months for now
             repayment_schedule=loan_application.frequency,
             repayment_mode=loan_application.repayment_option,
-            interest_basis=loan_application.interest_basis or '365',  # Use the modified interest_basis if provided
+            # Use the modified interest_basis if provided
+            interest_basis=getattr(loan_application, 'interest_basis', None) or '365',
             loan_calculation_method='constant_repayment',  # You can map this to a proper method
             repayment_start_date=today  # Continue from today
         )
 
-        repayment_plan = calculator.calculate_repayment_schedule()
+        schedule = calculator.calculate_schedule()
+
+        if incremental:
+            return LoanSchedule.sync_with_schedule(loan_application, future_schedules, schedule,
+                                                   first_installment_number=last_installment_number + 1)
 
-        for entry in repayment_plan['repayment_plan']:
-            LoanSchedule.objects.create(
-                application=loan_application,
-                installment_number=entry['period'],
-                due_date=entry['due_date'],
-                principal_amount=entry['principal'],
-                interest_amount=entry['interest'],
-                total_amount=entry['installment'],
-                status='pending'
-            )
+        with transaction.atomic():
+            deleted, _ = future_schedules.delete()
+            created = LoanSchedule.bulk_create_from_schedule(loan_application, schedule,
+                                                             first_installment_number=last_installment_number + 1)
+        return {'updated': 0, 'created': created, 'deleted': deleted}
 
 
 class LoanApplicationHistory(models.Model):
@@ -775,6 +903,12 @@ class LoanInterestAccrual(models.Model):
     interest_amount = models.DecimalField(max_digits=16, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One accrual per account and day, so the EOD accrual can be rerun safely
+        constraints = [
+            models.UniqueConstraint(fields=['loan_account', 'accrual_date'], name='unique_interest_accrual_per_day'),
+        ]
+
 
 class LoanPenaltiesAccrual(models.Model):
     loan_account = models.ForeignKey(LoanAccount, on_delete=models.CASCADE)
@@ -782,6 +916,12 @@ class LoanPenaltiesAccrual(models.Model):
     penalty_amount = models.DecimalField(max_digits=16, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One penalty accrual per account and day, so the EOD penalty accrual can be rerun safely
+        constraints = [
+            models.UniqueConstraint(fields=['loan_account', 'penalty_date'], name='unique_penalty_accrual_per_day'),
+        ]
+
 
 class LoanAccountEntry(models.Model):
     loan_account = models.ForeignKey(LoanAccount, on_delete=models.CASCADE)
@@ -800,12 +940,23 @@ class LoanRepaymentTry(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+# Queue of loan accounts whose repayment collection failed, one per account, retried on retry_date
 class RepaymentEODRetry(models.Model):
     loan_account = models.ForeignKey(LoanAccount, on_delete=models.CASCADE)
-    repayment_schedule_id = models.IntegerField()
+    repayment_schedule_id = models.IntegerField()  # The oldest unpaid due item when the collection failed
     retry_date = models.DateField()
+    try_count = models.IntegerField(default=1)  # Collection attempts made so far
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # The retry cycle reads only the retries that are due, through the retry_date index
+        indexes = [
+            models.Index(fields=['retry_date'], name='repayment_retry_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['loan_account'], name='unique_repayment_retry_per_account'),
+        ]
+
 
 class FailedLoanRepayments(models.Model):
     loan_account = models.ForeignKey(LoanAccount, on_delete=models.CASCADE)
@@ -814,9 +965,77 @@ class FailedLoanRepayments(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+# Ledger of the end-of-day runs, one per business date. A run that crashed is resumed from its checkpoints.
+class EODRun(models.Model):
+    run_id = models.AutoField(primary_key=True)
+    business_date = models.DateField(unique=True)
+    shard_count = models.IntegerField()
+    status = models.CharField(max_length=20, choices=[
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ], default='running')
+    summary = models.JSONField(null=True, blank=True)  # Per-stage totals and failed shards, once the run ends
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"EOD run {self.run_id} for {self.business_date} - {self.status}"
+
+
+# Progress of one stage of an EOD run on one shard, the loan account id range (after_id, upto_id].
+# last_processed_id and counts are saved in the same transaction as each batch the stage writes.
+class EODCheckpoint(models.Model):
+    checkpoint_id = models.AutoField(primary_key=True)
+    run = models.ForeignKey(EODRun, on_delete=models.CASCADE, related_name='checkpoints')
+    stage = models.CharField(max_length=50)
+    after_id = models.IntegerField()
+    upto_id = models.IntegerField()
+    last_processed_id = models.IntegerField(null=True, blank=True)  # Primary key of the stage's last written row
+    # Primary key of the last row the stage takes in, for stages that fix it on their first attempt
+    last_row_id = models.IntegerField(null=True, blank=True)
+    counts = models.JSONField(default=dict)
+    # GL Account balance deltas of the committed batches, {account_id: amount}, until the stage applies them
+    gl_deltas = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ], default='pending')
+    error = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'stage', 'after_id'], name='unique_eod_checkpoint_per_shard'),
+        ]
+
+    def __str__(self):
+        return f"EOD checkpoint {self.stage} ({self.after_id}, {self.upto_id}] - {self.status}"
+
+
+# Business-day calendar due dates are moved onto, from the LOAN_BUSINESS_CALENDAR setting: None for no adjustment,
+# a dict of calendars.HolidayCalendar arguments, or the dotted path of a calendars.BusinessCalendar class or instance.
+# Built once per process, so the due-date cache is shared by every loan.
+@lru_cache(maxsize=None)
+def get_business_calendar():
+    config = getattr(settings, 'LOAN_BUSINESS_CALENDAR', None)
+    if config is None:
+        return calendars.NO_ADJUSTMENT
+    if isinstance(config, dict):
+        holidays = [parse_date(day) if isinstance(day, str) else day for day in config.get('holidays', ())]
+        return calendars.HolidayCalendar(**dict(config, holidays=holidays))
+    business_calendar = import_string(config)
+    return business_calendar() if isinstance(business_calendar, type) else business_calendar
+
+
+# Django-facing wrapper around schedule_engine; the engine defaults to the LOAN_CALCULATOR_ENGINE setting
 class ReusableLoanCalculator:
+    # 'decimal' walks the schedule period by period, 'vectorized' computes it as NumPy arrays
+    ENGINES = schedule_engine.ENGINES
+
     def __init__(self, loan_amount, interest_rate, tenure, tenure_type, repayment_schedule, repayment_mode,
-                 interest_basis, loan_calculation_method, repayment_start_date):
+                 interest_basis, loan_calculation_method, repayment_start_date, engine=None):
         self.loan_amount = loan_amount
         self.interest_rate = interest_rate
         self.tenure = tenure
@@ -826,240 +1045,109 @@ class ReusableLoanCalculator:
         self.interest_basis = interest_basis
         self.loan_calculation_method = loan_calculation_method
         self.repayment_start_date = repayment_start_date
+        self.engine = engine or getattr(settings, 'LOAN_CALCULATOR_ENGINE', 'decimal')
 
-        getcontext().prec = 10  # Set precision for decimal operations
-
-    def calculate_repayment_schedule(self):
-        loan_amount = self.loan_amount
-        interest_rate = self.interest_rate
-        tenure = self.tenure
-        tenure_type = self.tenure_type
-        repayment_schedule = self.repayment_schedule
-        repayment_mode = self.repayment_mode
-        interest_basis = self.interest_basis
-        loan_calculation_method = self.loan_calculation_method
-        repayment_start_date = self.repayment_start_date
-
-        # Determine the number of periods based on the repayment schedule
-        periods, interval = self._determine_periods_and_interval(tenure, tenure_type, repayment_schedule)
-
-        # Adjust interest rate based on the interest basis (365 or other)
-        period_interest_rate = self._adjust_interest_rate(interest_rate, interest_basis, periods)
-
-        # Initialize totals
-        total_principal = Decimal(0)
-        total_interest = Decimal(0)
-
-        # Initialize repayment plan and remaining principal
-        repayment_plan = []
-        remaining_principal = loan_amount
-
-        # Implement loan calculation methods
-        repayment_plan, total_principal, total_interest = self._calculate_loan_repayments(
-            periods, interval, interest_rate, remaining_principal, period_interest_rate, repayment_start_date,
-            loan_amount, total_principal, total_interest, loan_calculation_method
+    # Returns a schedule_engine.Schedule; the engine can be chosen per call to run both side by side
+    def calculate_schedule(self, engine=None):
+        return schedule_engine.calculate_schedule(
+            loan_amount=self.loan_amount,
+            interest_rate=self.interest_rate,
+            tenure=self.tenure,
+            tenure_type=self.tenure_type,
+            repayment_schedule=self.repayment_schedule,
+            interest_basis=self.interest_basis,
+            loan_calculation_method=self.loan_calculation_method,
+            repayment_start_date=self.repayment_start_date,
+            engine=engine or self.engine,
+            business_calendar=get_business_calendar(),
         )
 
-        return {
-            'repayment_plan': repayment_plan,
-            'total_principal': round(total_principal, 2),
-            'total_interest': round(total_interest, 2),
-            'total_amount_to_repay': round(total_principal + total_interest, 2)
-        }
+    def calculate_repayment_schedule(self, engine=None):
+        return self.calculate_schedule(engine).as_dict()
 
-    def _determine_periods_and_interval(self, tenure, tenure_type, repayment_schedule):
-        if repayment_schedule == 'daily':
-            periods = tenure if tenure_type == 'days' else tenure * 365 // {'weeks': 7, 'months': 30, 'years': 365}[
-                tenure_type]
-            interval = timedelta(days=1)
-        elif repayment_schedule == 'weekly':
-            periods = tenure if tenure_type == 'weeks' else tenure * 52 // {'days': 1 / 7, 'months': 4, 'years': 52}[
-                tenure_type]
-            interval = timedelta(weeks=1)
-        elif repayment_schedule == 'monthly':
-            periods = tenure if tenure_type == 'months' else tenure * 12 // {'days': 1 / 30, 'weeks': 4, 'years': 12}[
-                tenure_type]
-            interval = timedelta(days=30)  # Approximation for a month
-        elif repayment_schedule == 'quarterly':
-            periods = tenure * 4 // {'months': 3, 'years': 4}[tenure_type]
-            interval = timedelta(days=90)
-        elif repayment_schedule == 'halfyearly':
-            periods = tenure * 2 // {'months': 6, 'years': 2}[tenure_type]
-            interval = timedelta(days=182)
-        elif repayment_schedule == 'annually':
-            periods = tenure if tenure_type == 'years' else tenure * 1 // \
-                                                            {'days': 1 / 365, 'weeks': 1 / 52, 'months': 1 / 12}[
-                                                                tenure_type]
-            interval = timedelta(days=365)
-        else:  # one_time
-            periods = 1
-            interval = None  # No interval as it's a one-time payment
-
-        return periods, interval
-
-    def _adjust_interest_rate(self, interest_rate, interest_basis, periods):
-        if interest_basis == '365':
-            return interest_rate / Decimal(100) / Decimal(365 / periods)
-        else:
-            return interest_rate / Decimal(100) / Decimal(365 / periods)  # Placeholder for other basis
-
-    def _calculate_loan_repayments(self, periods, interval, interest_rate, remaining_principal, period_interest_rate,
-                                   repayment_start_date, loan_amount, total_principal, total_interest,
-                                   loan_calculation_method):
-        repayment_plan = []
-
-        if loan_calculation_method == 'reducing_balance':
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = loan_amount / periods
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'flat_rate':
-            fixed_interest = loan_amount * interest_rate / Decimal(100) * periods / Decimal(12)
-            monthly_payment = (loan_amount + fixed_interest) / periods
-            for period in range(1, periods + 1):
-                interest_payment = fixed_interest / periods
-                principal_payment = loan_amount / periods
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'constant_repayment':
-            monthly_payment = (loan_amount * period_interest_rate) / (1 - (1 + period_interest_rate) ** -periods)
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = monthly_payment - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'simple_interest':
-            interest_payment = loan_amount * interest_rate / Decimal(100) * periods / Decimal(12)
-            for period in range(1, periods + 1):
-                principal_payment = loan_amount / periods
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment / periods, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment / periods
-
-        elif loan_calculation_method == 'compound_interest':
-            compound_factor = (1 + period_interest_rate) ** periods
-            total_amount = loan_amount * compound_factor
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = total_amount / periods - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'graduated_repayment':
-            initial_payment = loan_amount / periods
-            increment_factor = Decimal(1.05)  # 5% increment per period
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = initial_payment * (increment_factor ** (period - 1))
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'balloon_payment':
-            balloon_amount = loan_amount * Decimal(0.5)  # 50% as balloon payment
-            monthly_payment = (loan_amount - balloon_amount) / (periods - 1)
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = monthly_payment - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self._build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-            # Balloon payment in the last period
-            repayment_plan.append(
-                self._build_repayment_entry(periods, balloon_amount, remaining_principal * period_interest_rate,
-                                            repayment_start_date + (interval * (periods - 1))))
-            total_principal += balloon_amount
-            total_interest += remaining_principal * period_interest_rate
-
-        elif loan_calculation_method == 'bullet_repayment':
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self._build_repayment_entry(period, 0, interest_payment, due_date))
-                total_interest += interest_payment
-
-            # Principal paid in the last period
-            repayment_plan.append(
-                self._build_repayment_entry(periods, loan_amount, remaining_principal * period_interest_rate,
-                                            repayment_start_date + (interval * (periods - 1))))
-            total_principal += loan_amount
-            total_interest += remaining_principal * period_interest_rate
-
-        elif loan_calculation_method == 'interest_first':
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self._build_repayment_entry(period, 0, interest_payment, due_date))
-                total_interest += interest_payment
-
-            # Principal paid in the last period
-            repayment_plan.append(
-                self._build_repayment_entry(periods, loan_amount, 0, repayment_start_date + (interval * (periods - 1))))
-            total_principal += loan_amount
-
-        return repayment_plan, total_principal, total_interest
-
-    def _build_repayment_entry(self, period, principal, interest, due_date):
-        return {
-            'period': period,
-            'principal': round(principal, 2),
-            'interest': round(interest, 2),
-            'installment': round(principal + interest, 2),
-            'due_date': due_date.strftime('%Y-%m-%d') if due_date else None,
-        }
+    # Returns a schedule_engine.ScheduleStream producing the rows lazily, optionally only the offset/limit window
+    def iter_schedule(self, offset=0, limit=None):
+        return schedule_engine.ScheduleStream(
+            loan_amount=self.loan_amount,
+            interest_rate=self.interest_rate,
+            tenure=self.tenure,
+            tenure_type=self.tenure_type,
+            repayment_schedule=self.repayment_schedule,
+            interest_basis=self.interest_basis,
+            loan_calculation_method=self.loan_calculation_method,
+            repayment_start_date=self.repayment_start_date,
+            offset=offset,
+            limit=limit,
+            business_calendar=get_business_calendar(),
+        )
+
+    # Returns a schedule_engine.ScheduleSummary with the totals only, without building the schedule rows
+    def calculate_summary(self):
+        return schedule_engine.calculate_summary(
+            loan_amount=self.loan_amount,
+            interest_rate=self.interest_rate,
+            tenure=self.tenure,
+            tenure_type=self.tenure_type,
+            repayment_schedule=self.repayment_schedule,
+            interest_basis=self.interest_basis,
+            loan_calculation_method=self.loan_calculation_method,
+        )
 
 
 # past due process ------------
 
+class PastDueRecordQuerySet(models.QuerySet):
+
+    # Annotates how long each record has been overdue on as_of, as a timedelta in `age`
+    def with_age(self, as_of):
+        return self.annotate(age=models.ExpressionWrapper(
+            models.Value(as_of, output_field=models.DateField()) - models.F('overdue_date'),
+            output_field=models.DurationField()))
+
+
 class PastDueRecord(models.Model):
+    # Aging buckets by the day overdue they start on; they are the PDActionWorkflowConfig statuses
+    BUCKETS = ((0, '0-30 Days'), (31, '31-60 Days'), (61, '61-90 Days'), (91, 'Above 90 Days'))
+
     pd_record_id = models.AutoField(primary_key=True)
     loan_account_id = models.IntegerField()
     repayment_schedule_id = models.IntegerField()
     overdue_amount = models.DecimalField(max_digits=12, decimal_places=2)
     overdue_date = models.DateField()
-    days_overdue = models.IntegerField()
+    days_overdue = models.IntegerField(default=0)  # Not maintained, see days_overdue_on()
+    pd_bucket = models.CharField(max_length=50, choices=[(bucket, bucket) for _, bucket in BUCKETS],
+                                 default='0-30 Days')  # Moved forward by the EOD aging job
     status = models.CharField(max_length=50)  # Active, Resolved, Written-off
+    # PD action workflow status the record has reached, moved forward by the EOD actions job
+    workflow_status = models.CharField(max_length=50, choices=[(bucket, bucket) for _, bucket in BUCKETS],
+                                       default='0-30 Days')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PastDueRecordQuerySet.as_manager()
+
+    class Meta:
+        # The aging job moves the records of a bucket whose overdue_date crossed the next boundary
+        indexes = [
+            models.Index(fields=['pd_bucket', 'overdue_date'], name='pd_record_aging_idx'),
+            models.Index(fields=['repayment_schedule_id'], name='pd_record_schedule_idx'),
+        ]
+
     def __str__(self):
         return f"Past Due Record {self.pd_record_id} for Loan Account {self.loan_account_id}"
 
+    # Days overdue are derived from overdue_date rather than stored, so they never go stale
+    def days_overdue_on(self, day):
+        return (day - self.overdue_date).days
+
+    @classmethod
+    def bucket_for(cls, days_overdue):
+        bucket = cls.BUCKETS[0][1]
+        for start, name in cls.BUCKETS:
+            if days_overdue >= start:
+                bucket = name
+        return bucket
+
 
 class PDActionWorkflowConfig(models.Model):
     # Define the choices for the current PD status
@@ -0,0 +1,42 @@
+import csv
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+# Parses newline-delimited JSON lazily, one object per line, so large uploads are never held in memory.
+# A line that is not valid JSON is yielded as a ParseError, letting the view report it and carry on.
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self.iter_objects(stream, encoding)
+
+    def iter_objects(self, stream, encoding):
+        for line in stream:
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield ParseError(f'NDJSON parse error - {error}')
+
+
+# Parses CSV with a header line lazily, one dict per row. Empty cells and cells beyond the header are left out, so
+# optional columns can be blank.
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self.iter_rows(stream, encoding)
+
+    def iter_rows(self, stream, encoding):
+        for row in csv.DictReader(line.decode(encoding) for line in stream):
+            yield {column: value for column, value in row.items() if column is not None and value not in ('', None)}
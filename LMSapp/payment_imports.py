@@ -0,0 +1,65 @@
+import logging
+from itertools import islice
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError, ValidationError
+
+from . import repayments
+from .serializers import PaymentImportLineSerializer
+
+logger = logging.getLogger(__name__)
+
+# Bulk import of the payment files received from the bank. Lines are read lazily, PAYMENT_IMPORT_CHUNK_SIZE at a time,
+# and every chunk is validated and posted in one transaction by repayments.post_repayments. One result is produced per
+# line, in file order: {"index": ..., "result": {...}} or {"index": ..., "errors": {...}}. A chunk that fails to post
+# is rolled back as a whole and every one of its lines gets an error, so the caller knows exactly what was applied.
+
+
+def get_chunk_size(chunk_size=None):
+    return chunk_size or getattr(settings, 'PAYMENT_IMPORT_CHUNK_SIZE', 1000)
+
+
+# items are the parsed lines (dicts, or ParseErrors for lines that could not be parsed)
+def import_payments(items, chunk_size=None):
+    ledger = repayments.get_repayment_ledger()
+    chunk_size = get_chunk_size(chunk_size)
+    items = iter(items)
+    index = 0
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            break
+        try:
+            lines = import_chunk(chunk, ledger)
+        except Exception as error:
+            logger.exception("Payment import lines %d to %d failed", index, index + len(chunk) - 1)
+            lines = failed_chunk(chunk, error)
+        for line in lines:
+            line['index'] += index
+            yield line
+        index += len(chunk)
+
+
+def import_chunk(chunk, ledger):
+    # One serializer validates the whole chunk, which avoids rebuilding its fields for every line
+    serializer = PaymentImportLineSerializer()
+    lines = [None] * len(chunk)
+    valid = []
+    for position, item in enumerate(chunk):
+        if isinstance(item, ParseError):
+            lines[position] = {'index': position, 'errors': {'non_field_errors': [str(item.detail)]}}
+            continue
+        try:
+            valid.append((position, serializer.run_validation(item)))
+        except ValidationError as error:
+            lines[position] = {'index': position, 'errors': error.detail}
+
+    for position, result in repayments.post_repayments(valid, ledger).items():
+        lines[position] = {'index': position, **result}
+    return lines
+
+
+# Error lines of a chunk whose transaction was rolled back: none of its lines were posted
+def failed_chunk(chunk, error):
+    message = f"Not posted, the chunk of lines failed: {type(error).__name__}: {error}"
+    return [{'index': position, 'errors': {'non_field_errors': [message]}} for position in range(len(chunk))]
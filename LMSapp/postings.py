@@ -0,0 +1,205 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import (
+    Account, AccountBalanceSnapshot, Ledger, LoanAccount, LoanAccountBalanceSnapshot, LoanAccountEntry, Transaction,
+)
+
+# Double-entry posting engine. Every business event is posted as a Journal of debit and credit legs that must
+# balance. Journals are written in bulk inside one transaction: a Transaction per journal, a Ledger row per pair of
+# debit and credit legs, and the balance deltas applied with one F() UPDATE per model, so that
+# concurrent postings never overwrite each other's balances. A leg on the loans ledger account can name the loan
+# account it belongs to, whose LoanAccount.balance then moves with it. A journal counts on its value date, the
+# business date of the event, whenever it is posted.
+
+# Ledger accounts the engine posts to, by role, with the account type the account is looked up by
+LEDGER_ROLES = {
+    'loans': 'loan',
+    'disbursements': 'disbursement',
+    'repayments': 'repayment',
+    'interest_receivable': 'interest_accrual',
+    'penalty_receivable': 'penalty_accrual',
+    'interest_income': 'internal',
+    'penalty_income': 'internal',
+    'advance_payments': 'internal_suspense',
+}
+
+# Account types whose balance grows with credits; every other balance grows with debits
+CREDIT_NORMAL_TYPES = ('internal_funding', 'personal_customer', 'current_customer', 'business_customer')
+
+Leg = namedtuple('Leg', ['account', 'side', 'amount', 'loan_account_id'])
+
+
+# The Account a role posts to: account_number, else LEDGER_ACCOUNTS[role], else the first Account of its type
+def get_ledger_account(role, account_number=None):
+    account_number = account_number or getattr(settings, 'LEDGER_ACCOUNTS', {}).get(role)
+    accounts = Account.objects.filter(account_type=LEDGER_ROLES[role])
+    if account_number:
+        accounts = accounts.filter(account_number=account_number)
+    account = accounts.order_by('pk').first()
+    if account is None:
+        raise ValueError(f"No {role} ledger account is configured.")
+    return account
+
+
+# Accounts of several roles, e.g. at the start of a batch job
+def get_ledger_accounts(*roles):
+    return {role: get_ledger_account(role) for role in roles}
+
+
+class Journal:
+
+    def __init__(self, description, loan_account_id=None, value_date=None):
+        self.description = description
+        self.loan_account_id = loan_account_id
+        self.value_date = value_date or timezone.localdate()
+        self.legs = []
+
+    # loan_account_id moves that LoanAccount's balance with the leg; only for legs on the loans ledger account.
+    # Zero amounts are left out, so a leg can be added whether or not the event touched it.
+    def debit(self, account, amount, loan_account_id=None):
+        return self.add(account, 'debit', amount, loan_account_id)
+
+    def credit(self, account, amount, loan_account_id=None):
+        return self.add(account, 'credit', amount, loan_account_id)
+
+    def add(self, account, side, amount, loan_account_id=None):
+        if amount < 0:
+            raise ValueError(f"Journal legs cannot be negative: {side} of {amount} on account {account.pk}.")
+        if amount:
+            self.legs.append(Leg(account, side, amount, loan_account_id))
+        return self
+
+    def total(self, side):
+        return sum((leg.amount for leg in self.legs if leg.side == side), Decimal('0.00'))
+
+    def validate(self):
+        debits, credits = self.total('debit'), self.total('credit')
+        if debits != credits:
+            raise ValueError(f"Journal '{self.description}' does not balance: debits {debits}, credits {credits}.")
+
+    # Pairs the debit legs with the credit legs, as (debit_account, credit_account, amount), for the Ledger rows
+    def pairs(self):
+        debits = [[leg.account, leg.amount] for leg in self.legs if leg.side == 'debit']
+        credits = [[leg.account, leg.amount] for leg in self.legs if leg.side == 'credit']
+        pairs = []
+        d = c = 0
+        while d < len(debits) and c < len(credits):
+            amount = min(debits[d][1], credits[c][1])
+            pairs.append((debits[d][0], credits[c][0], amount))
+            debits[d][1] -= amount
+            credits[c][1] -= amount
+            d += not debits[d][1]
+            c += not credits[c][1]
+        return pairs
+
+    # The journal's Transaction, recorded against its first leg
+    def transaction(self):
+        first = self.legs[0]
+        return Transaction(account=first.account, loan_account_id=self.loan_account_id, transaction_type=first.side,
+                           amount=self.total('debit'), description=self.description, value_date=self.value_date)
+
+
+def balance_delta(leg):
+    grows = 'credit' if leg.account.account_type in CREDIT_NORMAL_TYPES else 'debit'
+    return leg.amount if leg.side == grows else -leg.amount
+
+
+# Posts journals atomically; journals without legs are skipped. Returns the Transactions created, in order.
+# With a gl_deltas dict, the GL Account balance deltas are added to it, {account_id: delta}, instead of applied, for
+# a batch job to apply once for all its batches with apply_balance_deltas; the loan account balances always move.
+def post_journals(journals, gl_deltas=None):
+    journals = [journal for journal in journals if journal.legs]
+    for journal in journals:
+        journal.validate()
+    if not journals:
+        return []
+
+    # Balance deltas and the earliest value date posted, per account
+    account_deltas, loan_deltas, account_dates, loan_dates = {}, {}, {}, {}
+    for journal in journals:
+        value_date = journal.value_date
+        for leg in journal.legs:
+            delta = balance_delta(leg)
+            account_id, loan_account_id = leg.account.pk, leg.loan_account_id
+            account_deltas[account_id] = account_deltas.get(account_id, 0) + delta
+            account_dates[account_id] = min(value_date, account_dates.get(account_id, value_date))
+            if loan_account_id is not None:
+                loan_deltas[loan_account_id] = loan_deltas.get(loan_account_id, 0) + delta
+                loan_dates[loan_account_id] = min(value_date, loan_dates.get(loan_account_id, value_date))
+
+    with transaction.atomic():
+        headers = [journal.transaction() for journal in journals]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Transaction.objects.bulk_create(headers)
+        else:
+            for header in headers:
+                header.save()
+        Ledger.objects.bulk_create([
+            Ledger(transaction=header, debit_account=debit_account, credit_account=credit_account, amount=amount,
+                   value_date=journal.value_date)
+            for journal, header in zip(journals, headers)
+            for debit_account, credit_account, amount in journal.pairs()
+        ])
+        if gl_deltas is None:
+            apply_balance_deltas(Account, account_deltas)
+        else:
+            for account_id, delta in account_deltas.items():
+                gl_deltas[account_id] = gl_deltas.get(account_id, 0) + delta
+        apply_balance_deltas(LoanAccount, loan_deltas)
+        drop_stale_snapshots(AccountBalanceSnapshot, 'account_id', account_dates)
+        drop_stale_snapshots(LoanAccountBalanceSnapshot, 'loan_account_id', loan_dates)
+    return headers
+
+
+def post_journal(journal):
+    headers = post_journals([journal])
+    return headers[0] if headers else None
+
+
+# Balance snapshots of the day a journal counts on or later no longer hold once it is posted, as with a backdated
+# payment, so each owner's snapshots from the earliest value date posted to it on are dropped, {owner_id: date};
+# balances as of those days are then read from an earlier snapshot, and the next EOD run snapshots them again.
+# One DELETE, with a condition per distinct date.
+def drop_stale_snapshots(model, owner_field, value_dates):
+    owners_by_date = {}
+    for owner_id, value_date in value_dates.items():
+        owners_by_date.setdefault(value_date, []).append(owner_id)
+    if not owners_by_date:
+        return
+    condition = Q()
+    for value_date, owner_ids in owners_by_date.items():
+        condition |= Q(**{f'{owner_field}__in': owner_ids}, snapshot_date__gte=value_date)
+    model.objects.filter(condition).delete()
+
+
+# Adds deltas, {pk: delta}, to the balance of the rows with one UPDATE. The rows are locked in primary key order
+# first, so concurrent postings to the same accounts always wait for each other in the same order.
+def apply_balance_deltas(model, deltas):
+    pks = sorted(pk for pk, delta in deltas.items() if delta)
+    if not pks:
+        return
+    list(model.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk', flat=True))
+    model.objects.filter(pk__in=pks).update(balance=F('balance') + Case(
+        *[When(pk=pk, then=Value(deltas[pk])) for pk in pks], output_field=model._meta.get_field('balance')))
+
+
+# Posts a completed Disbursement: the loan's balance grows by the amount paid out of the disbursements account.
+# The loan account is opened if the application does not have one yet.
+def post_disbursement(disbursement):
+    ledger = get_ledger_accounts('loans', 'disbursements')
+    description = f'Disbursement {disbursement.pk} to {disbursement.bank_account}'
+    with transaction.atomic():
+        loan_account, _ = LoanAccount.objects.get_or_create(loan_application_id=disbursement.loan_application_id)
+        LoanAccountEntry.objects.create(loan_account=loan_account, entry_type='disbursement',
+                                        amount=disbursement.amount, entry_date=timezone.localdate(),
+                                        description=description)
+        journal = Journal(description, loan_account.pk)
+        journal.debit(ledger['loans'], disbursement.amount, loan_account.pk)
+        journal.credit(ledger['disbursements'], disbursement.amount)
+        return post_journal(journal)
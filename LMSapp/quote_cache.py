@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Memoizes loan calculator quotes. Quote traffic repeats the same product amounts, rates and tenures, so the
+# repayment plan is cached per set of calculator inputs in a bounded, per-process LRU with a TTL. When a Django
+# cache alias is configured, quotes are also shared with the other worker processes through that cache.
+
+# Calculator inputs that determine the repayment plan; repayment_mode does not change it
+KEY_FIELDS = (
+    'loan_amount', 'interest_rate', 'tenure', 'tenure_type', 'repayment_schedule', 'loan_calculation_method',
+    'interest_basis', 'repayment_start_date',
+)
+KEY_PREFIX = 'loan-quote:v1:'
+
+
+class QuoteCache:
+
+    def __init__(self, max_size=1024, ttl=300, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds a quote stays cached; 0 or None keeps it until it is evicted
+        self.backend = backend  # Django cache alias, or None to keep quotes in this process only
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_size=getattr(settings, 'LOAN_CALCULATOR_QUOTE_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'LOAN_CALCULATOR_QUOTE_CACHE_TTL', 300),
+            backend=getattr(settings, 'LOAN_CALCULATOR_QUOTE_CACHE_BACKEND', None),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 or self.backend is not None
+
+    # Normalized key of a set of validated calculator inputs. The engine is part of it, since the engines' rows can
+    # differ by a cent.
+    def make_key(self, validated_data, engine, variant=''):
+        values = [str(validated_data.get(field)) for field in KEY_FIELDS]
+        values += [engine, variant]
+        return KEY_PREFIX + hashlib.sha1('|'.join(values).encode()).hexdigest()
+
+    # Returns the cached quote for the key, or calculates, caches and returns it.
+    # Cached quotes are shared between requests and must not be modified.
+    def get_or_calculate(self, key, calculate):
+        if not self.enabled:
+            return calculate()
+
+        quote = self._get_local(key)
+        if quote is None and self.backend is not None:
+            quote = self._shared_cache().get(key)
+            if quote is not None:
+                self._set_local(key, quote)
+
+        if quote is not None:
+            with self._lock:
+                self.hits += 1
+            return quote
+
+        with self._lock:
+            self.misses += 1
+        quote = calculate()
+        self._set_local(key, quote)
+        if self.backend is not None:
+            self._shared_cache().set(key, quote, timeout=self.ttl or None)
+        return quote
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'backend': self.backend,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _get_local(self, key):
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, quote = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return quote
+
+    def _set_local(self, key, quote):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, quote)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _shared_cache(self):
+        from django.core.cache import caches
+        return caches[self.backend]
+
+
+quote_cache = QuoteCache.from_settings()
@@ -0,0 +1,11 @@
+from rest_framework.renderers import JSONRenderer
+
+
+# Lets views negotiate newline-delimited JSON. Streamed rows are rendered one per line by the view itself;
+# anything else (errors, plain responses) is rendered as a single JSON line.
+class NDJSONRenderer(JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(data, accepted_media_type, renderer_context) + b'\n'
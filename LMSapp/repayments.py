@@ -0,0 +1,458 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import eod, postings
+from .waterfall import DEFAULT_WATERFALL, waterfall_cache
+from .models import (
+    DueRegister, FailedLoanRepayments, LoanAccount, LoanAccountEntry, LoanRepaymentTry, PaidItem, Payment,
+    RepaymentAccount, RepaymentEODRetry, RepaymentSchedule,
+)
+
+logger = logging.getLogger(__name__)
+
+# EOD repayment collection. Loan accounts with DueRegister items falling due on the business date are collected in
+# batches: the funds in their RepaymentAccount are allocated over every unpaid item due by then, in memory, following
+# the loan type's RepaymentPriority, and every batch is written with a handful of bulk statements in one transaction.
+# Accounts left owing are queued in RepaymentEODRetry and collected again with exponential backoff, until they are
+# paid or, after REPAYMENT_MAX_ATTEMPTS attempts, moved to FailedLoanRepayments.
+
+# The general ledger account repayments are posted to: REPAYMENT_ACCOUNT_NUMBER, or the first 'repayment' Account
+def get_repayment_account():
+    return postings.get_ledger_account('repayments', getattr(settings, 'REPAYMENT_ACCOUNT_NUMBER', None))
+
+
+# Ledger accounts of the repayment postings, by posting engine role
+def get_repayment_ledger():
+    ledger = postings.get_ledger_accounts('loans', 'interest_receivable', 'penalty_receivable', 'advance_payments')
+    ledger['repayments'] = get_repayment_account()
+    return ledger
+
+
+# Journal of a repayment: the amount received, split over the principal, interest and penalty it paid and the
+# advance payment it left; advance payments applied later are posted the same way from the 'advance_payments' account
+def repayment_journal(ledger, loan_account_id, description, principal, interest, penalty, advance=Decimal('0.00'),
+                      source='repayments', value_date=None):
+    journal = postings.Journal(description, loan_account_id, value_date)
+    journal.debit(ledger[source], principal + interest + penalty + advance)
+    journal.credit(ledger['loans'], principal, loan_account_id)
+    journal.credit(ledger['interest_receivable'], interest)
+    journal.credit(ledger['penalty_receivable'], penalty)
+    journal.credit(ledger['advance_payments'], advance)
+    return journal
+
+
+# Collects the repayments of every loan account with an item falling due on business_date; accounts waiting for a
+# retry are left to the retry cycle. Returns the number of loans processed and paid in full, of due items paid, and
+# the amount collected.
+def process_due_repayments(business_date, batch_size=None, after_id=None, upto_id=None, checkpoint=None):
+    falling_due = DueRegister.objects.filter(loan_account=OuterRef('pk'), is_paid=False, due_date=business_date)
+    retrying = RepaymentEODRetry.objects.filter(loan_account=OuterRef('pk'))
+    accounts = LoanAccount.objects.filter(Exists(falling_due)).exclude(Exists(retrying))
+    accounts = eod.in_shard(accounts, 'pk', after_id, upto_id)
+    ledger = None
+    waterfalls = waterfall_cache.snapshot()
+
+    result = {'loans': 0, 'paid_in_full': 0, 'items_paid': 0, 'collected': Decimal('0.00')}
+    for rows in eod.iter_batches(accounts, [], eod.get_batch_size(batch_size), eod.resume_after(checkpoint)):
+        ledger = ledger or get_repayment_ledger()
+        account_ids = [row[0] for row in rows]
+        with transaction.atomic():
+            gl_deltas = eod.batch_gl_deltas(checkpoint)
+            batch_result = collect_batch(account_ids, business_date, ledger, waterfalls, gl_deltas=gl_deltas)
+            schedule_retries(unpaid_items(account_ids, business_date), business_date)
+            eod.save_checkpoint(checkpoint, rows[-1][0], batch_result, gl_deltas)
+        for key, value in batch_result.items():
+            result[key] += value
+    return result
+
+
+# Collects one batch of loan accounts; runs inside the batch's transaction. ledger is get_repayment_ledger(); try_counts
+# numbers the attempt per account, the first one by default; gl_deltas is passed on to postings.post_journals.
+def collect_batch(account_ids, business_date, ledger, waterfalls, try_counts=None, gl_deltas=None):
+    try_counts = try_counts or {}
+    # The accounts and their funds stay locked until the batch commits, so a concurrent payment cannot interleave
+    loans = {row[0]: row[1:] for row in LoanAccount.objects.select_for_update(of=('self',)).filter(pk__in=account_ids)
+             .values_list('pk', 'loan_application__loan_type', 'accrued_penalty')}
+    funds = {loan_account_id: (repayment_account_id, balance) for repayment_account_id, loan_account_id, balance
+             in RepaymentAccount.objects.select_for_update().filter(loan_account_id__in=account_ids)
+             .values_list('pk', 'loan_account_id', 'balance')}
+
+    unpaid = DueRegister.objects.filter(loan_account_id__in=account_ids, is_paid=False, due_date__lte=business_date)
+    # Partly paid items already have their PaidItem, which is one-to-one with the item and is topped up
+    paid_items = {due_id: (paid_item_id, amount_paid) for paid_item_id, due_id, amount_paid
+                  in PaidItem.objects.filter(due_register__in=unpaid).values_list('pk', 'due_register_id',
+                                                                                   'amount_paid')}
+    dues = {}
+    for due_id, loan_account_id, due_type, due_date, amount in unpaid.values_list(
+            'pk', 'loan_account_id', 'due_type', 'due_date', 'amount'):
+        outstanding = amount - paid_items[due_id][1] if due_id in paid_items else amount
+        dues.setdefault(loan_account_id, []).append((due_id, due_type, due_date, outstanding))
+
+    now = timezone.now()
+    paid_due_ids, new_paid_items, updated_paid_items = [], [], []
+    repayment_accounts, loan_accounts, journals, entries, tries = [], [], [], [], []
+    result = {'loans': len(loans), 'paid_in_full': 0, 'items_paid': 0, 'collected': Decimal('0.00')}
+
+    for loan_account_id, (loan_type, accrued_penalty) in loans.items():
+        repayment_account_id, funds_balance = funds.get(loan_account_id, (None, Decimal('0.00')))
+        account_dues = dues.get(loan_account_id, [])
+        allocations = waterfalls.get(loan_type, DEFAULT_WATERFALL).allocate(funds_balance, account_dues)
+        outstanding = {due_id: (due_type, amount) for due_id, due_type, _, amount in account_dues}
+
+        paid = {'principal': Decimal('0.00'), 'interest': Decimal('0.00'), 'penalty': Decimal('0.00')}
+        for due_id, amount in allocations:
+            due_type, due_amount = outstanding[due_id]
+            paid[due_type] = paid.get(due_type, Decimal('0.00')) + amount
+            if amount == due_amount:
+                paid_due_ids.append(due_id)
+            if due_id in paid_items:
+                paid_item_id, amount_paid = paid_items[due_id]
+                updated_paid_items.append(PaidItem(pk=paid_item_id, amount_paid=amount_paid + amount))
+            else:
+                new_paid_items.append(PaidItem(due_register_id=due_id, amount_paid=amount))
+
+        collected = sum(amount for _, amount in allocations)
+        due_total = sum(amount for _, amount in outstanding.values())
+        in_full = collected == due_total
+        result['paid_in_full'] += in_full
+        result['items_paid'] += sum(amount == outstanding[due_id][1] for due_id, amount in allocations)
+        result['collected'] += collected
+
+        if collected:
+            repayment_accounts.append(RepaymentAccount(pk=repayment_account_id, balance=funds_balance - collected,
+                                                       updated_at=now))
+            loan_accounts.append(LoanAccount(pk=loan_account_id, accrued_penalty=accrued_penalty - paid['penalty'],
+                                             updated_at=now))
+            description = f'Repayment collected for {business_date}'
+            journals.append(repayment_journal(ledger, loan_account_id, description, paid['principal'],
+                                              paid['interest'], paid['penalty'], value_date=business_date))
+            entries.append(LoanAccountEntry(loan_account_id=loan_account_id, entry_type='repayment', amount=collected,
+                                            entry_date=business_date, description=description))
+        tries.append(LoanRepaymentTry(
+            loan_account_id=loan_account_id,
+            try_count=try_counts.get(loan_account_id, 1),
+            status='successful' if in_full else 'failed',
+            response_message=f'Collected {collected} of {due_total} due'
+        ))
+
+    DueRegister.objects.filter(pk__in=paid_due_ids).update(is_paid=True, paid_at=now)
+    PaidItem.objects.bulk_create(new_paid_items)
+    PaidItem.objects.bulk_update(updated_paid_items, ['amount_paid'])
+    # bulk_update bypasses auto_now, so updated_at is set with the balances
+    RepaymentAccount.objects.bulk_update(repayment_accounts, ['balance', 'updated_at'])
+    LoanAccount.objects.bulk_update(loan_accounts, ['accrued_penalty', 'updated_at'])
+    # The loan balances move with the principal repaid
+    postings.post_journals(journals, gl_deltas)
+    LoanAccountEntry.objects.bulk_create(entries)
+    LoanRepaymentTry.objects.bulk_create(tries)
+    return result
+
+
+# Oldest unpaid item due by business_date of each account that still owes something
+def unpaid_items(account_ids, business_date):
+    oldest = {}
+    unpaid = DueRegister.objects.filter(loan_account_id__in=account_ids, is_paid=False, due_date__lte=business_date)
+    for loan_account_id, due_id in unpaid.order_by('due_date', 'pk').values_list('loan_account_id', 'pk'):
+        oldest.setdefault(loan_account_id, due_id)
+    return oldest
+
+
+def get_max_attempts():
+    return getattr(settings, 'REPAYMENT_MAX_ATTEMPTS', 4)
+
+
+# Days to wait after the try_count-th failed attempt: REPAYMENT_RETRY_DELAY_DAYS, multiplied by
+# REPAYMENT_RETRY_BACKOFF_FACTOR after every further failure, up to REPAYMENT_RETRY_MAX_DELAY_DAYS
+def retry_delay(try_count):
+    delay = (getattr(settings, 'REPAYMENT_RETRY_DELAY_DAYS', 1)
+             * getattr(settings, 'REPAYMENT_RETRY_BACKOFF_FACTOR', 2) ** (try_count - 1))
+    return timedelta(days=min(delay, getattr(settings, 'REPAYMENT_RETRY_MAX_DELAY_DAYS', 30)))
+
+
+# Queues a retry for the accounts the first collection attempt left owing; unpaid maps them to their oldest item
+def schedule_retries(unpaid, business_date):
+    if get_max_attempts() <= 1:
+        fail_retries([(None, loan_account_id, due_id, 1) for loan_account_id, due_id in unpaid.items()])
+        return
+    retry_date = business_date + retry_delay(1)
+    RepaymentEODRetry.objects.bulk_create([
+        RepaymentEODRetry(loan_account_id=loan_account_id, repayment_schedule_id=due_id, retry_date=retry_date)
+        for loan_account_id, due_id in unpaid.items()
+    ], ignore_conflicts=True)
+
+
+# Collects the accounts whose retry is due by business_date. Paid accounts leave the queue, the others are
+# rescheduled with a longer delay, or moved to FailedLoanRepayments once they have used up their attempts.
+def process_repayment_retries(business_date, batch_size=None, after_id=None, upto_id=None, checkpoint=None):
+    retries = RepaymentEODRetry.objects.filter(retry_date__lte=business_date)
+    retries = eod.in_shard(retries, 'loan_account_id', after_id, upto_id)
+    ledger = None
+    waterfalls = waterfall_cache.snapshot()
+
+    result = {'retried': 0, 'recovered': 0, 'rescheduled': 0, 'failed': 0, 'collected': Decimal('0.00')}
+    for rows in eod.iter_batches(retries, ['loan_account_id', 'try_count'], eod.get_batch_size(batch_size),
+                                 eod.resume_after(checkpoint)):
+        ledger = ledger or get_repayment_ledger()
+        try_counts = {loan_account_id: try_count + 1 for _, loan_account_id, try_count in rows}
+        with transaction.atomic():
+            gl_deltas = eod.batch_gl_deltas(checkpoint)
+            collected = collect_batch(list(try_counts), business_date, ledger, waterfalls, try_counts, gl_deltas)
+            unpaid = unpaid_items(list(try_counts), business_date)
+
+            recovered, rescheduled, exhausted = [], [], []
+            for retry_id, loan_account_id, _ in rows:
+                try_count = try_counts[loan_account_id]
+                if loan_account_id not in unpaid:
+                    recovered.append(retry_id)
+                elif try_count >= get_max_attempts():
+                    exhausted.append((retry_id, loan_account_id, unpaid[loan_account_id], try_count))
+                else:
+                    rescheduled.append(RepaymentEODRetry(
+                        pk=retry_id, repayment_schedule_id=unpaid[loan_account_id], try_count=try_count,
+                        retry_date=business_date + retry_delay(try_count)))
+
+            RepaymentEODRetry.objects.filter(pk__in=recovered).delete()
+            RepaymentEODRetry.objects.bulk_update(rescheduled, ['repayment_schedule_id', 'try_count', 'retry_date'])
+            fail_retries(exhausted)
+
+            batch_result = {'retried': len(rows), 'recovered': len(recovered), 'rescheduled': len(rescheduled),
+                            'failed': len(exhausted), 'collected': collected['collected']}
+            eod.save_checkpoint(checkpoint, rows[-1][0], batch_result, gl_deltas)
+        for key, value in batch_result.items():
+            result[key] += value
+    return result
+
+
+# Moves retries that used up their attempts to FailedLoanRepayments, with the ids of the account's last attempts.
+# retries are (retry_id, loan_account_id, due_id, try_count) tuples; retry_id is None for an account never queued.
+def fail_retries(retries):
+    if not retries:
+        return
+    try_ids = {}
+    attempts = LoanRepaymentTry.objects.filter(loan_account_id__in=[retry[1] for retry in retries])
+    for loan_account_id, try_id in attempts.order_by('-pk').values_list('loan_account_id', 'pk'):
+        try_ids.setdefault(loan_account_id, []).append(try_id)
+
+    FailedLoanRepayments.objects.bulk_create([
+        FailedLoanRepayments(loan_account_id=loan_account_id, schedule_id=due_id,
+                             try_ids=sorted(try_ids.get(loan_account_id, [])[:try_count]))
+        for _, loan_account_id, due_id, try_count in retries
+    ])
+    RepaymentEODRetry.objects.filter(pk__in=[retry[0] for retry in retries if retry[0] is not None]).delete()
+
+
+# Moves every queued retry that has used up its attempts to FailedLoanRepayments, e.g. after
+# REPAYMENT_MAX_ATTEMPTS was lowered. Returns the number of accounts moved.
+def fail_exhausted_retries():
+    exhausted = list(RepaymentEODRetry.objects.filter(try_count__gte=get_max_attempts())
+                     .values_list('pk', 'loan_account_id', 'repayment_schedule_id', 'try_count'))
+    with transaction.atomic():
+        fail_retries(exhausted)
+    return len(exhausted)
+
+
+# Posts a repayment received for a loan account, rounded half up to the cent, split by the loan type's waterfall;
+# what is left over goes to the advance payment balance. The loan account row stays locked until the posting commits,
+# so concurrent repayments of the same loan are applied one after the other. The allocation is computed in memory and
+# written with one UPDATE of the installments, one of the account, one entry and one journal, whatever the number of
+# installments outstanding.
+def repay_loan(loan_account_id, amount, payment_date=None):
+    try:
+        amount = Decimal(str(amount)).quantize(eod.CENT, rounding=ROUND_HALF_UP)
+    except ArithmeticError:
+        raise ValueError(f"Invalid repayment amount '{amount}'.")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("The repayment amount must be greater than zero.")
+    payment_date = payment_date or timezone.localdate()
+    ledger = get_repayment_ledger()
+
+    with transaction.atomic():
+        loan_account = LoanAccount.objects.select_for_update(of=('self',)).select_related('loan_application').get(
+            pk=loan_account_id)
+        waterfall = waterfall_cache.get(loan_account.loan_application.loan_type)
+        schedules = RepaymentSchedule.objects.filter(loan_application_id=loan_account.loan_application_id,
+                                                     status__in=eod.UNPAID_INSTALLMENT).order_by('due_date', 'pk')
+        interest_amounts = {}
+        pending = []
+        for schedule_id, total_amount, interest_amount in schedules.values_list('pk', 'total_amount',
+                                                                                'interest_amount'):
+            pending.append((schedule_id, total_amount))
+            interest_amounts[schedule_id] = interest_amount
+        penalty_paid, paid, remaining = waterfall.allocate_repayment(amount, loan_account.accrued_penalty, pending)
+
+        RepaymentSchedule.objects.filter(pk__in=[schedule_id for schedule_id, _ in paid]).update(status='paid')
+        loan_account.accrued_penalty -= penalty_paid
+        loan_account.advance_payment_balance += remaining
+        loan_account.save(update_fields=['accrued_penalty', 'advance_payment_balance', 'updated_at'])
+        description = repayment_description(amount, penalty_paid, paid, remaining)
+        LoanAccountEntry.objects.create(loan_account=loan_account, entry_type='repayment', amount=amount,
+                                        entry_date=payment_date, description=description)
+        principal, interest = installment_parts(paid, interest_amounts)
+        postings.post_journal(repayment_journal(ledger, loan_account.pk, description, principal, interest,
+                                                penalty_paid, remaining, value_date=payment_date))
+
+    return {
+        'penalty_paid': penalty_paid,
+        'installments_paid': len(paid),
+        'advance_payment': remaining,
+        'advance_payment_balance': loan_account.advance_payment_balance,
+    }
+
+
+# Applies a loan account's advance payment balance to its unpaid installments, oldest first. An installment the
+# balance does not cover in full is paid in part, its interest and principal reduced in the order of the loan type's
+# waterfall, and left 'partial'. Locks the account like repay_loan and writes one UPDATE of the installments paid in
+# full and one journal. Returns the number of installments paid in full and in part, and the balance left.
+def apply_advance_payment(loan_account_id):
+    ledger = get_repayment_ledger()
+    with transaction.atomic():
+        loan_account = LoanAccount.objects.select_for_update(of=('self',)).select_related('loan_application').get(
+            pk=loan_account_id)
+        waterfall = waterfall_cache.get(loan_account.loan_application.loan_type)
+        schedules = RepaymentSchedule.objects.filter(loan_application_id=loan_account.loan_application_id,
+                                                     status__in=eod.UNPAID_INSTALLMENT).order_by('due_date', 'pk')
+        balance = loan_account.advance_payment_balance
+        paid, part_paid, interest_amounts = [], None, {}
+        principal, interest = Decimal('0.00'), Decimal('0.00')
+        for schedule in schedules.only('pk', 'interest_amount', 'principal_amount', 'total_amount', 'status'):
+            if balance <= 0:
+                break
+            if balance >= schedule.total_amount:
+                balance -= schedule.total_amount
+                paid.append((schedule.pk, schedule.total_amount))
+                interest_amounts[schedule.pk] = schedule.interest_amount
+                continue
+            interest_paid, principal_paid = waterfall.split_installment(balance, schedule.interest_amount,
+                                                                        schedule.principal_amount)
+            principal, interest = principal_paid, interest_paid
+            schedule.interest_amount -= interest_paid
+            schedule.principal_amount -= principal_paid
+            schedule.total_amount -= balance
+            schedule.status = 'partial'
+            part_paid = schedule
+            balance = Decimal('0.00')
+
+        RepaymentSchedule.objects.filter(pk__in=[schedule_id for schedule_id, _ in paid]).update(status='paid')
+        if part_paid is not None:
+            part_paid.save(update_fields=['interest_amount', 'principal_amount', 'total_amount', 'status'])
+        applied = loan_account.advance_payment_balance - balance
+        loan_account.advance_payment_balance = balance
+        loan_account.save(update_fields=['advance_payment_balance', 'updated_at'])
+        paid_principal, paid_interest = installment_parts(paid, interest_amounts)
+        postings.post_journal(repayment_journal(
+            ledger, loan_account.pk, f'Advance payment of {applied} applied', principal + paid_principal,
+            interest + paid_interest, Decimal('0.00'), source='advance_payments'
+        ))
+
+    return {
+        'installments_paid': len(paid),
+        'installments_part_paid': int(part_paid is not None),
+        'advance_payment_balance': balance,
+    }
+
+
+# Principal and interest of the installments paid in full, from their (schedule_id, total_amount) pairs and
+# {schedule_id: interest_amount}; an installment's interest is paid first out of its total
+def installment_parts(paid, interest_amounts):
+    total = sum((total_amount for _, total_amount in paid), Decimal('0.00'))
+    interest = sum((min(interest_amounts[schedule_id], total_amount) for schedule_id, total_amount in paid),
+                   Decimal('0.00'))
+    return total - interest, interest
+
+
+def repayment_description(amount, penalty_paid, paid, remaining):
+    return f'Repayment of {amount}: {penalty_paid} penalty, {len(paid)} installments, {remaining} to advance payment'
+
+
+# Posts a batch of repayments from a payment file the way repay_loan posts one. lines are (position, line) pairs of
+# validated lines with loan_account_id, amount, payment_date and payment_method; they are applied in order, so the
+# payments of one loan follow each other. The batch's loan accounts are locked and their pending installments loaded
+# with one query each, and everything is written in bulk: a Payment per installment paid, and a LoanAccountEntry and
+# a journal on the get_repayment_ledger() ledger per line. Returns {position: {'result': {...}} or {'errors': {...}}}.
+def post_repayments(lines, ledger):
+    results = {}
+    now = timezone.now()
+    waterfalls = waterfall_cache.snapshot()
+    with transaction.atomic():
+        accounts = LoanAccount.objects.select_for_update(of=('self',)).select_related('loan_application').filter(
+            pk__in={line['loan_account_id'] for _, line in lines})
+        accounts = {account.pk: account for account in accounts.order_by('pk')}
+        pending, interest_amounts = {}, {}
+        schedules = RepaymentSchedule.objects.filter(
+            loan_application_id__in=[account.loan_application_id for account in accounts.values()],
+            status__in=eod.UNPAID_INSTALLMENT
+        ).order_by('due_date', 'pk')
+        for schedule_id, loan_application_id, total_amount, interest_amount in schedules.values_list(
+                'pk', 'loan_application_id', 'total_amount', 'interest_amount'):
+            pending.setdefault(loan_application_id, []).append((schedule_id, total_amount))
+            interest_amounts[schedule_id] = interest_amount
+
+        paid_ids, payments, journals, entries, penalized, advanced = [], [], [], [], {}, {}
+        for position, line in lines:
+            account = accounts.get(line['loan_account_id'])
+            if account is None:
+                results[position] = {'errors': {'loan_account_id': [
+                    f"Loan account {line['loan_account_id']} does not exist."]}}
+                continue
+            amount = line['amount']
+            payment_date = line.get('payment_date') or timezone.localdate()
+            schedules = pending.setdefault(account.loan_application_id, [])
+            waterfall = waterfalls.get(account.loan_application.loan_type, DEFAULT_WATERFALL)
+            penalty_paid, paid, remaining = waterfall.allocate_repayment(amount, account.accrued_penalty, schedules)
+            del schedules[:len(paid)]
+
+            paid_at = timezone.make_aware(datetime.combine(payment_date, datetime.min.time()))
+            for schedule_id, total_amount in paid:
+                paid_ids.append(schedule_id)
+                payments.append(Payment(schedule_id=schedule_id, amount_paid=total_amount, payment_date=paid_at,
+                                        payment_method=line['payment_method'], status='completed'))
+            description = repayment_description(amount, penalty_paid, paid, remaining)
+            principal, interest = installment_parts(paid, interest_amounts)
+            journals.append(repayment_journal(ledger, account.pk, description, principal, interest, penalty_paid,
+                                              remaining, value_date=payment_date))
+            entries.append(LoanAccountEntry(loan_account_id=account.pk, entry_type='repayment', amount=amount,
+                                            entry_date=payment_date, description=description))
+            # Only the balances that moved are written; most lines leave the penalty alone
+            if penalty_paid:
+                account.accrued_penalty -= penalty_paid
+                account.updated_at = now
+                penalized[account.pk] = account
+            if remaining:
+                account.advance_payment_balance += remaining
+                account.updated_at = now
+                advanced[account.pk] = account
+            results[position] = {'result': {
+                'loan_account_id': account.pk,
+                'penalty_paid': penalty_paid,
+                'installments_paid': len(paid),
+                'advance_payment': remaining,
+            }}
+
+        RepaymentSchedule.objects.filter(pk__in=paid_ids).update(status='paid')
+        Payment.objects.bulk_create(payments)
+        # bulk_update bypasses auto_now, so updated_at is set with the balances
+        LoanAccount.objects.bulk_update(penalized.values(),
+                                        ['accrued_penalty', 'advance_payment_balance', 'updated_at'])
+        LoanAccount.objects.bulk_update([account for pk, account in advanced.items() if pk not in penalized],
+                                        ['advance_payment_balance', 'updated_at'])
+        LoanAccountEntry.objects.bulk_create(entries)
+        postings.post_journals(journals)
+    return results
+
+
+# Runs process_due_repayments and reports its throughput
+def process_with_metrics(business_date, **options):
+    started = time.monotonic()
+    result = process_due_repayments(business_date, **options)
+    seconds = time.monotonic() - started
+    loans_per_second = result['loans'] / seconds if seconds else 0
+    logger.info("Processed the repayments of %d loans in %.2fs (%.0f loans/s)", result['loans'], seconds,
+                loans_per_second)
+    return dict(result, seconds=round(seconds, 3), loans_per_second=round(loans_per_second, 1))
@@ -0,0 +1,502 @@
+from decimal import Decimal, localcontext
+
+from . import calendars
+
+# Shared repayment schedule engine used by the loan calculator API, loan approval, utils.py and loan
+# modifications. It has no Django dependency; NumPy is only imported when the 'vectorized' engine is used.
+
+ENGINES = ('decimal', 'vectorized')
+DECIMAL_PRECISION = 10  # Precision of the decimal operations in the 'decimal' engine
+SUMMARY_PRECISION = 28  # Precision of the closed-form totals
+GRADUATED_INCREMENT = Decimal(1.05)  # 5% increment per period
+BALLOON_RATIO = Decimal(0.5)  # 50% of the loan amount is paid as the balloon
+ZERO = Decimal(0)
+
+# Errors a schedule calculation can raise for inputs that passed validation
+CALCULATION_ERRORS = (ArithmeticError, KeyError, TypeError, ValueError)
+
+
+class ScheduleRow:
+    __slots__ = ('period', 'principal', 'interest', 'installment', 'due_date')
+
+    def __init__(self, period, principal, interest, installment, due_date):
+        self.period = period
+        self.principal = principal
+        self.interest = interest
+        self.installment = installment
+        self.due_date = due_date
+
+    def as_dict(self):
+        return {
+            'period': self.period,
+            'principal': self.principal,
+            'interest': self.interest,
+            'installment': self.installment,
+            'due_date': self.due_date.strftime('%Y-%m-%d') if self.due_date else None,
+        }
+
+
+class Schedule:
+    __slots__ = ('rows', 'total_principal', 'total_interest', 'total_amount_to_repay')
+
+    def __init__(self, rows, total_principal, total_interest, total_amount_to_repay):
+        self.rows = rows
+        self.total_principal = total_principal
+        self.total_interest = total_interest
+        self.total_amount_to_repay = total_amount_to_repay
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # The API representation, built only when a response needs it
+    def as_dict(self):
+        return {
+            'repayment_plan': [row.as_dict() for row in self.rows],
+            'total_principal': self.total_principal,
+            'total_interest': self.total_interest,
+            'total_amount_to_repay': self.total_amount_to_repay
+        }
+
+
+# A schedule calculated lazily with the 'decimal' engine: rows are produced one at a time while it is iterated,
+# so memory stays flat whatever the number of periods. offset/limit restrict the rows to a window; the periods
+# before the window are still walked (every method carries the remaining principal forward) but no rows are built
+# for them, and nothing after the window is calculated. The totals cover the whole plan, as calculate_schedule()
+# returns them, and are available once the rows have been read.
+class ScheduleStream:
+
+    def __init__(self, loan_amount, interest_rate, tenure, tenure_type, repayment_schedule, interest_basis,
+                 loan_calculation_method, repayment_start_date, repayment_mode=None, offset=0, limit=None,
+                 business_calendar=None):
+        self.inputs = {
+            'loan_amount': loan_amount,
+            'interest_rate': interest_rate,
+            'tenure': tenure,
+            'tenure_type': tenure_type,
+            'repayment_schedule': repayment_schedule,
+            'interest_basis': interest_basis,
+            'loan_calculation_method': loan_calculation_method,
+        }
+        self.repayment_start_date = repayment_start_date
+        self.business_calendar = business_calendar or calendars.NO_ADJUSTMENT
+        self.offset = offset or 0
+        self.limit = limit
+        self.periods, self.period_interest_rate = schedule_terms(tenure, tenure_type, repayment_schedule,
+                                                                 interest_rate, interest_basis)
+        self._totals = None
+
+    @property
+    def is_window(self):
+        return self.offset > 0 or (self.limit is not None and self.limit < self.periods)
+
+    def __iter__(self):
+        inputs = self.inputs
+        amounts = iter_period_amounts(inputs['loan_amount'], inputs['interest_rate'], inputs['tenure'], self.periods,
+                                      self.period_interest_rate, inputs['loan_calculation_method'])
+        totals = plan_totals(inputs['loan_amount'], inputs['interest_rate'], inputs['tenure'], self.periods,
+                             self.period_interest_rate, inputs['loan_calculation_method'])
+        end = None if self.limit is None else self.offset + self.limit
+        total_principal = ZERO  # Unrounded, for the totals when the method has no closed form
+        total_interest = ZERO
+        rounded_principal = ZERO  # Rounded rows so far, for the last row's true-up
+        rounded_interest = ZERO
+        period = 0
+        while end is None or period < end:
+            # The precision is set per step only, so the caller never runs inside this generator's context
+            with localcontext() as context:
+                context.prec = DECIMAL_PRECISION
+                amount = next(amounts, None)
+                if amount is None:
+                    break
+                period += 1
+                principal, interest = amount
+                total_principal += principal
+                total_interest += interest
+                principal, interest = round(principal, 2), round(interest, 2)
+                context.prec = SUMMARY_PRECISION
+                if period == self.periods and totals is not None:
+                    principal = totals[0] - rounded_principal
+                    interest = totals[1] - rounded_interest
+                rounded_principal += principal
+                rounded_interest += interest
+                if period <= self.offset:
+                    continue
+                row = ScheduleRow(period, principal, interest, principal + interest,
+                                  calendars.due_date(self.repayment_start_date, inputs['repayment_schedule'],
+                                                     period, self.business_calendar))
+            yield row
+
+        if totals is None:
+            with localcontext() as context:
+                context.prec = DECIMAL_PRECISION
+                totals = round(total_principal, 2), round(total_interest, 2)
+        self._totals = (totals[0], totals[1], totals[0] + totals[1])
+
+    # Totals of the whole plan; only available once the rows have been iterated
+    def totals(self):
+        if self._totals is None:
+            raise ValueError("The schedule totals are only known once its rows have been read.")
+        total_principal, total_interest, total_amount_to_repay = self._totals
+        return {
+            'total_principal': total_principal,
+            'total_interest': total_interest,
+            'total_amount_to_repay': total_amount_to_repay
+        }
+
+
+# Totals of a schedule without its rows, for callers that only need what the loan costs
+class ScheduleSummary:
+    __slots__ = ('periods', 'installment', 'total_principal', 'total_interest', 'total_amount_to_repay')
+
+    def __init__(self, periods, installment, total_principal, total_interest, total_amount_to_repay):
+        self.periods = periods
+        self.installment = installment
+        self.total_principal = total_principal
+        self.total_interest = total_interest
+        self.total_amount_to_repay = total_amount_to_repay
+
+    def as_dict(self):
+        return {
+            'number_of_installments': self.periods,
+            'installment': self.installment,
+            'total_principal': self.total_principal,
+            'total_interest': self.total_interest,
+            'total_amount_to_repay': self.total_amount_to_repay
+        }
+
+
+# Number of installments; the due dates themselves come from the calendars module
+def determine_periods(tenure, tenure_type, repayment_schedule):
+    if repayment_schedule == 'daily':
+        periods = tenure if tenure_type == 'days' else tenure * 365 // {'weeks': 7, 'months': 30, 'years': 365}[
+            tenure_type]
+    elif repayment_schedule == 'weekly':
+        periods = tenure if tenure_type == 'weeks' else tenure * 52 // {'days': 1 / 7, 'months': 4, 'years': 52}[
+            tenure_type]
+    elif repayment_schedule == 'monthly':
+        periods = tenure if tenure_type == 'months' else tenure * 12 // {'days': 1 / 30, 'weeks': 4, 'years': 12}[
+            tenure_type]
+    elif repayment_schedule == 'quarterly':
+        periods = tenure * 4 // {'months': 3, 'years': 4}[tenure_type]
+    elif repayment_schedule == 'halfyearly':
+        periods = tenure * 2 // {'months': 6, 'years': 2}[tenure_type]
+    elif repayment_schedule == 'annually':
+        periods = tenure if tenure_type == 'years' else tenure * 1 // \
+                                                        {'days': 1 / 365, 'weeks': 1 / 52, 'months': 1 / 12}[
+                                                            tenure_type]
+    else:  # one_time
+        periods = 1
+
+    return periods
+
+
+def adjust_interest_rate(interest_rate, interest_basis, periods):
+    if interest_basis == '365':
+        return interest_rate / Decimal(100) / Decimal(365 / periods)
+    else:
+        return interest_rate / Decimal(100) / Decimal(365 / periods)  # Placeholder for other basis
+
+
+# Number of periods and per-period interest rate of a loan
+def schedule_terms(tenure, tenure_type, repayment_schedule, interest_rate, interest_basis):
+    with localcontext() as context:
+        context.prec = DECIMAL_PRECISION
+        periods = determine_periods(tenure, tenure_type, repayment_schedule)
+        return periods, adjust_interest_rate(interest_rate, interest_basis, periods)
+
+
+# Yields the unrounded (principal, interest) of every period, one period at a time.
+# flat_rate and simple_interest charge interest for `tenure` months.
+def iter_period_amounts(loan_amount, interest_rate, tenure, periods, period_interest_rate, loan_calculation_method):
+    remaining_principal = loan_amount
+
+    if loan_calculation_method == 'reducing_balance':
+        for period in range(1, periods + 1):
+            interest_payment = remaining_principal * period_interest_rate
+            principal_payment = loan_amount / periods
+            remaining_principal -= principal_payment
+            yield principal_payment, interest_payment
+
+    elif loan_calculation_method == 'flat_rate':
+        fixed_interest = loan_amount * interest_rate / Decimal(100) * tenure / Decimal(12)
+        for period in range(1, periods + 1):
+            yield loan_amount / periods, fixed_interest / periods
+
+    elif loan_calculation_method == 'constant_repayment':
+        monthly_payment = (loan_amount * period_interest_rate) / (1 - (1 + period_interest_rate) ** -periods)
+        for period in range(1, periods + 1):
+            interest_payment = remaining_principal * period_interest_rate
+            principal_payment = monthly_payment - interest_payment
+            remaining_principal -= principal_payment
+            yield principal_payment, interest_payment
+
+    elif loan_calculation_method == 'simple_interest':
+        interest_payment = loan_amount * interest_rate / Decimal(100) * tenure / Decimal(12)
+        for period in range(1, periods + 1):
+            yield loan_amount / periods, interest_payment / periods
+
+    elif loan_calculation_method == 'compound_interest':
+        compound_factor = (1 + period_interest_rate) ** periods
+        total_amount = loan_amount * compound_factor
+        for period in range(1, periods + 1):
+            interest_payment = remaining_principal * period_interest_rate
+            principal_payment = total_amount / periods - interest_payment
+            remaining_principal -= principal_payment
+            yield principal_payment, interest_payment
+
+    elif loan_calculation_method == 'graduated_repayment':
+        initial_payment = loan_amount / periods
+        for period in range(1, periods + 1):
+            interest_payment = remaining_principal * period_interest_rate
+            principal_payment = initial_payment * (GRADUATED_INCREMENT ** (period - 1))
+            remaining_principal -= principal_payment
+            yield principal_payment, interest_payment
+
+    elif loan_calculation_method == 'balloon_payment':
+        balloon_amount = loan_amount * BALLOON_RATIO
+        monthly_payment = (loan_amount - balloon_amount) / (periods - 1)
+        for period in range(1, periods):
+            interest_payment = remaining_principal * period_interest_rate
+            principal_payment = monthly_payment - interest_payment
+            remaining_principal -= principal_payment
+            yield principal_payment, interest_payment
+        # Balloon payment in the last period
+        yield balloon_amount, remaining_principal * period_interest_rate
+
+    elif loan_calculation_method == 'bullet_repayment':
+        for period in range(1, periods):
+            yield ZERO, remaining_principal * period_interest_rate
+        # Principal paid in the last period
+        yield loan_amount, remaining_principal * period_interest_rate
+
+    elif loan_calculation_method == 'interest_first':
+        for period in range(1, periods):
+            yield ZERO, remaining_principal * period_interest_rate
+        # Principal paid in the last period
+        yield loan_amount, ZERO
+
+
+def calculate_schedule(loan_amount, interest_rate, tenure, tenure_type, repayment_schedule, interest_basis,
+                       loan_calculation_method, repayment_start_date, repayment_mode=None, engine='decimal',
+                       business_calendar=None):
+    # repayment_mode is accepted so calculator inputs can be passed straight through; it does not change the plan
+    if engine not in ENGINES:
+        raise ValueError(f"Invalid calculator engine '{engine}'.")
+
+    periods, period_interest_rate = schedule_terms(tenure, tenure_type, repayment_schedule, interest_rate,
+                                                   interest_basis)
+    due_dates = calendars.due_dates(repayment_start_date, repayment_schedule, periods,
+                                    business_calendar or calendars.NO_ADJUSTMENT)
+
+    totals = plan_totals(loan_amount, interest_rate, tenure, periods, period_interest_rate, loan_calculation_method)
+
+    if engine == 'vectorized' and totals is not None:
+        from . import vectorized
+        try:
+            return vectorized.calculate_repayment_schedule(
+                periods, due_dates, interest_rate, period_interest_rate, loan_amount, loan_calculation_method,
+                *totals, interest_months=tenure
+            )
+        except OverflowError:
+            pass  # Amounts too large for exact cents in float64 are calculated with Decimal below
+
+    with localcontext() as context:
+        context.prec = DECIMAL_PRECISION
+        rows = []
+        total_principal = ZERO
+        total_interest = ZERO
+        amounts = iter_period_amounts(loan_amount, interest_rate, tenure, periods, period_interest_rate,
+                                      loan_calculation_method)
+        for (period, due_date), (principal, interest) in zip(enumerate(due_dates, start=1), amounts):
+            rows.append(ScheduleRow(period, round(principal, 2), round(interest, 2), None, due_date))
+            total_principal += principal
+            total_interest += interest
+        if totals is None:
+            totals = round(total_principal, 2), round(total_interest, 2)
+
+    return true_up(rows, *totals)
+
+
+# Rounded (total_principal, total_interest) of the whole plan, from the closed forms evaluated to
+# SUMMARY_PRECISION, or None when the method has none or they cannot be evaluated. Both engines true the last row up
+# to them, so they return the same totals, and the Decimal engine's DECIMAL_PRECISION loop does not drift them.
+def plan_totals(loan_amount, interest_rate, tenure, periods, period_interest_rate, loan_calculation_method):
+    try:
+        with localcontext() as context:
+            context.prec = SUMMARY_PRECISION
+            totals = closed_form_totals(loan_amount, interest_rate, tenure, periods, period_interest_rate,
+                                        loan_calculation_method)
+            if totals is None:
+                return None
+            _, total_principal, total_interest = totals
+            return round(total_principal, 2), round(total_interest, 2)
+    except ArithmeticError:
+        return None  # The period loop raises the error, or calculates what it can
+
+
+# Schedule of rows rounded period by period, with the last row trued up so that the rows add up exactly to the
+# totals; every installment is its row's principal plus interest
+def true_up(rows, total_principal, total_interest):
+    with localcontext() as context:
+        context.prec = SUMMARY_PRECISION
+        if rows:
+            last = rows[-1]
+            last.principal += total_principal - sum(row.principal for row in rows)
+            last.interest += total_interest - sum(row.interest for row in rows)
+        for row in rows:
+            row.installment = row.principal + row.interest
+        return Schedule(rows, total_principal, total_interest, total_principal + total_interest)
+
+
+# Closed-form (first installment, total principal, total interest) of a schedule, unrounded, or None when the
+# method has no closed form. The first installment is the regular one for the level-payment methods.
+def closed_form_totals(loan_amount, interest_rate, tenure, periods, period_interest_rate, loan_calculation_method):
+    r = period_interest_rate
+
+    if loan_calculation_method == 'reducing_balance':
+        # Interest is charged on a balance falling linearly from loan_amount to loan_amount / periods
+        total_interest = loan_amount * r * (periods + 1) / 2
+        return loan_amount / periods + loan_amount * r, loan_amount, total_interest
+
+    if loan_calculation_method in ('flat_rate', 'simple_interest'):
+        fixed_interest = loan_amount * interest_rate / Decimal(100) * tenure / Decimal(12)
+        return (loan_amount + fixed_interest) / periods, loan_amount, fixed_interest
+
+    if loan_calculation_method == 'constant_repayment':
+        monthly_payment = (loan_amount * r) / (1 - (1 + r) ** -periods)
+        return monthly_payment, loan_amount, monthly_payment * periods - loan_amount
+
+    if loan_calculation_method == 'compound_interest':
+        per_period = loan_amount * (1 + r) ** periods / periods
+        total_interest = _level_payment_interest(loan_amount, r, per_period, periods)
+        return per_period, per_period * periods - total_interest, total_interest
+
+    if loan_calculation_method == 'graduated_repayment':
+        initial_payment = loan_amount / periods
+        growth = GRADUATED_INCREMENT - 1
+        total_principal = initial_payment * (GRADUATED_INCREMENT ** periods - 1) / growth
+        # Sum of the principal paid before each period
+        paid_before = initial_payment * ((GRADUATED_INCREMENT ** periods - 1) / growth - periods) / growth
+        total_interest = (loan_amount * periods - paid_before) * r
+        return initial_payment + loan_amount * r, total_principal, total_interest
+
+    if loan_calculation_method == 'balloon_payment':
+        balloon_amount = loan_amount * BALLOON_RATIO
+        monthly_payment = (loan_amount - balloon_amount) / (periods - 1)
+        regular = periods - 1
+        regular_interest = _level_payment_interest(loan_amount, r, monthly_payment, regular)
+        # Balance left for the balloon period
+        remaining = loan_amount * (1 + r) ** regular - monthly_payment * _growth_sum(r, regular)
+        total_principal = monthly_payment * regular - regular_interest + balloon_amount
+        return monthly_payment, total_principal, regular_interest + remaining * r
+
+    if loan_calculation_method == 'bullet_repayment':
+        installment = loan_amount * r if periods > 1 else loan_amount + loan_amount * r
+        return installment, loan_amount, loan_amount * r * periods
+
+    if loan_calculation_method == 'interest_first':
+        installment = loan_amount * r if periods > 1 else loan_amount
+        return installment, loan_amount, loan_amount * r * (periods - 1)
+
+    return None
+
+
+# Sum of (1 + r) ** k for k in 0 .. periods - 1
+def _growth_sum(r, periods):
+    return ((1 + r) ** periods - 1) / r if r else Decimal(periods)
+
+
+# Interest paid over `periods` periods when a fixed payment is made every period on a balance growing by r
+def _level_payment_interest(loan_amount, r, payment, periods):
+    growth_sum = _growth_sum(r, periods)
+    return r * loan_amount * growth_sum - payment * (growth_sum - periods)
+
+
+# Totals of a schedule computed without building its rows: O(1) for every method with a closed form,
+# walking the periods otherwise.
+def calculate_summary(loan_amount, interest_rate, tenure, tenure_type, repayment_schedule, interest_basis,
+                      loan_calculation_method, repayment_start_date=None, repayment_mode=None,
+                      business_calendar=None):
+    periods, period_interest_rate = schedule_terms(tenure, tenure_type, repayment_schedule, interest_rate,
+                                                   interest_basis)
+
+    with localcontext() as context:
+        # The closed forms subtract nearly equal terms, so they get more digits than the period loop
+        context.prec = SUMMARY_PRECISION
+        totals = closed_form_totals(loan_amount, interest_rate, tenure, periods, period_interest_rate,
+                                    loan_calculation_method)
+        if totals is None:
+            context.prec = DECIMAL_PRECISION
+            installment = None
+            total_principal = ZERO
+            total_interest = ZERO
+            amounts = iter_period_amounts(loan_amount, interest_rate, tenure, periods, period_interest_rate,
+                                          loan_calculation_method)
+            for principal, interest in amounts:
+                if installment is None:
+                    installment = principal + interest
+                total_principal += principal
+                total_interest += interest
+        else:
+            installment, total_principal, total_interest = totals
+
+        # The total to repay is the sum of the rounded totals, as in a calculated schedule
+        total_principal, total_interest = round(total_principal, 2), round(total_interest, 2)
+        return ScheduleSummary(periods, round(installment, 2) if installment is not None else None,
+                               total_principal, total_interest, total_principal + total_interest)
+
+
+# Calculates many schedules in one pass; each item is a dict of calculate_schedule() inputs. With the vectorized
+# engine, loans sharing the same periods and method are computed together. Returns one result per item, in
+# order: a Schedule, or the exception raised while calculating it.
+def calculate_schedules(items, engine='decimal', business_calendar=None):
+    from . import vectorized
+    business_calendar = business_calendar or calendars.NO_ADJUSTMENT
+    if engine != 'vectorized' or not vectorized.is_available():
+        return [_calculate_or_error(item, 'decimal', business_calendar) for item in items]
+
+    results = [None] * len(items)
+    positions = []
+    requests = []
+    for position, item in enumerate(items):
+        try:
+            periods, period_interest_rate = schedule_terms(
+                item['tenure'], item['tenure_type'], item['repayment_schedule'], item['interest_rate'],
+                item['interest_basis'])
+            totals = plan_totals(item['loan_amount'], item['interest_rate'], item['tenure'], periods,
+                                 period_interest_rate, item['loan_calculation_method'])
+            if totals is None:
+                results[position] = _calculate_or_error(item, 'decimal', business_calendar)
+                continue
+            requests.append({
+                'periods': periods,
+                # Loans starting on the same day share one cached date sequence
+                'due_dates': calendars.due_dates(item['repayment_start_date'], item['repayment_schedule'], periods,
+                                                 business_calendar),
+                'interest_rate': item['interest_rate'],
+                'period_interest_rate': period_interest_rate,
+                'loan_amount': item['loan_amount'],
+                'loan_calculation_method': item['loan_calculation_method'],
+                'interest_months': item['tenure'],
+                'total_principal': totals[0],
+                'total_interest': totals[1],
+            })
+            positions.append(position)
+        except CALCULATION_ERRORS as error:
+            results[position] = error
+
+    for position, schedule in zip(positions, vectorized.calculate_repayment_schedules(requests)):
+        if isinstance(schedule, OverflowError):
+            schedule = _calculate_or_error(items[position], 'decimal', business_calendar)
+        results[position] = schedule
+    return results
+
+
+def _calculate_or_error(item, engine, business_calendar):
+    try:
+        return calculate_schedule(**item, engine=engine, business_calendar=business_calendar)
+    except CALCULATION_ERRORS as error:
+        return error
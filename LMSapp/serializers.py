@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from decimal import Decimal, getcontext
+from decimal import Decimal
 from .models import *
 from django.utils import timezone
 
@@ -241,6 +241,15 @@ class RetentionMetricSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+# One line of a bank payment file, see payment_imports
+class PaymentImportLineSerializer(serializers.Serializer):
+    loan_account_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=16, decimal_places=2, min_value=Decimal('0.01'))
+    payment_date = serializers.DateField(required=False)
+    payment_method = serializers.ChoiceField(choices=Payment._meta.get_field('payment_method').choices,
+                                             default='bank_transfer')
+
+
 class LoanCalculatorSerializer(serializers.Serializer):
     loan_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
     interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
@@ -283,197 +292,36 @@ class LoanCalculatorSerializer(serializers.Serializer):
         ('interest_first', 'Interest-Only Loans'),
     ])
     repayment_start_date = serializers.DateField()
+    summary_only = serializers.BooleanField(
+        default=False, help_text="Return only the installment and totals, computed without building the schedule.")
+    offset = serializers.IntegerField(
+        required=False, min_value=0, help_text="Number of installments to skip; the schedule is streamed.")
+    limit = serializers.IntegerField(
+        required=False, min_value=1, help_text="Maximum number of installments to return; the schedule is streamed.")
+
+    # Options that change what is returned, not the repayment plan itself
+    OPTION_FIELDS = ('summary_only', 'offset', 'limit')
 
     def calculate_repayment_schedule(self, validated_data):
-        loan_amount = validated_data['loan_amount']
-        interest_rate = validated_data['interest_rate']
-        tenure = validated_data['tenure']
-        tenure_type = validated_data['tenure_type']
-        repayment_schedule = validated_data['repayment_schedule']
-        repayment_mode = validated_data['repayment_mode']
-        interest_basis = validated_data['interest_basis']
-        loan_calculation_method = validated_data['loan_calculation_method']
-        repayment_start_date = validated_data['repayment_start_date']
-
-        getcontext().prec = 10  # Set precision for decimal operations
-
-        # Determine the number of periods based on the repayment schedule
-        if repayment_schedule == 'daily':
-            periods = tenure if tenure_type == 'days' else tenure * 365 // {'weeks': 7, 'months': 30, 'years': 365}[
-                tenure_type]
-            interval = timedelta(days=1)
-        elif repayment_schedule == 'weekly':
-            periods = tenure if tenure_type == 'weeks' else tenure * 52 // {'days': 1 / 7, 'months': 4, 'years': 52}[
-                tenure_type]
-            interval = timedelta(weeks=1)
-        elif repayment_schedule == 'monthly':
-            periods = tenure if tenure_type == 'months' else tenure * 12 // {'days': 1 / 30, 'weeks': 4, 'years': 12}[
-                tenure_type]
-            interval = timedelta(days=30)  # Approximation for a month
-        elif repayment_schedule == 'quarterly':
-            periods = tenure * 4 // {'months': 3, 'years': 4}[tenure_type]
-            interval = timedelta(days=90)
-        elif repayment_schedule == 'halfyearly':
-            periods = tenure * 2 // {'months': 6, 'years': 2}[tenure_type]
-            interval = timedelta(days=182)
-        elif repayment_schedule == 'annually':
-            periods = tenure if tenure_type == 'years' else tenure * 1 // \
-                                                            {'days': 1 / 365, 'weeks': 1 / 52, 'months': 1 / 12}[
-                                                                tenure_type]
-            interval = timedelta(days=365)
-        else:  # one_time
-            periods = 1
-            interval = None  # No interval as it's a one-time payment
-
-        # Adjust interest rate based on the interest basis (365 or other)
-        if interest_basis == '365':
-            period_interest_rate = interest_rate / Decimal(100) / Decimal(365 / periods)
-        else:
-            # Placeholder for other basis
-            period_interest_rate = interest_rate / Decimal(100) / Decimal(365 / periods)
-
-        # Initialize totals
-        total_principal = Decimal(0)
-        total_interest = Decimal(0)
-
-        # Initialize repayment plan and remaining principal
-        repayment_plan = []
-        remaining_principal = loan_amount
-
-        # Implement loan calculation methods
-        if loan_calculation_method == 'reducing_balance':
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = loan_amount / periods
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'flat_rate':
-            fixed_interest = loan_amount * interest_rate / Decimal(100) * tenure / Decimal(12)
-            monthly_payment = (loan_amount + fixed_interest) / periods
-            for period in range(1, periods + 1):
-                interest_payment = fixed_interest / periods
-                principal_payment = loan_amount / periods
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'constant_repayment':
-            monthly_payment = (loan_amount * period_interest_rate) / (1 - (1 + period_interest_rate) ** -periods)
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = monthly_payment - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'simple_interest':
-            interest_payment = loan_amount * interest_rate / Decimal(100) * tenure / Decimal(12)
-            for period in range(1, periods + 1):
-                principal_payment = loan_amount / periods
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(
-                    self.build_repayment_entry(period, principal_payment, interest_payment / periods, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment / periods
-
-        elif loan_calculation_method == 'compound_interest':
-            compound_factor = (1 + period_interest_rate) ** periods
-            total_amount = loan_amount * compound_factor
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = total_amount / periods - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'graduated_repayment':
-            initial_payment = loan_amount / periods
-            increment_factor = Decimal(1.05)  # 5% increment per period
-            for period in range(1, periods + 1):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = initial_payment * (increment_factor ** (period - 1))
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-        elif loan_calculation_method == 'balloon_payment':
-            balloon_amount = loan_amount * Decimal(0.5)  # 50% as balloon payment
-            monthly_payment = (loan_amount - balloon_amount) / (periods - 1)
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                principal_payment = monthly_payment - interest_payment
-                remaining_principal -= principal_payment
-
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, principal_payment, interest_payment, due_date))
-                total_principal += principal_payment
-                total_interest += interest_payment
-
-            # Balloon payment in the last period
-            repayment_plan.append(
-                self.build_repayment_entry(periods, balloon_amount, remaining_principal * period_interest_rate,
-                                           repayment_start_date + (interval * (periods - 1))))
-            total_principal += balloon_amount
-            total_interest += remaining_principal * period_interest_rate
-
-        elif loan_calculation_method == 'bullet_repayment':
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, 0, interest_payment, due_date))
-                total_interest += interest_payment
-
-            # Principal paid in the last period
-            repayment_plan.append(
-                self.build_repayment_entry(periods, loan_amount, remaining_principal * period_interest_rate,
-                                           repayment_start_date + (interval * (periods - 1))))
-            total_principal += loan_amount
-            total_interest += remaining_principal * period_interest_rate
-
-        elif loan_calculation_method == 'interest_first':
-            for period in range(1, periods):
-                interest_payment = remaining_principal * period_interest_rate
-                due_date = repayment_start_date + (interval * (period - 1)) if interval else repayment_start_date
-                repayment_plan.append(self.build_repayment_entry(period, 0, interest_payment, due_date))
-                total_interest += interest_payment
-
-            # Principal paid in the last period
-            repayment_plan.append(
-                self.build_repayment_entry(periods, loan_amount, 0, repayment_start_date + (interval * (periods - 1))))
-            total_principal += loan_amount
-
-        return {
-            'repayment_plan': repayment_plan,
-            'total_principal': round(total_principal, 2),
-            'total_interest': round(total_interest, 2),
-            'total_amount_to_repay': round(total_principal + total_interest, 2)
-        }
-
-    def build_repayment_entry(self, period, principal, interest, due_date):
-        return {
-            'period': period,
-            'principal': round(principal, 2),
-            'interest': round(interest, 2),
-            'installment': round(principal + interest, 2),
-            'due_date': due_date.strftime('%Y-%m-%d') if due_date else None,
-        }
+        if validated_data.get('summary_only'):
+            return self.calculate_summary(validated_data).as_dict()
+        return self.calculate_schedule(validated_data).as_dict()
+
+    def calculate_schedule(self, validated_data):
+        return self.get_calculator(validated_data).calculate_schedule()
+
+    def calculate_summary(self, validated_data):
+        return self.get_calculator(validated_data).calculate_summary()
+
+    def iter_schedule(self, validated_data):
+        return self.get_calculator(validated_data).iter_schedule(validated_data.get('offset', 0),
+                                                                validated_data.get('limit'))
+
+    def get_calculator(self, validated_data):
+        return ReusableLoanCalculator(**self.calculator_inputs(validated_data))
+
+    def calculator_inputs(self, validated_data):
+        return {field: value for field, value in validated_data.items() if field not in self.OPTION_FIELDS}
 
 
 class LoanApprovalSerializer(serializers.ModelSerializer):
@@ -486,6 +334,7 @@ class LoanApprovalSerializer(serializers.ModelSerializer):
     ], required=True)
     application_expiry_date = serializers.DateField(required=True)
     repayment_start_date = serializers.DateField(read_only=True)
+    schedules_created = serializers.IntegerField(read_only=True, help_text="Repayment schedule rows written.")
 
     class Meta:
         model = LoanApplication
@@ -544,19 +393,22 @@ class LoanModificationSerializer(serializers.ModelSerializer):
         return modification
 
     def get_remaining_principal(self, loan_application):
-        future_schedules = LoanSchedule.objects.filter(
-            application=loan_application,
-            due_date__gte=timezone.now()
-        )
-        return sum(schedule.principal_amount for schedule in future_schedules if schedule.status == 'pending')
+        return LoanSchedule.remaining_principal(loan_application, timezone.localdate())
 
 
 # Past Due Processing ------
 
 class PastDueRecordSerializer(serializers.ModelSerializer):
+    # Derived from overdue_date as of today instead of the stored value, which is not maintained
+    days_overdue = serializers.SerializerMethodField()
+
     class Meta:
         model = PastDueRecord
         fields = '__all__'
+        read_only_fields = ['pd_bucket']
+
+    def get_days_overdue(self, record):
+        return record.days_overdue_on(timezone.localdate())
 
 
 class PDActionWorkflowConfigSerializer(serializers.ModelSerializer):
@@ -1,109 +1,114 @@
-from celery import shared_task
+from celery import chord, group, shared_task
 from .models import *
 from django.utils import timezone
 from decimal import Decimal
 from datetime import datetime
+from django.utils.dateparse import parse_date
+from . import balances, eod, repayments
 
 
 @shared_task
-def calculate_interest_accruals():
-    today = timezone.now().date()
-    loan_accounts = LoanAccount.objects.all()
-    for loan in loan_accounts:
-        interest_amount = (loan.principal_amount * loan.interest_rate) / 100 / 365  # Daily interest
-        accrual = LoanInterestAccrual.objects.create(
-            loan_account=loan,
-            accrual_date=today,
-            interest_amount=interest_amount
-        )
-        LoanAccountEntry.objects.create(
-            loan_account=loan,
-            entry_type='interest',
-            amount=interest_amount,
-            entry_date=today,
-            description=f'Interest accrued for {today}',
-        )
+def calculate_interest_accruals(accrual_date=None):
+    # Set-based and idempotent per accrual_date, see eod.accrue_interest
+    accrual_date = parse_date(accrual_date) if accrual_date else timezone.now().date()
+    result = eod.accrue_interest(accrual_date)
+    return {'accrual_date': str(accrual_date), 'accounts': result['accounts'], 'interest': str(result['interest'])}
 
 
 @shared_task
-def process_loan_repayments():
-    # Logic to process due repayments
-    pass
+def process_loan_repayments(business_date=None):
+    # Collects the repayments due by business_date in batches, see repayments.process_due_repayments
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    result = repayments.process_with_metrics(business_date)
+    return dict(result, business_date=str(business_date), collected=str(result['collected']))
 
 
 @shared_task
-def handle_repayment_retries():
-    # Logic to handle retries for failed repayments
-    pass
+def handle_repayment_retries(business_date=None):
+    # Collects the failed repayments whose retry is due, see repayments.process_repayment_retries
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    result = repayments.process_repayment_retries(business_date)
+    return dict(result, business_date=str(business_date), collected=str(result['collected']))
 
 
 @shared_task
-def apply_penalties_for_missed_repayments():
-    today = timezone.now().date()
-    # Logic to calculate and apply penalties
-    pass
+def apply_penalties_for_missed_repayments(penalty_date=None):
+    # Set-based and idempotent per penalty_date, see eod.accrue_penalties
+    penalty_date = parse_date(penalty_date) if penalty_date else timezone.now().date()
+    result = eod.accrue_penalties(penalty_date)
+    return dict(result, penalty_date=str(penalty_date), penalty=str(result['penalty']))
 
 
 @shared_task
 def final_failed_repayment_handling():
-    # Logic to handle final failed repayments
-    pass
+    # The retry cycle moves accounts to FailedLoanRepayments after their last attempt; this sweeps up the queued
+    # retries that are over the limit
+    return {'failed': repayments.fail_exhausted_retries()}
 
 
 @shared_task
 def eod_pd_action_workflow():
     today = datetime.today().date()
-    actions = PDNextAction.objects.filter(next_action_date__lte=today, action_status='Pending')
+    return eod.run_pd_actions(today)
 
-    for action in actions:
-        # Perform the next action (e.g., send reminder, apply penalty)
-        # Logic to perform the action goes here
 
-        # Update action status to completed
-        action.action_status = 'Completed'
-        action.save()
+@shared_task
+def detect_delinquencies(business_date=None):
+    # Creates the PastDueRecords of newly overdue installments, see eod.detect_delinquencies
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    return eod.detect_delinquencies(business_date)
+
 
-        # Update PD Record Status and create the next action if needed
-        pd_record = action.pd_record_id
-        workflow = PDActionWorkflowConfig.objects.get(current_pd_status=action.current_pd_status)
+@shared_task
+def snapshot_balances(business_date=None):
+    # Records every account's closing balance of business_date, see balances.snapshot_balances
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    return balances.snapshot_balances(business_date)
 
-        # Update PD Record Status
-        pd_record.status = workflow.next_pd_status
-        pd_record.save()
 
-        # Create next action
-        next_action_date = today + timedelta(days=workflow.action_timeline_days)
-        PDNextAction.objects.create(
-            pd_record_id=pd_record,
-            next_action_date=next_action_date,
-            next_action_type=workflow.next_action_type,
-            current_pd_status=workflow.next_pd_status
-        )
+@shared_task
+def age_past_due_records(business_date=None):
+    # Moves only the records crossing an aging boundary, see eod.age_past_due_records
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    return eod.age_past_due_records(business_date)
 
 
 @shared_task
 def apply_pd_penalties_charges():
     today = datetime.today().date()
-    pd_records = PastDueRecord.objects.filter(status='Active')
-
-    for record in pd_records:
-        config = PDPenaltiesChargesConfig.objects.filter(charge_trigger__lte=record.days_overdue).first()
-
-        if config:
-            penalty = PenaltyAccrual.objects.create(
-                pd_record_id=record,
-                penalty_amount=config.charge_amount,
-                penalty_date=today,
-                penalty_type=config.penalty_type,
-                status='Applied'
-            )
-
-            # Post to Loan Account Receivables
-            LoanAccountReceivable.objects.create(
-                loan_account_id=record.loan_account_id,
-                pd_record_id=record,
-                amount_type=config.penalty_type,
-                amount_due=config.charge_amount,
-                due_date=today,
-                status='Due'
-            )
+    return eod.apply_pd_penalties(today)
+
+
+@shared_task
+def run_end_of_day(business_date=None, shard_count=None):
+    # Runs every EOD stage over id-range shards of the loan book, see eod.run_end_of_day
+    business_date = parse_date(business_date) if business_date else timezone.now().date()
+    result = eod.run_end_of_day(business_date, shard_count)
+    return result if isinstance(result, dict) else result.id
+
+
+@shared_task
+def run_eod_shard(checkpoint_id):
+    return eod.run_checkpoint(checkpoint_id)
+
+
+# Fans a stage out over its unfinished shards as a chord; the callback starts the next stage
+def start_eod_stage(run_id, stage):
+    run = EODRun.objects.get(pk=run_id)
+    checkpoint_ids = eod.pending_checkpoints(run, stage)
+    if not checkpoint_ids:
+        return finish_eod_stage.delay([], run_id, stage)
+    header = group(run_eod_shard.s(checkpoint_id) for checkpoint_id in checkpoint_ids)
+    return chord(header)(finish_eod_stage.s(run_id, stage))
+
+
+@shared_task
+def finish_eod_stage(shard_results, run_id, stage):
+    run = EODRun.objects.get(pk=run_id)
+    eod.settle_gl_deltas(run, stage)
+    stages = list(eod.STAGES)
+    position = stages.index(stage) + 1
+    if position < len(stages) and not eod.stage_failed(run, stage):
+        start_eod_stage(run_id, stages[position])
+        return None
+    return eod.end_run(run)
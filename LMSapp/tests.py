@@ -1,3 +1,1177 @@
-from django.test import TestCase
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal, localcontext
+from itertools import count
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from . import (balances, calendars, eod, payment_imports, postings, quote_cache, repayments, schedule_engine,
+               vectorized, waterfall)
+from .models import (Account, AccountBalanceSnapshot, Company, Customer, DueRegister, EODCheckpoint, EODRun,
+                     FailedLoanRepayments, LatePayment, LoanAccount, LoanAccountBalanceSnapshot, LoanAccountEntry,
+                     LoanAccountReceivable, LoanApplication, LoanInterestAccrual, LoanModification,
+                     LoanPenaltiesAccrual, LoanRepaymentTry, LoanSchedule, PaidItem, PastDueRecord, Payment,
+                     PDActionWorkflowConfig, PDNextAction, PDPenaltiesChargesConfig, PenaltyAccrual, RepaymentAccount,
+                     RepaymentEODRetry, RepaymentPriority, RepaymentSchedule, ReusableLoanCalculator, Transaction)
+
+_customer_numbers = count(1)
+
+CALCULATION_METHODS = ['reducing_balance', 'flat_rate', 'constant_repayment', 'simple_interest', 'compound_interest',
+                       'graduated_repayment', 'balloon_payment', 'bullet_repayment', 'interest_first']
+
+
+def calculator_inputs(**overrides):
+    inputs = {
+        'loan_amount': Decimal('75000'),
+        'interest_rate': Decimal('12.5'),
+        'tenure': 36,
+        'tenure_type': 'months',
+        'repayment_schedule': 'monthly',
+        'interest_basis': '365',
+        'loan_calculation_method': 'reducing_balance',
+        'repayment_start_date': date(2026, 1, 31),
+    }
+    inputs.update(overrides)
+    return inputs
+
+
+@skipUnless(vectorized.is_available(), "The vectorized engine requires NumPy")
+class EngineParityTests(SimpleTestCase):
+
+    def assert_parity(self, inputs):
+        expected = schedule_engine.calculate_schedule(**inputs)
+        actual = schedule_engine.calculate_schedule(**inputs, engine='vectorized')
+        for field in ('total_principal', 'total_interest', 'total_amount_to_repay'):
+            self.assertEqual(getattr(actual, field), getattr(expected, field))
+        for schedule in (expected, actual):
+            self.assertEqual(sum(row.principal for row in schedule), schedule.total_principal)
+            self.assertEqual(sum(row.interest for row in schedule), schedule.total_interest)
+            self.assertEqual(sum(row.installment for row in schedule), schedule.total_amount_to_repay)
+
+        # Rows before the last, which is trued up, are rounded from float64 and DECIMAL_PRECISION amounts
+        expected_rows, actual_rows = list(expected), list(actual)
+        self.assertEqual(len(actual_rows), len(expected_rows))
+        for expected_row, actual_row in zip(expected_rows[:-1], actual_rows[:-1]):
+            for field in ('principal', 'interest', 'installment'):
+                self.assertLessEqual(abs(getattr(expected_row, field) - getattr(actual_row, field)), Decimal('0.01'))
+        self.assertEqual([row.due_date for row in actual_rows], [row.due_date for row in expected_rows])
+
+    def test_every_method_matches_the_decimal_engine(self):
+        for method in CALCULATION_METHODS:
+            for loan_amount in ('1000', '75000', '250000.55'):
+                for tenure in (12, 36, 60):
+                    with self.subTest(method=method, loan_amount=loan_amount, tenure=tenure):
+                        self.assert_parity(calculator_inputs(loan_calculation_method=method,
+                                                             loan_amount=Decimal(loan_amount), tenure=tenure))
+
+    def test_long_daily_schedules_match_the_decimal_engine(self):
+        for method in ('reducing_balance', 'flat_rate', 'simple_interest', 'bullet_repayment', 'interest_first'):
+            with self.subTest(method=method):
+                self.assert_parity(calculator_inputs(loan_calculation_method=method, loan_amount=Decimal('25000'),
+                                                     tenure=730, tenure_type='days', repayment_schedule='daily',
+                                                     interest_rate=Decimal('0.5')))
+
+    def test_batch_matches_single_schedules(self):
+        items = [calculator_inputs(loan_calculation_method=method) for method in CALCULATION_METHODS]
+        schedules = schedule_engine.calculate_schedules(items, engine='vectorized')
+        for item, schedule in zip(items, schedules):
+            single = schedule_engine.calculate_schedule(**item, engine='vectorized')
+            self.assertEqual(schedule.as_dict(), single.as_dict())
+
+    def test_rows_are_rounded_per_period_and_the_last_one_trued_up(self):
+        principal, interest = vectorized.to_minor_units(
+            vectorized.np.array([[0.125, 0.135, 0.5]]), vectorized.np.array([[0.0, 0.0, 0.0]]), [77], [1])
+        self.assertEqual(principal.tolist(), [[12, 14, 51]])  # Half to even, like round() on a Decimal
+        self.assertEqual(interest.tolist(), [[0, 0, 1]])
+
+    def test_the_response_has_the_decimal_engines_amounts(self):
+        inputs = calculator_inputs(loan_calculation_method='flat_rate')
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(schedule_engine.calculate_schedule(**inputs, engine='vectorized').as_dict()),
+                         renderer.render(schedule_engine.calculate_schedule(**inputs).as_dict()))
+
+
+# The loan calculator request body of calculator_inputs(**overrides)
+def calculator_payload(**overrides):
+    payload = {field: str(value) for field, value in calculator_inputs(**overrides).items()}
+    payload['repayment_mode'] = 'both'
+    return payload
+
+
+class ClosedFormTests(SimpleTestCase):
+
+    PLANS = [
+        {},
+        {'loan_amount': Decimal('250000.55'), 'interest_rate': Decimal('24'), 'tenure': 5, 'tenure_type': 'years',
+         'repayment_schedule': 'quarterly'},
+        {'loan_amount': Decimal('9999.99'), 'interest_rate': Decimal('18'), 'tenure': 104, 'tenure_type': 'weeks',
+         'repayment_schedule': 'weekly'},
+        {'loan_amount': Decimal('25000'), 'interest_rate': Decimal('0.5'), 'tenure': 180, 'tenure_type': 'days',
+         'repayment_schedule': 'daily'},
+    ]
+
+    def test_every_method_has_closed_forms_matching_its_period_loop(self):
+        for method in CALCULATION_METHODS:
+            for plan in self.PLANS:
+                inputs = calculator_inputs(**plan, loan_calculation_method=method)
+                with self.subTest(method=method, schedule=inputs['repayment_schedule']):
+                    periods, period_interest_rate = schedule_engine.schedule_terms(
+                        inputs['tenure'], inputs['tenure_type'], inputs['repayment_schedule'],
+                        inputs['interest_rate'], inputs['interest_basis'])
+                    terms = (inputs['loan_amount'], inputs['interest_rate'], inputs['tenure'], periods,
+                             period_interest_rate, method)
+                    # Both at the closed forms' precision, so only the formulas can differ
+                    with localcontext() as context:
+                        context.prec = schedule_engine.SUMMARY_PRECISION
+                        installment, total_principal, total_interest = schedule_engine.closed_form_totals(*terms)
+                        amounts = list(schedule_engine.iter_period_amounts(*terms))
+                    self.assertEqual(round(installment, 2), round(sum(amounts[0]), 2))
+                    self.assertEqual(round(total_principal, 2), round(sum(p for p, _ in amounts), 2))
+                    self.assertEqual(round(total_interest, 2), round(sum(i for _, i in amounts), 2))
+
+    def test_a_summary_has_the_totals_of_the_calculated_schedule(self):
+        for method in CALCULATION_METHODS:
+            for plan in self.PLANS:
+                inputs = calculator_inputs(**plan, loan_calculation_method=method)
+                with self.subTest(method=method, schedule=inputs['repayment_schedule']):
+                    summary = schedule_engine.calculate_summary(**inputs)
+                    schedule = schedule_engine.calculate_schedule(**inputs)
+                    self.assertEqual(summary.periods, len(schedule.rows))
+                    for field in ('total_principal', 'total_interest', 'total_amount_to_repay'):
+                        self.assertEqual(getattr(summary, field), getattr(schedule, field))
+
+
+class LoanCalculatorViewTests(TestCase):
+
+    def post(self, data, **headers):
+        payload = {**calculator_payload(), **data}
+        return self.client.post('/loan-calculator/', payload, content_type='application/json', headers=headers)
+
+    def expected_rows(self, **overrides):
+        schedule = schedule_engine.calculate_schedule(**calculator_inputs(**overrides))
+        return json.loads(JSONRenderer().render(schedule.as_dict()))
+
+    def test_an_ndjson_schedule_has_a_line_per_installment_then_the_totals(self):
+        response = self.post({}, accept='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        expected = self.expected_rows()
+        self.assertEqual(lines[:-1], expected['repayment_plan'])
+        self.assertEqual(lines[-1], {'number_of_installments': 36, 'offset': 0, 'limit': None,
+                                     'total_principal': expected['total_principal'],
+                                     'total_interest': expected['total_interest'],
+                                     'total_amount_to_repay': expected['total_amount_to_repay']})
+
+    def test_a_window_has_its_installments_and_the_totals_of_the_whole_plan(self):
+        response = self.post({'offset': 10, 'limit': 5})
+
+        self.assertEqual(response.status_code, 200)
+        plan = json.loads(b''.join(response.streaming_content))
+        expected = self.expected_rows()
+        self.assertEqual(plan['repayment_plan'], expected['repayment_plan'][10:15])
+        self.assertEqual((plan['offset'], plan['limit'], plan['number_of_installments']), (10, 5, 36))
+        self.assertEqual(plan['total_amount_to_repay'], expected['total_amount_to_repay'])
+
+    @override_settings(LOAN_CALCULATOR_STREAM_THRESHOLD=12)
+    def test_a_long_schedule_is_streamed_as_the_usual_response(self):
+        response = self.post({})
+
+        self.assertTrue(response.streaming)
+        plan = json.loads(b''.join(response.streaming_content))
+        expected = self.expected_rows()
+        self.assertEqual(plan['repayment_plan'], expected['repayment_plan'])
+        self.assertEqual(plan['total_principal'], expected['total_principal'])
+
+    def test_a_schedule_the_engine_cannot_calculate_is_a_bad_request(self):
+        # Served whole, streamed as a window and streamed as NDJSON
+        for data, accept in (({}, 'application/json'), ({'limit': 1}, 'application/json'),
+                             ({}, 'application/x-ndjson')):
+            with self.subTest(data=data, accept=accept), self.assertLogs('django.request', 'WARNING'):
+                response = self.post({'loan_calculation_method': 'balloon_payment', 'tenure': 1, **data},
+                                     accept=accept)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.streaming)
+                self.assertIn('non_field_errors', json.loads(response.content))
+
+
+@override_settings(LOAN_CALCULATOR_BATCH_CHUNK_SIZE=2)
+class LoanCalculatorBatchViewTests(TestCase):
+
+    def post(self, body, content_type):
+        response = self.client.post('/loan-calculator/batch/', body, content_type=content_type)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_a_json_array_gets_a_line_per_loan_in_input_order(self):
+        items = [calculator_payload(), calculator_payload(loan_calculation_method='flat_rate', summary_only='true'),
+                 {**calculator_payload(), 'tenure_type': 'fortnights'},
+                 calculator_payload(loan_calculation_method='balloon_payment', tenure=1)]
+        lines = self.post(json.dumps(items), 'application/json')
+
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2, 3])
+        # The batch engine's totals are those of the single loan calculator
+        expected = schedule_engine.calculate_schedule(**calculator_inputs())
+        self.assertEqual(len(lines[0]['result']['repayment_plan']), 36)
+        self.assertEqual(lines[0]['result']['total_amount_to_repay'], float(expected.total_amount_to_repay))
+        summary = schedule_engine.calculate_summary(**calculator_inputs(loan_calculation_method='flat_rate'))
+        self.assertEqual(lines[1]['result']['total_interest'], float(summary.total_interest))
+        self.assertIn('tenure_type', lines[2]['errors'])
+        self.assertIn('non_field_errors', lines[3]['errors'])
+
+    def test_an_ndjson_stream_gets_an_error_line_for_each_line_that_does_not_parse(self):
+        body = '\n'.join([json.dumps(calculator_payload()), '{"loan_amount": ', '',
+                          json.dumps(calculator_payload(tenure=12))]) + '\n'
+        lines = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2])
+        self.assertEqual(len(lines[0]['result']['repayment_plan']), 36)
+        self.assertIn('NDJSON parse error', lines[1]['errors']['non_field_errors'][0])
+        self.assertEqual(len(lines[2]['result']['repayment_plan']), 12)
+
+    def test_a_single_object_is_a_bad_request(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.post('/loan-calculator/batch/', calculator_payload(),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+# A loan account with `installments` pending monthly installments of 100.00 (80.00 principal, 20.00 interest),
+# the first one due on first_due_date
+def create_loan(balance=Decimal('1000.00'), installments=0, first_due_date=date(2026, 1, 31), loan_type='personal',
+                **account_fields):
+    number = next(_customer_numbers)
+    customer = Customer.objects.create(name=f'Customer {number}', email=f'customer{number}@example.com',
+                                       phone_number='0700000000', address='1 Main Street',
+                                       date_of_birth=date(1990, 1, 1))
+    application = LoanApplication.objects.create(customer=customer, loan_type=loan_type, loan_amount=balance,
+                                                 interest_rate=Decimal('12.00'), status='approved')
+    RepaymentSchedule.objects.bulk_create([
+        RepaymentSchedule(loan_application=application, installment_number=number,
+                          due_date=first_due_date + timedelta(days=30 * (number - 1)),
+                          principal_amount=Decimal('80.00'), interest_amount=Decimal('20.00'),
+                          total_amount=Decimal('100.00'))
+        for number in range(1, installments + 1)
+    ])
+    return LoanAccount.objects.create(loan_application=application, balance=balance, **account_fields)
+
+
+class PaymentImportTests(TestCase):
+
+    def test_every_line_gets_a_result_in_file_order(self):
+        loan_account = create_loan(installments=2)
+        items = [
+            {'loan_account_id': loan_account.pk, 'amount': '150.00', 'payment_date': '2026-02-01'},
+            {'loan_account_id': loan_account.pk, 'amount': '-1'},
+            ParseError('Line 3 is not valid JSON.'),
+            {'loan_account_id': 999999, 'amount': '10.00'},
+        ]
+        lines = list(payment_imports.import_payments(items, chunk_size=3))
+
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2, 3])
+        self.assertEqual(lines[0]['result']['installments_paid'], 1)
+        self.assertEqual(lines[0]['result']['advance_payment'], Decimal('50.00'))
+        self.assertIn('amount', lines[1]['errors'])
+        self.assertIn('non_field_errors', lines[2]['errors'])
+        self.assertIn('loan_account_id', lines[3]['errors'])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_a_failed_chunk_gets_an_error_line_for_every_line_and_posts_nothing(self):
+        loan_accounts = [create_loan() for _ in range(4)]
+        items = [{'loan_account_id': loan_account.pk, 'amount': '10.00'} for loan_account in loan_accounts]
+        post_repayments = repayments.post_repayments
+
+        def fail_second_chunk(lines, ledger):
+            if lines[0][1]['loan_account_id'] == loan_accounts[2].pk:
+                raise RuntimeError("Connection lost")
+            return post_repayments(lines, ledger)
+
+        with mock.patch.object(repayments, 'post_repayments', fail_second_chunk), \
+                self.assertLogs('LMSapp.payment_imports', 'ERROR'):
+            lines = list(payment_imports.import_payments(items, chunk_size=2))
+
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2, 3])
+        self.assertTrue(all('result' in line for line in lines[:2]))
+        for line in lines[2:]:
+            self.assertIn('Connection lost', line['errors']['non_field_errors'][0])
+        advances = dict(LoanAccount.objects.values_list('pk', 'advance_payment_balance'))
+        self.assertEqual([advances[loan_account.pk] for loan_account in loan_accounts],
+                         [Decimal('10.00'), Decimal('10.00'), Decimal('0.00'), Decimal('0.00')])
+
+
+@override_settings(PAYMENT_IMPORT_CHUNK_SIZE=1)
+class PaymentImportViewTests(TestCase):
+
+    def test_the_whole_file_is_posted_before_the_results_are_read(self):
+        loan_accounts = [create_loan(installments=1) for _ in range(3)]
+        body = ''.join(json.dumps({'loan_account_id': loan_account.pk, 'amount': '100.00'}) + '\n'
+                       for loan_account in loan_accounts)
+        response = self.client.post('/payment-imports/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(Payment.objects.count(), 3)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(line['index'], line['result']['installments_paid']) for line in lines],
+                         [(0, 1), (1, 1), (2, 1)])
+
+    def test_the_lines_read_before_a_file_stops_parsing_keep_their_results(self):
+        loan_account = create_loan()
+        body = f'loan_account_id,amount\n{loan_account.pk},10.00\n'.encode() + b'\xff,1\n'
+        response = self.client.post('/payment-imports/', body, content_type='text/csv')
+
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['result']['advance_payment'], 10.0)
+        self.assertEqual(lines[1]['index'], 1)
+        self.assertIn('The rest of the file was not read', lines[1]['errors']['non_field_errors'][0])
+        loan_account.refresh_from_db()
+        self.assertEqual(loan_account.advance_payment_balance, Decimal('10.00'))
+
+
+class ScheduleRecalculationTests(TestCase):
+
+    def setUp(self):
+        self.application = create_loan(balance=Decimal('6000.00')).loan_application
+        LoanApplication.objects.filter(pk=self.application.pk).update(term_count=6)
+        LoanSchedule.objects.bulk_create([
+            LoanSchedule(application=self.application, installment_number=number,
+                         due_date=date(2026, number, 28), principal_amount=Decimal('1000.00'),
+                         interest_amount=Decimal('60.00'), total_amount=Decimal('1060.00'),
+                         status='paid' if number in (1, 3) else 'pending')
+            for number in range(1, 7)
+        ])
+        self.modification = LoanModification.objects.create(
+            loan_application=self.application, current_principal_amount=Decimal('6000.00'),
+            new_interest_rate=Decimal('10.00'), status='approved', modified_by='tests')
+        LoanModification.objects.filter(pk=self.modification.pk).update(
+            modification_date=timezone.make_aware(datetime(2026, 2, 15, 12)))
+        self.modification.refresh_from_db()
+
+    def rows(self):
+        rows = LoanSchedule.objects.filter(application=self.application).order_by('installment_number')
+        return list(rows.values_list('installment_number', 'due_date', 'total_amount', 'status'))
+
+    def test_the_new_tail_starts_after_the_last_paid_installment(self):
+        before = self.rows()
+        result = self.modification.recalculate_future_schedules(incremental=True)
+
+        rows = self.rows()
+        self.assertEqual(result, {'updated': 3, 'created': 3, 'deleted': 0})
+        self.assertEqual(rows[:3], before[:3])
+        self.assertEqual([row[0] for row in rows], list(range(1, 10)))
+        self.assertTrue(all(row[3] == 'pending' for row in rows[3:]))
+        self.assertEqual(rows[3][1], date(2026, 2, 15))
+
+    def test_incremental_and_full_recalculation_write_the_same_rows(self):
+        self.modification.recalculate_future_schedules(incremental=True)
+        incremental = self.rows()
+        self.assertEqual(self.modification.recalculate_future_schedules(incremental=True),
+                         {'updated': 0, 'created': 0, 'deleted': 0})
+        self.modification.recalculate_future_schedules(incremental=False)
+        self.assertEqual(self.rows(), incremental)
+
+
+class RepayLoanTests(TestCase):
+
+    def test_the_amount_is_rounded_half_up_to_the_cent(self):
+        loan_account = create_loan(installments=1)
+        result = repayments.repay_loan(loan_account.pk, '100.005', payment_date=date(2026, 2, 1))
+
+        self.assertEqual(result['installments_paid'], 1)
+        self.assertEqual(result['advance_payment'], Decimal('0.01'))
+        entry = LoanAccountEntry.objects.get(loan_account=loan_account)
+        self.assertEqual(entry.amount, Decimal('100.01'))
+
+    def test_non_positive_and_invalid_amounts_are_rejected_before_posting(self):
+        loan_account = create_loan(installments=1)
+        for amount in ('0', '-5', '0.004', 'abc', 'NaN', 'Infinity'):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                repayments.repay_loan(loan_account.pk, amount)
+        self.assertFalse(LoanAccountEntry.objects.filter(loan_account=loan_account).exists())
+
+
+# A loan with 20.00 of interest and 80.00 of principal due on 2026-03-01 and `funds` in its repayment account
+def create_loan_with_dues(funds):
+    loan_account = create_loan()
+    RepaymentAccount.objects.create(loan_account=loan_account, balance=funds)
+    for due_type, amount in (('interest', Decimal('20.00')), ('principal', Decimal('80.00'))):
+        DueRegister.objects.create(loan_account=loan_account, due_type=due_type, amount=amount,
+                                   due_date=date(2026, 3, 1))
+    return loan_account
+
+
+class RepaymentCollectionTests(TestCase):
+
+    def test_partial_full_and_overpaid_dues_are_collected(self):
+        partial, full, overpaid = [create_loan_with_dues(Decimal(funds))
+                                   for funds in ('50.00', '100.00', '150.00')]
+        updated_at = {loan_account.pk: loan_account.updated_at for loan_account in (partial, full, overpaid)}
+
+        self.assertEqual(repayments.process_due_repayments(date(2026, 3, 1)),
+                         {'loans': 3, 'paid_in_full': 2, 'items_paid': 5, 'collected': Decimal('250.00')})
+
+        funds = dict(RepaymentAccount.objects.values_list('loan_account_id', 'balance'))
+        self.assertEqual([funds[loan_account.pk] for loan_account in (partial, full, overpaid)],
+                         [Decimal('0.00'), Decimal('0.00'), Decimal('50.00')])
+        # The interest ranks first, so the part payment pays it and 30.00 of the principal
+        unpaid = DueRegister.objects.get(is_paid=False)
+        self.assertEqual((unpaid.loan_account_id, unpaid.due_type), (partial.pk, 'principal'))
+        self.assertEqual(PaidItem.objects.get(due_register=unpaid).amount_paid, Decimal('30.00'))
+        self.assertEqual(list(RepaymentEODRetry.objects.values_list('loan_account_id', flat=True)), [partial.pk])
+        self.assertEqual(dict(LoanRepaymentTry.objects.values_list('loan_account_id', 'status')),
+                         {partial.pk: 'failed', full.pk: 'successful', overpaid.pk: 'successful'})
+        for loan_account in LoanAccount.objects.filter(pk__in=updated_at):
+            self.assertGreater(loan_account.updated_at, updated_at[loan_account.pk])
+
+    def test_partial_full_and_overpayments_from_a_payment_file_are_posted(self):
+        loan_accounts = [create_loan(installments=2) for _ in range(3)]
+        updated_at = {loan_account.pk: loan_account.updated_at for loan_account in loan_accounts}
+        lines = [(position, {'loan_account_id': loan_account.pk, 'amount': Decimal(amount),
+                             'payment_date': date(2026, 2, 1), 'payment_method': 'bank_transfer'})
+                 for position, (loan_account, amount) in enumerate(zip(loan_accounts, ('50.00', '100.00', '150.00')))]
+
+        results = repayments.post_repayments(lines, repayments.get_repayment_ledger())
+
+        self.assertEqual([(results[position]['result']['installments_paid'],
+                           results[position]['result']['advance_payment']) for position in range(3)],
+                         [(0, Decimal('50.00')), (1, Decimal('0.00')), (1, Decimal('50.00'))])
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(RepaymentSchedule.objects.filter(status='paid').count(), 2)
+        partial, full, overpaid = LoanAccount.objects.filter(pk__in=updated_at).order_by('pk')
+        self.assertEqual([partial.advance_payment_balance, full.advance_payment_balance,
+                          overpaid.advance_payment_balance], [Decimal('50.00'), Decimal('0.00'), Decimal('50.00')])
+        # The accounts whose advance payment moved are written with a new updated_at
+        self.assertGreater(partial.updated_at, updated_at[partial.pk])
+        self.assertGreater(overpaid.updated_at, updated_at[overpaid.pk])
+        self.assertEqual(ledger_balance('repayments'), Decimal('300.00'))
+
+
+@override_settings(REPAYMENT_MAX_ATTEMPTS=4, REPAYMENT_RETRY_DELAY_DAYS=1, REPAYMENT_RETRY_BACKOFF_FACTOR=2,
+                   REPAYMENT_RETRY_MAX_DELAY_DAYS=30)
+class RepaymentRetryTests(TestCase):
+
+    def test_retries_back_off_until_the_attempts_are_used_up(self):
+        loan_account = create_loan_with_dues(Decimal('0.00'))
+        repayments.process_due_repayments(date(2026, 3, 1))
+
+        # Attempt n waits 1, 2 and 4 days before attempt n + 1
+        for business_date, try_count, retry_date in ((date(2026, 3, 2), 2, date(2026, 3, 4)),
+                                                     (date(2026, 3, 4), 3, date(2026, 3, 8))):
+            self.assertEqual(RepaymentEODRetry.objects.get().retry_date, business_date)
+            self.assertEqual(repayments.process_repayment_retries(business_date)['rescheduled'], 1)
+            retry = RepaymentEODRetry.objects.get()
+            self.assertEqual((retry.try_count, retry.retry_date), (try_count, retry_date))
+
+        self.assertEqual(repayments.process_repayment_retries(date(2026, 3, 8))['failed'], 1)
+        self.assertFalse(RepaymentEODRetry.objects.exists())
+        failed = FailedLoanRepayments.objects.get()
+        unpaid = DueRegister.objects.filter(loan_account=loan_account).earliest('due_date', 'pk')
+        self.assertEqual((failed.loan_account_id, failed.schedule_id), (loan_account.pk, unpaid.pk))
+        self.assertEqual(failed.try_ids, sorted(LoanRepaymentTry.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(failed.try_ids), 4)
+
+    def test_the_delay_is_capped(self):
+        with override_settings(REPAYMENT_RETRY_MAX_DELAY_DAYS=3):
+            self.assertEqual([repayments.retry_delay(try_count).days for try_count in (1, 2, 3, 4)], [1, 2, 3, 3])
+
+    def test_a_rerun_of_the_day_does_not_retry_twice(self):
+        recovered, owing = create_loan_with_dues(Decimal('0.00')), create_loan_with_dues(Decimal('0.00'))
+        repayments.process_due_repayments(date(2026, 3, 1))
+        RepaymentAccount.objects.filter(loan_account=recovered).update(balance=Decimal('100.00'))
+
+        self.assertEqual(repayments.process_repayment_retries(date(2026, 3, 2)),
+                         {'retried': 2, 'recovered': 1, 'rescheduled': 1, 'failed': 0,
+                          'collected': Decimal('100.00')})
+        self.assertEqual(repayments.process_repayment_retries(date(2026, 3, 2)),
+                         {'retried': 0, 'recovered': 0, 'rescheduled': 0, 'failed': 0,
+                          'collected': Decimal('0.00')})
+        retry = RepaymentEODRetry.objects.get()
+        self.assertEqual((retry.loan_account_id, retry.try_count), (owing.pk, 2))
+        self.assertEqual(LoanRepaymentTry.objects.filter(loan_account=recovered).count(), 2)
+
+    @override_settings(REPAYMENT_MAX_ATTEMPTS=1)
+    def test_accounts_are_failed_at_once_without_retries(self):
+        loan_account = create_loan_with_dues(Decimal('0.00'))
+        repayments.process_due_repayments(date(2026, 3, 1))
+
+        self.assertFalse(RepaymentEODRetry.objects.exists())
+        failed = FailedLoanRepayments.objects.get()
+        self.assertEqual(failed.loan_account_id, loan_account.pk)
+        self.assertEqual(failed.try_ids, list(LoanRepaymentTry.objects.values_list('pk', flat=True)))
+
+
+class LoanApprovalTests(TestCase):
+
+    # A submitted application of 75,000.00 at 12.5% over term_count months, repaid from 2026-02-01
+    def create_application(self, term_count, frequency):
+        number = next(_customer_numbers)
+        customer = Customer.objects.create(name=f'Customer {number}', email=f'customer{number}@example.com',
+                                           phone_number='0700000000', address='1 Main Street',
+                                           date_of_birth=date(1990, 1, 1))
+        return LoanApplication.objects.create(
+            customer=customer, loan_type='personal', loan_amount=Decimal('75000.00'), interest_rate=Decimal('12.50'),
+            term_count=term_count, term_metric='months', frequency=frequency, application_expiry_date=date(2026, 1, 21),
+            funeral_period_count=10, funeral_period_type='days')
+
+    def test_the_approval_writes_the_schedule_the_calculator_quotes(self):
+        for term_count, frequency in ((36, 'monthly'), (24, 'quarterly'), (12, 'weekly')):
+            with self.subTest(frequency=frequency):
+                application = self.create_application(term_count, frequency)
+                application.approve_application()
+
+                quote = self.client.post('/loan-calculator/', calculator_payload(
+                    loan_amount='75000.00', interest_rate='12.50', tenure=term_count, repayment_schedule=frequency,
+                    loan_calculation_method='constant_repayment', repayment_start_date=date(2026, 2, 1),
+                ), content_type='application/json').json()
+                written = [
+                    {'period': row.installment_number, 'principal': float(row.principal_amount),
+                     'interest': float(row.interest_amount), 'installment': float(row.total_amount),
+                     'due_date': row.due_date.isoformat()}
+                    for row in application.schedules.order_by('installment_number')
+                ]
+                self.assertEqual(application.repayment_start_date, date(2026, 2, 1))
+                self.assertEqual(written, quote['repayment_plan'])
+
+    def test_schedule_rows_are_written_in_batches_from_the_first_installment_number(self):
+        application = self.create_application(36, 'monthly')
+        schedule = schedule_engine.calculate_schedule(**calculator_inputs())
+
+        self.assertEqual(LoanSchedule.bulk_create_from_schedule(application, schedule, batch_size=5,
+                                                                first_installment_number=4), 36)
+        written = application.schedules.order_by('installment_number')
+        self.assertEqual([(row.installment_number, row.due_date, row.principal_amount, row.interest_amount,
+                           row.total_amount, row.status) for row in written],
+                         [(row.period + 3, row.due_date, row.principal, row.interest, row.installment, 'pending')
+                          for row in schedule])
+
+    def test_the_approval_returns_the_number_of_schedule_rows_written(self):
+        application = self.create_application(24, 'monthly')
+        response = self.client.put(f'/loan-approvals/{application.pk}/', {
+            'customer': application.customer_id, 'loan_type': 'personal', 'loan_amount': '75000.00',
+            'application_expiry_date': '2026-01-21', 'funeral_period_count': 10, 'funeral_period_type': 'days',
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['schedules_created'], response.json()['status']), (24, 'approved'))
+        self.assertEqual(application.schedules.count(), 24)
+        # An approved application is not approved twice
+        application.refresh_from_db()
+        self.assertEqual(application.approve_application(), 0)
+        self.assertEqual(application.schedules.count(), 24)
+
+    def test_flat_rate_and_simple_interest_charge_interest_over_the_tenure_whatever_the_frequency(self):
+        # 12.5% a year of 75,000.00 over 24 months, whatever the number of quarterly installments
+        for method in ('flat_rate', 'simple_interest'):
+            with self.subTest(method=method):
+                inputs = calculator_inputs(tenure=24, repayment_schedule='quarterly', loan_calculation_method=method)
+                calculator = ReusableLoanCalculator(**inputs, repayment_mode='both')
+                quote = self.client.post('/loan-calculator/', calculator_payload(**inputs),
+                                         content_type='application/json').json()
+
+                schedule = calculator.calculate_schedule()
+                self.assertEqual(schedule.total_interest, Decimal('18750.00'))
+                self.assertEqual(sum(row.interest for row in schedule), Decimal('18750.00'))
+                self.assertEqual(quote, json.loads(JSONRenderer().render(schedule.as_dict())))
+
+
+class WaterfallTests(SimpleTestCase):
+
+    def test_dues_are_paid_by_priority_then_oldest_first(self):
+        dues = [
+            (1, 'principal', date(2026, 1, 31), Decimal('80.00')),
+            (2, 'interest', date(2026, 2, 28), Decimal('20.00')),
+            (3, 'interest', date(2026, 1, 31), Decimal('20.00')),
+            (4, 'penalty', date(2026, 2, 28), Decimal('5.00')),
+        ]
+        interest_first = waterfall.Waterfall.parse({'1': 'interest', '2': 'penalty', '3': 'principal'})
+        self.assertEqual(interest_first.allocate(Decimal('50.00'), dues),
+                         [(3, Decimal('20.00')), (2, Decimal('20.00')), (4, Decimal('5.00')), (1, Decimal('5.00'))])
+        self.assertEqual(waterfall.DEFAULT_WATERFALL.allocate(Decimal('10.00'), dues),
+                         [(4, Decimal('5.00')), (3, Decimal('5.00'))])
+
+    def test_installments_are_paid_whole_and_the_penalty_before_or_after_them(self):
+        schedules = [(1, Decimal('100.00')), (2, Decimal('100.00'))]
+        self.assertEqual(waterfall.DEFAULT_WATERFALL.allocate_repayment(Decimal('230.00'), Decimal('40.00'), schedules),
+                         (Decimal('40.00'), [(1, Decimal('100.00'))], Decimal('90.00')))
+        penalty_last = waterfall.Waterfall(['interest', 'principal', 'penalty'])
+        self.assertEqual(penalty_last.allocate_repayment(Decimal('230.00'), Decimal('40.00'), schedules),
+                         (Decimal('30.00'), schedules, Decimal('0.00')))
+
+    def test_a_part_payment_goes_to_the_higher_ranked_of_interest_and_principal(self):
+        self.assertEqual(waterfall.DEFAULT_WATERFALL.split_installment(Decimal('50.00'), Decimal('20.00'),
+                                                                         Decimal('80.00')),
+                         (Decimal('20.00'), Decimal('30.00')))
+        principal_first = waterfall.Waterfall(['principal', 'interest'])
+        self.assertEqual(principal_first.split_installment(Decimal('50.00'), Decimal('20.00'), Decimal('80.00')),
+                         (Decimal('0.00'), Decimal('50.00')))
+
+
+class WaterfallCacheTests(TestCase):
+
+    def setUp(self):
+        self.company = Company.objects.create(name='Lender')
+        self.cache = waterfall.WaterfallCache()
+
+    def test_single_lookups_reuse_the_compiled_waterfalls(self):
+        RepaymentPriority.objects.create(company=self.company, loan_type='personal',
+                                         priority_order={'1': 'interest', '2': 'principal', '3': 'penalty'})
+        with self.assertNumQueries(2):
+            compiled = self.cache.get('personal')
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertIs(self.cache.get('personal'), compiled)
+            self.assertIs(self.cache.get('business'), waterfall.DEFAULT_WATERFALL)
+        self.assertEqual(compiled.priority, ('interest', 'principal', 'penalty'))
+
+    @override_settings(REPAYMENT_WATERFALL_CACHE_MAX_AGE=0)
+    def test_the_version_is_checked_again_once_the_last_check_is_too_old(self):
+        self.cache.get('personal')
+        with self.assertNumQueries(1):
+            self.cache.get('personal')
+
+    def test_a_committed_config_change_clears_the_cache(self):
+        waterfall.waterfall_cache.get('personal')
+        with self.captureOnCommitCallbacks(execute=True):
+            config = RepaymentPriority.objects.create(company=self.company, loan_type='personal',
+                                                      priority_order={'1': 'principal', '2': 'interest'})
+        self.assertEqual(waterfall.waterfall_cache.get('personal').priority, ('principal', 'interest'))
+        with self.captureOnCommitCallbacks(execute=True):
+            config.delete()
+        self.assertIs(waterfall.waterfall_cache.get('personal'), waterfall.DEFAULT_WATERFALL)
+
+    def test_invalid_configs_are_skipped(self):
+        RepaymentPriority.objects.create(company=self.company, loan_type='personal', priority_order=['interest'])
+        with self.assertLogs('LMSapp.waterfall', 'WARNING'):
+            self.assertIs(self.cache.get('personal'), waterfall.DEFAULT_WATERFALL)
+
+
+class CalendarTests(SimpleTestCase):
+
+    def test_add_months_clamps_to_the_end_of_shorter_months(self):
+        self.assertEqual(calendars.add_months(date(2026, 1, 31), 1), date(2026, 2, 28))
+        self.assertEqual(calendars.add_months(date(2028, 1, 31), 1), date(2028, 2, 29))
+        self.assertEqual(calendars.add_months(date(2026, 1, 31), 3), date(2026, 4, 30))
+        self.assertEqual(calendars.add_months(date(2026, 11, 30), 3), date(2027, 2, 28))
+        self.assertEqual(calendars.add_months(date(2026, 3, 31), -1), date(2026, 2, 28))
+
+    def test_monthly_due_dates_step_from_the_start_date_without_drifting(self):
+        self.assertEqual(calendars.due_dates(date(2026, 1, 31), 'monthly', 4),
+                         (date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31), date(2026, 4, 30)))
+        self.assertEqual(calendars.due_dates(date(2026, 1, 31), 'quarterly', 3),
+                         (date(2026, 1, 31), date(2026, 4, 30), date(2026, 7, 31)))
+
+    @mock.patch.object(calendars, 'DUE_DATE_CACHE_PERIODS', 6)
+    def test_due_dates_of_every_tenure_are_sliced_from_one_bounded_sequence(self):
+        start = date(2031, 1, 31)
+        expected = tuple(calendars.due_date(start, 'monthly', period) for period in range(1, 11))
+        self.assertEqual(calendars.due_dates(start, 'monthly', 3), expected[:3])
+        self.assertEqual(calendars.due_dates(start, 'monthly', 10), expected)
+        self.assertEqual(calendars.due_dates(start, 'monthly', 4), expected[:4])
+        cached = calendars._due_date_sequence(start, 'monthly', calendars.NO_ADJUSTMENT)
+        self.assertEqual(tuple(cached), expected[:6])
+
+    def test_due_dates_are_moved_to_business_days(self):
+        # 2026-05-31 is a Sunday and 2026-06-01 is in the next month
+        modified_following = calendars.HolidayCalendar(convention='modified_following')
+        self.assertEqual(calendars.due_date(date(2026, 3, 31), 'monthly', 3, modified_following), date(2026, 5, 29))
+        following = calendars.HolidayCalendar(holidays=[date(2026, 6, 1)])
+        self.assertEqual(calendars.due_date(date(2026, 3, 31), 'monthly', 3, following), date(2026, 6, 2))
+        with self.assertRaises(ValueError):
+            calendars.HolidayCalendar(convention='nearest')
+
+
+class QuoteCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calculated = []
+
+    def calculate(self, value):
+        self.calculated.append(value)
+        return value
+
+    def test_a_quote_is_calculated_once_until_it_expires(self):
+        cache = quote_cache.QuoteCache(max_size=10, ttl=300)
+        with mock.patch.object(quote_cache.time, 'monotonic', return_value=1000.0) as monotonic:
+            self.assertEqual(cache.get_or_calculate('a', lambda: self.calculate(1)), 1)
+            monotonic.return_value = 1299.0
+            self.assertEqual(cache.get_or_calculate('a', lambda: self.calculate(2)), 1)
+            monotonic.return_value = 1300.0
+            self.assertEqual(cache.get_or_calculate('a', lambda: self.calculate(3)), 3)
+        self.assertEqual(self.calculated, [1, 3])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_the_least_recently_used_quote_is_evicted(self):
+        cache = quote_cache.QuoteCache(max_size=2, ttl=0)
+        cache.get_or_calculate('a', lambda: self.calculate('a'))
+        cache.get_or_calculate('b', lambda: self.calculate('b'))
+        cache.get_or_calculate('a', lambda: self.calculate('a'))
+        cache.get_or_calculate('c', lambda: self.calculate('c'))
+        cache.get_or_calculate('a', lambda: self.calculate('a'))
+        cache.get_or_calculate('b', lambda: self.calculate('b'))
+        self.assertEqual(self.calculated, ['a', 'b', 'c', 'b'])
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_a_disabled_cache_always_calculates(self):
+        cache = quote_cache.QuoteCache(max_size=0)
+        cache.get_or_calculate('a', lambda: self.calculate(1))
+        cache.get_or_calculate('a', lambda: self.calculate(2))
+        self.assertEqual(self.calculated, [1, 2])
+
+    def test_keys_depend_on_the_plan_inputs_and_the_engine_only(self):
+        cache = quote_cache.QuoteCache()
+        inputs = calculator_inputs(repayment_mode='both')
+        key = cache.make_key(inputs, 'decimal')
+        self.assertEqual(cache.make_key({**inputs, 'repayment_mode': 'interest_only'}, 'decimal'), key)
+        self.assertNotEqual(cache.make_key(inputs, 'vectorized'), key)
+        self.assertNotEqual(cache.make_key({**inputs, 'tenure': 48}, 'decimal'), key)
+
+
+def ledger_balance(role):
+    return postings.get_ledger_account(role).balance
+
+
+class InterestAccrualTests(TestCase):
+
+    def test_a_rerun_of_the_day_does_not_accrue_twice(self):
+        # One day of 12% on 36,500.00 is 12.00
+        loan_accounts = [create_loan(balance=Decimal('36500.00')) for _ in range(3)]
+        create_loan(balance=Decimal('0.00'))
+
+        self.assertEqual(eod.accrue_interest(date(2026, 3, 1), batch_size=2),
+                         {'accounts': 3, 'interest': Decimal('36.00')})
+        self.assertEqual(eod.accrue_interest(date(2026, 3, 1), batch_size=2),
+                         {'accounts': 0, 'interest': Decimal('0.00')})
+
+        self.assertEqual(LoanInterestAccrual.objects.count(), 3)
+        self.assertEqual(
+            LoanAccountEntry.objects.filter(loan_account__in=loan_accounts, entry_type='interest').count(), 3)
+        self.assertEqual(ledger_balance('interest_receivable'), Decimal('36.00'))
+        self.assertEqual(eod.accrue_interest(date(2026, 3, 2))['accounts'], 3)
+
+
+# 36.5% a year is 0.1% of the overdue installment a day
+@override_settings(LATE_PAYMENT_PENALTY_RATE=Decimal('36.5'), LATE_PAYMENT_GRACE_DAYS=0)
+class PenaltyAccrualTests(TestCase):
+
+    def test_a_rerun_of_the_day_does_not_accrue_twice(self):
+        loan_account = create_loan(installments=2, first_due_date=date(2026, 1, 31))
+        create_loan(installments=1, first_due_date=date(2026, 3, 1))
+
+        self.assertEqual(eod.accrue_penalties(date(2026, 3, 1)),
+                         {'accounts': 1, 'installments': 1, 'penalty': Decimal('0.10')})
+        self.assertEqual(eod.accrue_penalties(date(2026, 3, 1)),
+                         {'accounts': 0, 'installments': 0, 'penalty': Decimal('0.00')})
+        self.assertEqual(LoanPenaltiesAccrual.objects.count(), 1)
+        self.assertEqual(ledger_balance('penalty_receivable'), Decimal('0.10'))
+
+        # The next day the second loan's installment is overdue too, and the first one's LatePayment grows
+        self.assertEqual(eod.accrue_penalties(date(2026, 3, 2)),
+                         {'accounts': 2, 'installments': 2, 'penalty': Decimal('0.20')})
+        late_payment = LatePayment.objects.get(schedule__loan_application=loan_account.loan_application)
+        self.assertEqual((late_payment.days_late, late_payment.penalty_amount), (30, Decimal('0.20')))
+        loan_account.refresh_from_db()
+        self.assertEqual(loan_account.accrued_penalty, Decimal('0.20'))
+
+
+@override_settings(EOD_BATCH_SIZE=1)
+class EndOfDayResumeTests(TestCase):
+
+    def test_a_failed_run_resumes_from_its_checkpoints(self):
+        loan_accounts = [create_loan(balance=Decimal('36500.00')) for _ in range(3)]
+        daily_interest = eod.daily_interest
+        balances = []
+
+        def fail_on_the_second_batch(balance, interest_rate):
+            balances.append(balance)
+            if len(balances) == 2:
+                raise RuntimeError("Worker lost")
+            return daily_interest(balance, interest_rate)
+
+        with mock.patch.object(eod, 'daily_interest', fail_on_the_second_batch), \
+                self.assertLogs('LMSapp.eod', 'ERROR'):
+            summary = eod.run_end_of_day(date(2026, 3, 1), shard_count=1, executor='local', workers=1)
+
+        self.assertEqual(summary['status'], 'failed')
+        checkpoint = EODCheckpoint.objects.get(stage='interest_accrual')
+        self.assertEqual((checkpoint.status, checkpoint.last_processed_id), ('failed', loan_accounts[0].pk))
+        self.assertEqual(checkpoint.counts, {'accounts': 1, 'interest': '12.00'})
+        self.assertFalse(EODCheckpoint.objects.exclude(stage='interest_accrual').exclude(status='pending').exists())
+        self.assertEqual(ledger_balance('interest_receivable'), Decimal('12.00'))
+
+        summary = eod.run_end_of_day(date(2026, 3, 1), shard_count=1, executor='local', workers=1)
+
+        self.assertEqual(summary['status'], 'completed')
+        self.assertEqual(summary['stages'][0]['totals'], {'accounts': 3, 'interest': '36.00'})
+        self.assertEqual(LoanInterestAccrual.objects.count(), 3)
+        self.assertEqual(ledger_balance('interest_receivable'), Decimal('36.00'))
+        self.assertFalse(EODCheckpoint.objects.exclude(gl_deltas={}).exists())
+        self.assertEqual(eod.run_end_of_day(date(2026, 3, 1), executor='local'), summary)
+
+
+# An open past due record of loan_account, overdue since overdue_date
+def create_past_due_record(loan_account, overdue_date, business_date=date(2026, 3, 1), **fields):
+    bucket = PastDueRecord.bucket_for((business_date - overdue_date).days)
+    fields = {'pd_bucket': bucket, 'workflow_status': bucket, 'status': 'Active', **fields}
+    return PastDueRecord.objects.create(loan_account_id=loan_account.pk, repayment_schedule_id=0,
+                                        overdue_amount=Decimal('100.00'), overdue_date=overdue_date, **fields)
+
+
+class PastDueActionTests(TestCase):
+
+    def setUp(self):
+        PDActionWorkflowConfig.objects.create(current_pd_status='0-30 Days', next_action_type='Reminder',
+                                              action_timeline_days=0, next_pd_status='31-60 Days')
+
+    def create_action(self, record, current_pd_status='0-30 Days'):
+        return PDNextAction.objects.create(pd_record_id=record, next_action_date=date(2026, 3, 1),
+                                           next_action_type='Reminder', current_pd_status=current_pd_status)
+
+    def test_an_action_moves_the_workflow_status_and_leaves_the_record_open(self):
+        record = create_past_due_record(create_loan(), date(2026, 2, 20))
+        action = self.create_action(record)
+        unmatched = self.create_action(record, current_pd_status='Above 90 Days')
+
+        with self.assertLogs('LMSapp.eod', 'WARNING'):
+            self.assertEqual(eod.run_pd_actions(date(2026, 3, 1)), {'actions': 1, 'unmatched': 1})
+
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.workflow_status, record.pd_bucket),
+                         ('Active', '31-60 Days', '0-30 Days'))
+        self.assertEqual(PDNextAction.objects.get(pk=action.pk).action_status, 'Completed')
+        self.assertEqual(PDNextAction.objects.get(pk=unmatched.pk).action_status, 'Pending')
+        next_action = PDNextAction.objects.latest('pk')
+        self.assertEqual((next_action.current_pd_status, next_action.action_status), ('31-60 Days', 'Pending'))
+
+    @override_settings(EOD_BATCH_SIZE=1)
+    def test_a_resumed_run_stops_at_the_last_action_of_the_first_attempt(self):
+        # The next actions are due the same day, so only the bound kept on the checkpoint leaves them out
+        records = [create_past_due_record(create_loan(), date(2026, 2, 20)) for _ in range(2)]
+        actions = [self.create_action(record) for record in records]
+        run = EODRun.objects.create(business_date=date(2026, 3, 1), shard_count=1)
+        checkpoint = EODCheckpoint.objects.create(run=run, stage='pd_actions', after_id=0, upto_id=10 ** 6)
+        get = eod.WorkflowTransitions.get
+        calls = []
+
+        def fail_on_the_second_batch(transitions, current_pd_status):
+            calls.append(current_pd_status)
+            if len(calls) == 2:
+                raise RuntimeError("Worker lost")
+            return get(transitions, current_pd_status)
+
+        with mock.patch.object(eod.WorkflowTransitions, 'get', fail_on_the_second_batch), \
+                self.assertRaises(RuntimeError):
+            eod.run_pd_actions(date(2026, 3, 1), checkpoint=checkpoint)
+
+        checkpoint = EODCheckpoint.objects.get(pk=checkpoint.pk)
+        self.assertEqual((checkpoint.last_processed_id, checkpoint.last_row_id), (actions[0].pk, actions[1].pk))
+        self.assertEqual(eod.run_pd_actions(date(2026, 3, 1), checkpoint=checkpoint), {'actions': 1, 'unmatched': 0})
+        self.assertEqual(checkpoint.counts, {'actions': 2, 'unmatched': 0})
+        self.assertEqual(PDNextAction.objects.filter(action_status='Completed').count(), 2)
+        self.assertEqual(PDNextAction.objects.filter(action_status='Pending', current_pd_status='31-60 Days').count(),
+                         2)
+
+
+class DelinquencyDetectionTests(TestCase):
+
+    def setUp(self):
+        PDActionWorkflowConfig.objects.create(current_pd_status='0-30 Days', next_action_type='Reminder',
+                                              action_timeline_days=1, next_pd_status='31-60 Days')
+        self.loan_account = create_loan()
+
+    def create_installments(self, *due_dates):
+        return RepaymentSchedule.objects.bulk_create([
+            RepaymentSchedule(loan_application=self.loan_account.loan_application, installment_number=number,
+                              due_date=due_date, principal_amount=Decimal('80.00'), interest_amount=Decimal('20.00'),
+                              total_amount=Decimal('100.00'))
+            for number, due_date in enumerate(due_dates, 1)
+        ])
+
+    def test_a_rerun_of_the_day_creates_nothing_twice(self):
+        first, second = self.create_installments(date(2026, 2, 1), date(2026, 2, 15))
+
+        self.assertEqual(eod.detect_delinquencies(date(2026, 3, 1)),
+                         {'created': 2, 'actions': 2, 'updated': 0, 'resolved': 0})
+        self.assertEqual(eod.detect_delinquencies(date(2026, 3, 1)),
+                         {'created': 0, 'actions': 0, 'updated': 0, 'resolved': 0})
+        self.assertEqual((PastDueRecord.objects.count(), PDNextAction.objects.count()), (2, 2))
+
+        # The open records follow their installments: a paid one is resolved, a changed amount is refreshed
+        RepaymentSchedule.objects.filter(pk=first.pk).update(status='paid')
+        RepaymentSchedule.objects.filter(pk=second.pk).update(total_amount=Decimal('60.00'), status='partial')
+        self.assertEqual(eod.detect_delinquencies(date(2026, 3, 1)),
+                         {'created': 0, 'actions': 0, 'updated': 1, 'resolved': 1})
+        self.assertEqual(PastDueRecord.objects.get(repayment_schedule_id=first.pk).status, 'Resolved')
+        self.assertEqual(PastDueRecord.objects.get(repayment_schedule_id=second.pk).overdue_amount, Decimal('60.00'))
+
+    def test_installments_due_since_the_last_completed_run_are_detected_after_days_without_one(self):
+        # Runs on Thursday and Friday; the weekend run failed and Monday 2026-03-09 is a holiday without one
+        for business_date in (date(2026, 3, 5), date(2026, 3, 6)):
+            EODRun.objects.create(business_date=business_date, shard_count=1, status='completed')
+        EODRun.objects.create(business_date=date(2026, 3, 7), shard_count=1, status='failed')
+        installments = self.create_installments(date(2026, 3, 4), date(2026, 3, 6), date(2026, 3, 7),
+                                                date(2026, 3, 9), date(2026, 3, 10))
+
+        self.assertEqual(eod.previous_business_date(date(2026, 3, 10)), date(2026, 3, 6))
+        self.assertEqual(eod.detect_delinquencies(date(2026, 3, 10))['created'], 3)
+        # Wednesday's installment fell overdue before Friday's run, so it is that run's to detect
+        self.assertEqual(set(PastDueRecord.objects.values_list('repayment_schedule_id', flat=True)),
+                         {installment.pk for installment in installments[1:4]})
+
+
+class PastDueAgingTests(TestCase):
+
+    def test_buckets_start_on_their_first_day_overdue(self):
+        self.assertEqual([PastDueRecord.bucket_for(days) for days in (0, 30, 31, 60, 61, 90, 91, 400)],
+                         ['0-30 Days', '0-30 Days', '31-60 Days', '31-60 Days', '61-90 Days', '61-90 Days',
+                          'Above 90 Days', 'Above 90 Days'])
+
+    def test_records_move_bucket_the_day_they_cross_a_boundary(self):
+        record = create_past_due_record(create_loan(), date(2026, 1, 30), business_date=date(2026, 1, 31))
+
+        # 30 days overdue on 2026-03-01, 31 the next day
+        self.assertEqual(eod.age_past_due_records(date(2026, 3, 1)), {'records': 0})
+        self.assertEqual(eod.age_past_due_records(date(2026, 3, 2)), {'records': 1})
+        self.assertEqual(eod.age_past_due_records(date(2026, 3, 2)), {'records': 0})
+        record.refresh_from_db()
+        self.assertEqual(record.pd_bucket, '31-60 Days')
+
+    def test_missed_days_are_caught_up_in_one_move(self):
+        loan_account = create_loan()
+        behind = create_past_due_record(loan_account, date(2026, 1, 1), business_date=date(2026, 1, 2))
+        resolved = create_past_due_record(loan_account, date(2026, 1, 1), business_date=date(2026, 1, 2),
+                                          status='Resolved')
+
+        # No run since the day after it fell overdue: 95 days later it goes straight to the oldest bucket
+        self.assertEqual(eod.age_past_due_records(date(2026, 4, 6)), {'records': 1})
+        behind.refresh_from_db()
+        resolved.refresh_from_db()
+        self.assertEqual((behind.pd_bucket, resolved.pd_bucket), ('Above 90 Days', '0-30 Days'))
+
+
+class PenaltyRuleTests(TestCase):
+
+    def create_rule(self, charge_trigger, penalty_type):
+        return PDPenaltiesChargesConfig.objects.create(penalty_type=penalty_type, charge_amount=Decimal('5.00'),
+                                                       charge_frequency='Daily', charge_trigger=charge_trigger)
+
+    def test_triggers_are_sorted_as_numbers(self):
+        # As text, '30' would sort before '9'
+        rules = {trigger: self.create_rule(trigger, f'After {trigger}') for trigger in ('30', '9', '90')}
+        index = eod.PenaltyRuleIndex.load()
+
+        self.assertEqual(index.triggers, [9, 30, 90])
+        self.assertEqual([index.match(days) for days in (8, 9, 29, 30, 89, 90, 400)],
+                         [None, rules['9'], rules['9'], rules['30'], rules['30'], rules['90'], rules['90']])
+
+    def test_non_numeric_triggers_and_records_below_every_trigger_are_skipped(self):
+        self.create_rule('30 days', 'Unparsed')
+        self.create_rule('10', 'Late fee')
+        with self.assertLogs('LMSapp.eod', 'WARNING'):
+            index = eod.PenaltyRuleIndex.load()
+        self.assertEqual(index.triggers, [10])
+
+        loan_account = create_loan()
+        charged = create_past_due_record(loan_account, date(2026, 2, 1))
+        create_past_due_record(loan_account, date(2026, 2, 25))
+        with self.assertLogs('LMSapp.eod', 'WARNING'):
+            self.assertEqual(eod.apply_pd_penalties(date(2026, 3, 1)), {'records': 2, 'penalties': 1})
+        penalty = PenaltyAccrual.objects.get()
+        self.assertEqual((penalty.pd_record_id_id, penalty.penalty_type), (charged.pk, 'Late fee'))
+        self.assertEqual(LoanAccountReceivable.objects.get().pd_record_id_id, charged.pk)
+
+
+class ShardTests(TestCase):
+
+    def test_no_loans_no_shards(self):
+        self.assertEqual(eod.shard_ranges(4), [])
+
+    def test_shards_cover_every_loan_account_exactly_once(self):
+        loan_accounts = [create_loan() for _ in range(10)]
+        # Gaps in the ids, so the spans hold uneven numbers of loans
+        for loan_account in loan_accounts[2:5] + loan_accounts[7:8]:
+            loan_account.delete()
+        ids = list(LoanAccount.objects.values_list('pk', flat=True))
+
+        for count in (1, 2, 3, 4, 7, 100):
+            with self.subTest(count=count):
+                shards = eod.shard_ranges(count)
+                self.assertLessEqual(len(shards), count)
+                self.assertEqual(shards[0][0], min(ids) - 1)
+                self.assertEqual(shards[-1][1], max(ids))
+                # Each shard starts where the one before ends
+                self.assertEqual([after_id for after_id, _ in shards[1:]], [upto_id for _, upto_id in shards[:-1]])
+                self.assertEqual(sorted(pk for pk in ids for after_id, upto_id in shards if after_id < pk <= upto_id),
+                                 ids)
+
+
+# The GL balance changes of a day's EOD run: every loan accrues a day of interest, as it does every other day
+class ShardedEndOfDayTests(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        for _ in range(5):
+            create_loan(balance=Decimal('36500.00'))
+
+    def run_day(self, business_date, shard_count, workers):
+        before = dict(Account.objects.values_list('pk', 'balance'))
+        summary = eod.run_end_of_day(business_date, shard_count=shard_count, executor='local', workers=workers)
+        self.assertEqual(summary['status'], 'completed')
+        self.assertEqual(summary['shards'], shard_count)
+        self.assertFalse(EODCheckpoint.objects.exclude(gl_deltas={}).exists())
+        return {pk: balance - before[pk] for pk, balance in Account.objects.values_list('pk', 'balance')
+                if balance != before[pk]}
+
+    def test_sharded_runs_settle_the_same_gl_balances_as_a_single_shard(self):
+        single = self.run_day(date(2026, 3, 1), shard_count=1, workers=1)
+        self.assertEqual(single[postings.get_ledger_account('interest_receivable').pk], Decimal('60.00'))
+        self.assertEqual(self.run_day(date(2026, 3, 2), shard_count=3, workers=1), single)
+
+    @skipIf(connection.vendor == 'sqlite', "SQLite takes one writer at a time, so EOD shards run in one process")
+    def test_a_process_pool_run_settles_the_same_gl_balances_as_a_single_process(self):
+        single = self.run_day(date(2026, 3, 1), shard_count=1, workers=1)
+        self.assertEqual(self.run_day(date(2026, 3, 2), shard_count=3, workers=3), single)
+
+
+class PostingTests(TestCase):
+
+    def setUp(self):
+        self.ledger = postings.get_ledger_accounts('loans', 'disbursements', 'repayments', 'interest_receivable',
+                                                   'interest_income', 'advance_payments')
+
+    def journals(self, loan_account_id, day):
+        ledger = self.ledger
+        return [
+            postings.Journal('Disbursement', loan_account_id, value_date=day)
+            .debit(ledger['loans'], Decimal('1000.00'), loan_account_id)
+            .credit(ledger['disbursements'], Decimal('1000.00')),
+            postings.Journal('Interest accrued', value_date=day)
+            .debit(ledger['interest_receivable'], Decimal('12.00'))
+            .credit(ledger['interest_income'], Decimal('12.00')),
+            postings.Journal('Repayment', loan_account_id, value_date=day)
+            .debit(ledger['repayments'], Decimal('150.00'))
+            .credit(ledger['loans'], Decimal('100.00'), loan_account_id)
+            .credit(ledger['interest_receivable'], Decimal('12.00'))
+            .credit(ledger['advance_payments'], Decimal('38.00')),
+        ]
+
+    def test_posted_journals_keep_the_trial_balance_balanced(self):
+        loan_account = create_loan(balance=Decimal('0.00'))
+        headers = postings.post_journals(self.journals(loan_account.pk, date(2026, 3, 1)))
+
+        self.assertEqual([header.amount for header in headers], [Decimal('1000.00'), Decimal('12.00'),
+                                                                 Decimal('150.00')])
+        loan_account.refresh_from_db()
+        self.assertEqual(loan_account.balance, Decimal('900.00'))
+        self.assertEqual(ledger_balance('loans'), Decimal('900.00'))
+        self.assertEqual(ledger_balance('interest_receivable'), Decimal('0.00'))
+        trial_balance = balances.trial_balance(date(2026, 3, 1))
+        self.assertEqual(trial_balance['total_debit'], trial_balance['total_credit'])
+        self.assertEqual(trial_balance['total_debit'], Decimal('1050.00'))
+
+    def test_gl_deltas_are_collected_instead_of_applied(self):
+        loan_account = create_loan(balance=Decimal('0.00'))
+        gl_deltas = {}
+        postings.post_journals(self.journals(loan_account.pk, date(2026, 3, 1)), gl_deltas)
+
+        self.assertEqual(ledger_balance('loans'), Decimal('0.00'))
+        self.assertEqual(gl_deltas[self.ledger['loans'].pk], Decimal('900.00'))
+        loan_account.refresh_from_db()
+        self.assertEqual(loan_account.balance, Decimal('900.00'))
+        postings.apply_balance_deltas(Account, gl_deltas)
+        self.assertEqual(ledger_balance('loans'), Decimal('900.00'))
+
+    def test_balance_deltas_are_added_to_their_own_rows(self):
+        loan_accounts = [create_loan(balance=Decimal('100.00')) for _ in range(4)]
+        deltas = [Decimal('5.00'), Decimal('5.00'), Decimal('0.00'), Decimal('-3.00')]
+        postings.apply_balance_deltas(LoanAccount, {loan_account.pk: delta
+                                                    for loan_account, delta in zip(loan_accounts, deltas)})
+
+        balances = dict(LoanAccount.objects.values_list('pk', 'balance'))
+        self.assertEqual([balances[loan_account.pk] for loan_account in loan_accounts],
+                         [Decimal('105.00'), Decimal('105.00'), Decimal('100.00'), Decimal('97.00')])
+
+    def test_an_unbalanced_journal_posts_nothing(self):
+        unbalanced = postings.Journal('Unbalanced').debit(self.ledger['repayments'], Decimal('10.00')).credit(
+            self.ledger['advance_payments'], Decimal('9.99'))
+        with self.assertRaises(ValueError):
+            postings.post_journals(self.journals(None, date(2026, 3, 1))[1:2] + [unbalanced])
+        self.assertFalse(Transaction.objects.exists())
+        with self.assertRaises(ValueError):
+            postings.Journal('Negative').debit(self.ledger['repayments'], Decimal('-1.00'))
+
+
+class BalanceTests(TestCase):
+    DAYS = [date(2026, 3, 1), date(2026, 3, 2), date(2026, 3, 3)]
+
+    def setUp(self):
+        self.ledger = postings.get_ledger_accounts('loans', 'disbursements', 'repayments')
+        self.loan_account = create_loan(balance=Decimal('0.00'))
+        self.post('Disbursement', 'disbursements', 'loans', '1000.00', self.DAYS[0])
+        self.post('Repayment', 'loans', 'repayments', '100.00', self.DAYS[1])
+        balances.snapshot_balances(self.DAYS[1])
+        self.post('Repayment', 'loans', 'repayments', '50.00', self.DAYS[2])
+
+    # Moves the loan's balance by amount from one role's account to the other's
+    def post(self, description, from_role, to_role, amount, day):
+        amount = Decimal(amount)
+        journal = postings.Journal(description, self.loan_account.pk, value_date=day)
+        journal.debit(self.ledger[to_role], amount, self.loan_account.pk if to_role == 'loans' else None)
+        journal.credit(self.ledger[from_role], amount, self.loan_account.pk if from_role == 'loans' else None)
+        postings.post_journal(journal)
+
+    def loan_balances(self):
+        return [balances.loan_account_balances.as_of(day, [self.loan_account.pk])[self.loan_account.pk]
+                for day in [self.DAYS[0] - timedelta(days=1)] + self.DAYS]
+
+    def test_as_of_balances_read_the_snapshots_and_the_later_ledger_rows(self):
+        self.assertEqual(LoanAccountBalanceSnapshot.objects.get().balance, Decimal('900.00'))
+        expected = [Decimal('0.00'), Decimal('1000.00'), Decimal('900.00'), Decimal('850.00')]
+        self.assertEqual(self.loan_balances(), expected)
+        self.assertEqual(balances.account_balances.as_of(self.DAYS[0])[self.ledger['loans'].pk], Decimal('1000.00'))
+
+        # Without snapshots the balances are worked back from the current ones
+        LoanAccountBalanceSnapshot.objects.all().delete()
+        AccountBalanceSnapshot.objects.all().delete()
+        self.assertEqual(self.loan_balances(), expected)
+        self.assertEqual(balances.account_balances.as_of(self.DAYS[1])[self.ledger['loans'].pk], Decimal('900.00'))
+
+    def test_a_rerun_of_the_snapshot_stage_takes_no_snapshot_twice(self):
+        self.assertEqual(balances.snapshot_balances(self.DAYS[1]), {'accounts': 0, 'loan_accounts': 0})
+
+    def test_a_backdated_posting_drops_the_later_snapshots(self):
+        self.post('Backdated repayment', 'loans', 'repayments', '25.00', self.DAYS[0])
+        self.assertFalse(LoanAccountBalanceSnapshot.objects.exists())
+        self.assertEqual(self.loan_balances(), [Decimal('0.00'), Decimal('975.00'), Decimal('875.00'),
+                                                Decimal('825.00')])
+
+    def test_only_the_snapshots_of_the_accounts_and_days_posted_to_are_dropped(self):
+        other = create_loan(balance=Decimal('0.00'))
+        LoanAccountBalanceSnapshot.objects.create(loan_account=other, snapshot_date=self.DAYS[1],
+                                                  balance=Decimal('0.00'))
+        backdated = postings.Journal('Backdated repayment', self.loan_account.pk, value_date=self.DAYS[0])
+        backdated.debit(self.ledger['repayments'], Decimal('25.00'))
+        backdated.credit(self.ledger['loans'], Decimal('25.00'), self.loan_account.pk)
+        current = postings.Journal('Disbursement', other.pk, value_date=self.DAYS[2])
+        current.debit(self.ledger['loans'], Decimal('10.00'), other.pk)
+        current.credit(self.ledger['disbursements'], Decimal('10.00'))
+        postings.post_journals([backdated, current])
+
+        # The other loan was posted to on a later day, and the disbursements account only from that day on
+        self.assertEqual(list(LoanAccountBalanceSnapshot.objects.values_list('loan_account_id', flat=True)),
+                         [other.pk])
+        posted_to = AccountBalanceSnapshot.objects.filter(account__in=self.ledger.values())
+        self.assertEqual(list(posted_to.values_list('account_id', flat=True)), [self.ledger['disbursements'].pk])
+
+    def test_a_statement_runs_the_balance_from_the_opening_to_the_closing_one(self):
+        statement = balances.loan_account_balances.statement(self.loan_account.pk, self.DAYS[1], self.DAYS[2])
+
+        self.assertEqual((statement['opening_balance'], statement['closing_balance']),
+                         (Decimal('1000.00'), Decimal('850.00')))
+        self.assertEqual([(entry['value_date'], entry['credit'], entry['balance']) for entry in statement['entries']],
+                         [(self.DAYS[1], Decimal('100.00'), Decimal('900.00')),
+                          (self.DAYS[2], Decimal('50.00'), Decimal('850.00'))])
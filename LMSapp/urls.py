@@ -48,4 +48,7 @@ router.register(r'loan-approvals', views.LoanApprovalViewSet, basename='loan-app
 urlpatterns = [
     path('', include(router.urls)),
     path('loan-calculator/', views.LoanCalculatorView.as_view(), name='loan-calculator'),
+    path('loan-calculator/batch/', views.LoanCalculatorBatchView.as_view(), name='loan-calculator-batch'),
+    path('payment-imports/', views.PaymentImportView.as_view(), name='payment-import'),
+    path('trial-balance/', views.TrialBalanceView.as_view(), name='trial-balance'),
 ]
@@ -1,6 +1,5 @@
 from datetime import timedelta, date
-from .models import LoanSchedule, LoanApplicationHistory
-from .serializers import LoanCalculatorSerializer
+from .models import LoanSchedule, LoanApplicationHistory, ReusableLoanCalculator
 
 
 def calculate_repayment_start_date(loan_application):
@@ -28,33 +27,19 @@ def generate_repayment_schedule(loan_application):
     if not loan_application.repayment_start_date:
         raise ValueError("Repayment start date must be set before generating the repayment schedule.")
 
-    # Prepare data for the serializer
-    data = {
-        'loan_amount': loan_application.loan_amount,
-        'interest_rate': loan_application.interest_rate,
-        'tenure': int(loan_application.term_years * 12),  # Assuming term_years is in years
-        'tenure_type': 'months',  # Assuming tenure type is always in months for now
-        'repayment_schedule': loan_application.frequency,
-        'repayment_mode': loan_application.repayment_option,
-        'interest_basis': '365',  # Assuming 365 days interest basis
-        'loan_calculation_method': 'constant_repayment',  # You can map this to a proper method
-        'repayment_start_date': loan_application.repayment_start_date,  # Use the calculated repayment start date
-    }
-
-    # Instantiate the serializer and calculate the schedule
-    serializer = LoanCalculatorSerializer(data=data)
-    if serializer.is_valid():
-        repayment_plan = serializer.calculate_repayment_schedule(serializer.validated_data)
-        for entry in repayment_plan['repayment_plan']:
-            LoanSchedule.objects.create(
-                application=loan_application,
-                installment_number=entry['period'],
-                due_date=entry['due_date'],
-                principal_amount=entry['principal'],
-                interest_amount=entry['interest'],
-                total_amount=entry['installment'],
-                status='pending'
-            )
+    # Calculate the schedule directly with the shared engine, no serializer validation needed
+    calculator = ReusableLoanCalculator(
+        loan_amount=loan_application.loan_amount,
+        interest_rate=loan_application.interest_rate,
+        tenure=loan_application.calculate_tenure(),
+        tenure_type='months',  # calculate_tenure() always returns months
+        repayment_schedule=loan_application.frequency,
+        repayment_mode=loan_application.repayment_option,
+        interest_basis='365',  # Assuming 365 days interest basis
+        loan_calculation_method='constant_repayment',  # You can map this to a proper method
+        repayment_start_date=loan_application.repayment_start_date,  # Use the calculated repayment start date
+    )
+    return LoanSchedule.bulk_create_from_schedule(loan_application, calculator.calculate_schedule())
 
 
 def apply_loan_modification(loan_modification):
@@ -103,50 +88,8 @@ def apply_loan_modification(loan_modification):
 
 
 def get_remaining_principal(loan_modification):
-    future_schedules = LoanSchedule.objects.filter(
-        application=loan_modification.loan_application,
-        due_date__gte=loan_modification.modification_date
-    ).order_by('due_date')
-
-    return sum(schedule.principal_amount for schedule in future_schedules if schedule.status == 'pending')
+    return loan_modification.get_remaining_principal()
 
 
-def recalculate_future_schedules(loan_modification):
-    loan_application = loan_modification.loan_application
-    today = loan_modification.modification_date
-
-    # Fetch and delete all future schedules
-    future_schedules = LoanSchedule.objects.filter(
-        application=loan_application,
-        due_date__gte=today
-    ).order_by('due_date')
-
-    future_schedules.delete()
-
-    # Recalculate future schedules based on modified parameters
-    data = {
-        'loan_amount': loan_application.loan_amount,
-        'interest_rate': loan_application.interest_rate,
-        'tenure': int(loan_application.term_years * 12),  # Assuming term_years is in years
-        'tenure_type': 'months',  # Assuming tenure type is always in months for now
-        'repayment_schedule': loan_application.frequency,
-        'repayment_mode': loan_application.repayment_option,
-        'interest_basis': loan_application.interest_basis or '365',  # Use the modified interest_basis if provided
-        'loan_calculation_method': 'constant_repayment',  # You can map this to a proper method
-        'repayment_start_date': today,  # Continue from today
-    }
-
-    # Instantiate the serializer and calculate the new schedule
-    serializer = LoanCalculatorSerializer(data=data)
-    if serializer.is_valid():
-        repayment_plan = serializer.calculate_repayment_schedule(serializer.validated_data)
-        for entry in repayment_plan['repayment_plan']:
-            LoanSchedule.objects.create(
-                application=loan_application,
-                installment_number=entry['period'],
-                due_date=entry['due_date'],
-                principal_amount=entry['principal'],
-                interest_amount=entry['interest'],
-                total_amount=entry['installment'],
-                status='pending'
-            )
+def recalculate_future_schedules(loan_modification, incremental=None):
+    return loan_modification.recalculate_future_schedules(incremental)
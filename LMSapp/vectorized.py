@@ -0,0 +1,258 @@
+from decimal import Context, Decimal
+
+from .schedule_engine import ScheduleRow
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only the 'vectorized' calculator engine needs it
+    np = None
+
+# The amortisation runs in float64 and is rounded to integer cents per period, half to even, as the Decimal engine
+# rounds its rows, with the last period trued up to the plan totals so the rows add up exactly to them. The totals
+# come from schedule_engine.plan_totals(), as the Decimal engine's do, so both engines return the same totals; a
+# row can differ from the Decimal engine's by a cent where the two round an amount on either side of half a cent.
+# Schedules stay int64 arrays until they are serialized.
+
+GRADUATED_INCREMENT = 1.05  # 5% increment per period, same as the Decimal engine
+BALLOON_RATIO = 0.5  # 50% of the loan amount is paid as the balloon
+
+# Largest amount whose cents are still exact in float64; schedule_engine calculates schedules with bigger amounts
+# with the Decimal engine instead
+MAX_AMOUNT = 2 ** 53 / 100
+
+# Wide enough for any amount the models can store, so converting cents back to Decimal never rounds
+_EXACT = Context(prec=28)
+
+
+def is_available():
+    return np is not None
+
+
+# Vectorized counterpart of schedule_engine.iter_period_amounts.
+# Amounts and rates are scalars or one value per loan; the result is a (loans x periods) matrix, so loans
+# sharing the same number of periods and method are computed together. interest_months is the term the
+# flat_rate/simple_interest interest is charged for and defaults to the number of periods.
+def schedule_arrays(periods, interest_rate, period_interest_rate, loan_amount, loan_calculation_method,
+                    interest_months=None):
+    n = int(periods)
+    loan_amount = _column(loan_amount)
+    rate = _column(interest_rate)
+    r = _column(period_interest_rate)
+    months = n if interest_months is None else _column(interest_months)
+    shape = (len(loan_amount), n)
+    k = np.arange(n, dtype=np.float64)  # period - 1
+
+    if loan_calculation_method == 'reducing_balance':
+        principal = np.broadcast_to(loan_amount / n, shape).copy()
+        interest = (loan_amount - k * (loan_amount / n)) * r
+
+    elif loan_calculation_method in ('flat_rate', 'simple_interest'):
+        fixed_interest = loan_amount * rate / 100 * months / 12
+        principal = np.broadcast_to(loan_amount / n, shape).copy()
+        interest = np.broadcast_to(fixed_interest / n, shape).copy()
+
+    elif loan_calculation_method == 'constant_repayment':
+        if (r == 0).any():
+            raise ZeroDivisionError("Constant repayment requires a non-zero interest rate.")
+        growth = 1 + r
+        payment = loan_amount * r / (1 - growth ** -n)
+        # Remaining principal before each period, in the numerically stable annuity form
+        remaining = payment * (1 - growth ** -(n - k)) / r
+        interest = remaining * r
+        principal = payment - interest
+
+    elif loan_calculation_method == 'compound_interest':
+        per_period = loan_amount * (1 + r) ** n / n
+        remaining = _remaining_balance(loan_amount, r, per_period, k)
+        interest = remaining * r
+        principal = per_period - interest
+
+    elif loan_calculation_method == 'graduated_repayment':
+        principal = (loan_amount / n) * GRADUATED_INCREMENT ** k
+        paid_before = np.cumsum(principal, axis=1) - principal
+        interest = (loan_amount - paid_before) * r
+
+    elif loan_calculation_method == 'balloon_payment':
+        if n < 2:
+            raise ZeroDivisionError("Balloon payment requires at least two periods.")
+        balloon_amount = loan_amount * BALLOON_RATIO
+        monthly_payment = (loan_amount - balloon_amount) / (n - 1)
+        remaining = _remaining_balance(loan_amount, r, monthly_payment, k)
+        interest = remaining * r
+        principal = monthly_payment - interest
+        principal[:, -1:] = balloon_amount
+
+    elif loan_calculation_method == 'bullet_repayment':
+        principal = np.zeros(shape)
+        principal[:, -1:] = loan_amount
+        interest = np.broadcast_to(loan_amount * r, shape).copy()
+
+    elif loan_calculation_method == 'interest_first':
+        principal = np.zeros(shape)
+        principal[:, -1:] = loan_amount
+        interest = np.broadcast_to(loan_amount * r, shape).copy()
+        interest[:, -1] = 0.0
+
+    else:
+        principal = np.zeros((len(loan_amount), 0))
+        interest = np.zeros((len(loan_amount), 0))
+
+    return principal, interest
+
+
+def _column(values):
+    return np.asarray(values, dtype=np.float64).reshape(-1, 1)
+
+
+# Balance left before each period when a fixed amount is paid every period on a balance growing by r
+def _remaining_balance(loan_amount, r, payment, k):
+    growth = (1 + r) ** k
+    # (growth - 1) / r, which tends to k when there is no interest
+    annuity = np.divide(growth - 1, r, out=np.broadcast_to(k, growth.shape).copy(), where=r != 0)
+    return loan_amount * growth - payment * annuity
+
+
+# Rounds each period to integer cents on its own, half to even, as the Decimal engine rounds its rows, and trues the
+# last period up to the plan totals (integer cents, one per loan), so the rows add up exactly to them.
+# Returns the (loans x periods) principal and interest cents.
+def to_minor_units(principal, interest, total_principal, total_interest):
+    # NaN fails the comparison too, so non-finite amounts are rejected as well
+    if not all((np.abs(values) < MAX_AMOUNT).all() for values in (principal, interest, principal + interest)):
+        raise OverflowError("Repayment schedule amounts are out of range.")
+
+    principal_cents, interest_cents = _cents(principal), _cents(interest)
+    if principal_cents.shape[1]:
+        principal_cents[:, -1] += np.asarray(total_principal, dtype=np.int64) - principal_cents.sum(axis=1)
+        interest_cents[:, -1] += np.asarray(total_interest, dtype=np.int64) - interest_cents.sum(axis=1)
+    return principal_cents, interest_cents
+
+
+def _cents(amounts):
+    return np.rint(amounts * 100).astype(np.int64)
+
+
+# Plan totals, Decimals with two decimal places, in integer cents
+def _total_cents(total):
+    cents = int(total.scaleb(2, _EXACT))
+    if abs(cents) >= MAX_AMOUNT * 100:
+        raise OverflowError("Repayment schedule totals are out of range.")
+    return cents
+
+
+# A schedule kept as integer cents. ScheduleRow objects are only built if its rows are read, e.g. to save them;
+# as_dict() writes the amounts as floats of the exact cents, which the JSON renderer writes out just as it writes
+# the Decimal engine's amounts, so no Decimal is built per row for an API response.
+class MinorUnitSchedule:
+
+    def __init__(self, principal_cents, interest_cents, due_dates, total_principal, total_interest):
+        self.principal_cents = principal_cents
+        self.interest_cents = interest_cents
+        self.due_dates = due_dates
+        self.total_principal = total_principal
+        self.total_interest = total_interest
+        self.total_amount_to_repay = total_principal + total_interest
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = [
+                ScheduleRow(period, _to_decimal(principal), _to_decimal(interest), _to_decimal(principal + interest),
+                            due_date)
+                for period, principal, interest, due_date in zip(
+                    range(1, len(self) + 1), self.principal_cents.tolist(), self.interest_cents.tolist(),
+                    self.due_dates)
+            ]
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.principal_cents)
+
+    def as_dict(self):
+        installment_cents = self.principal_cents + self.interest_cents
+        return {
+            'repayment_plan': [
+                {'period': period, 'principal': principal, 'interest': interest, 'installment': installment,
+                 'due_date': due_date.isoformat() if due_date else None}
+                for period, principal, interest, installment, due_date in zip(
+                    range(1, len(self) + 1), (self.principal_cents / 100).tolist(),
+                    (self.interest_cents / 100).tolist(), (installment_cents / 100).tolist(), self.due_dates)
+            ],
+            'total_principal': self.total_principal,
+            'total_interest': self.total_interest,
+            'total_amount_to_repay': self.total_amount_to_repay
+        }
+
+
+# due_dates is the sequence of the schedule's due dates, from the calendars module; total_principal and
+# total_interest are the plan totals from schedule_engine.plan_totals()
+def calculate_repayment_schedule(periods, due_dates, interest_rate, period_interest_rate, loan_amount,
+                                 loan_calculation_method, total_principal, total_interest, interest_months=None):
+    if not is_available():
+        raise ValueError("The vectorized loan calculator engine requires NumPy.")
+
+    principal, interest = schedule_arrays(periods, interest_rate, period_interest_rate, loan_amount,
+                                          loan_calculation_method, interest_months)
+    principal_cents, interest_cents = to_minor_units(principal, interest, [_total_cents(total_principal)],
+                                                     [_total_cents(total_interest)])
+    return MinorUnitSchedule(principal_cents[0], interest_cents[0], due_dates, total_principal, total_interest)
+
+
+# Computes many schedules at once. Each request is a dict of calculate_repayment_schedule() arguments;
+# requests with the same periods and method are computed as one matrix. Returns one result per request,
+# in order: the schedule, or the exception raised while computing it.
+def calculate_repayment_schedules(requests):
+    if not is_available():
+        raise ValueError("The vectorized loan calculator engine requires NumPy.")
+
+    groups = {}
+    for position, request in enumerate(requests):
+        key = (int(request['periods']), request['loan_calculation_method'])
+        groups.setdefault(key, []).append(position)
+
+    results = [None] * len(requests)
+    for positions in groups.values():
+        try:
+            schedules = _calculate_group([requests[position] for position in positions])
+        except (ArithmeticError, ValueError):
+            # One bad loan must not fail the whole group: compute its members one by one instead
+            schedules = [_calculate_or_error(requests[position]) for position in positions]
+        for position, schedule in zip(positions, schedules):
+            results[position] = schedule
+
+    return results
+
+
+def _calculate_or_error(request):
+    try:
+        return calculate_repayment_schedule(**request)
+    except (ArithmeticError, ValueError) as error:
+        return error
+
+
+def _calculate_group(requests):
+    first = requests[0]
+    interest_months = [request.get('interest_months') for request in requests]
+    principal, interest = schedule_arrays(
+        first['periods'],
+        [request['interest_rate'] for request in requests],
+        [request['period_interest_rate'] for request in requests],
+        [request['loan_amount'] for request in requests],
+        first['loan_calculation_method'],
+        None if None in interest_months else interest_months,
+    )
+    principal_cents, interest_cents = to_minor_units(
+        principal, interest, [_total_cents(request['total_principal']) for request in requests],
+        [_total_cents(request['total_interest']) for request in requests])
+    return [
+        MinorUnitSchedule(principal_cents[row], interest_cents[row], request['due_dates'],
+                          request['total_principal'], request['total_interest'])
+        for row, request in enumerate(requests)
+    ]
+
+
+def _to_decimal(minor_units):
+    return Decimal(minor_units).scaleb(-2, _EXACT)
@@ -6,12 +6,26 @@ from rest_framework.views import APIView
 from rest_framework.exceptions import NotFound
 from .models import *
 from .serializers import *
+from django.db import transaction
 from django.db.models import Sum, F
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet, NumberFilter, CharFilter
 from decimal import Decimal
 from django.utils import timezone
 from rest_framework import generics
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from itertools import chain, islice
+import tempfile
+from datetime import timedelta
+from django.utils.dateparse import parse_date
+from . import balances, payment_imports, postings, repayments, schedule_engine
+from .parsers import CSVParser, NDJSONParser
+from .renderers import NDJSONRenderer
+from rest_framework.settings import api_settings
+from .quote_cache import quote_cache
 
 
 def home(request):
@@ -137,6 +151,27 @@ class DisbursementViewSet(viewsets.ModelViewSet):
             return Disbursement.objects.filter(loan_application_id=self.request.query_params['loan_application_id'])
         return super().get_queryset()
 
+    # A disbursement is posted to the ledger once, when it is created or updated as completed
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            disbursement = serializer.save()
+            if disbursement.status == 'completed':
+                self.post_to_ledger(disbursement)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            was_completed = Disbursement.objects.select_for_update().filter(pk=serializer.instance.pk,
+                                                                            status='completed').exists()
+            disbursement = serializer.save()
+            if disbursement.status == 'completed' and not was_completed:
+                self.post_to_ledger(disbursement)
+
+    def post_to_ledger(self, disbursement):
+        try:
+            postings.post_disbursement(disbursement)
+        except ValueError as error:
+            raise ValidationError({"error": str(error)})
+
 
 # Repayment schedules are created for approved loans.
 # Create repayment schedules based on loan terms.
@@ -191,59 +226,33 @@ class LoanAccountViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], url_path='repay-loan')
     def repay_loan(self, request, pk=None): # This method handles the repayment of a loan.
         loan_account = self.get_object()
-    
-        amount = Decimal(request.data.get('amount', 0))
-
-        # Apply penalties first
-        if loan_account.accrued_penalty > 0:
-            if amount >= loan_account.accrued_penalty:
-                amount -= loan_account.accrued_penalty
-                loan_account.accrued_penalty = Decimal('0.00')
-            else:
-                loan_account.accrued_penalty -= amount
-                amount = Decimal('0.00')
-
-        # Apply to the next due repayment schedule
-        schedules = RepaymentSchedule.objects.filter(loan_application=loan_account.loan_application,
-                                                     status='pending').order_by('due_date')
-        for schedule in schedules:
-            if amount <= 0:
-                break
-            if amount >= schedule.total_amount:
-                amount -= schedule.total_amount
-                schedule.status = 'paid'
-            else:
-                loan_account.advance_payment_balance += amount
-                amount = Decimal('0.00')
-            schedule.save()
-
-        # If there's any remaining amount, add to advance payment balance
-        if amount > 0:
-            loan_account.advance_payment_balance += amount
-
-        loan_account.save()
+        try:
+            result = repayments.repay_loan(loan_account.pk, request.data.get('amount', 0))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({"status": "Repayment processed successfully."}, status=status.HTTP_200_OK)
+        return Response({"status": "Repayment processed successfully.", **result}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], url_path='apply-advance-payment')
     def apply_advance_payment(self, request, pk=None):
         loan_account = self.get_object()
-        schedules = RepaymentSchedule.objects.filter(loan_application=loan_account.loan_application,status='pending').order_by('due_date')                                    
-        for schedule in schedules:
-            if loan_account.advance_payment_balance <= 0:
-                break
-            if loan_account.advance_payment_balance >= schedule.total_amount:
-                loan_account.advance_payment_balance -= schedule.total_amount
-                schedule.status = 'paid'
-            else:
-                schedule.status = 'partial'
-                schedule.total_amount -= loan_account.advance_payment_balance
-                loan_account.advance_payment_balance = Decimal('0.00')
-            schedule.save()
+        try:
+            result = repayments.apply_advance_payment(loan_account.pk)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"status": "Advance payment applied successfully.", **result}, status=status.HTTP_200_OK)
 
-        loan_account.save()
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        loan_account = self.get_object()
+        try:
+            from_date, to_date = statement_period(request)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({"status": "Advance payment applied successfully."}, status=status.HTTP_200_OK)
+        result = balances.loan_account_balances.statement(loan_account.pk, from_date, to_date)
+        return Response({"loan_account": loan_account.pk, **result}, status=status.HTTP_200_OK)
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -472,6 +481,40 @@ class AccountViewSet(viewsets.ModelViewSet): #  viewsets.ModelViewSet, which pro
             return queryset.filter(id=self.request.query_params['id'])
         return queryset
 
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        account = self.get_object()
+        try:
+            from_date, to_date = statement_period(request)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = balances.account_balances.statement(account.pk, from_date, to_date)
+        return Response({"account": account.pk, **result}, status=status.HTTP_200_OK)
+
+
+# Date query parameter in YYYY-MM-DD format, or default when it is not given
+def date_param(request, name, default):
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f"{name} must be a valid date in YYYY-MM-DD format.")
+    return day
+
+
+# Period of a statement: ?from=&to=, by default the 30 days up to today
+def statement_period(request):
+    to_date = date_param(request, 'to', timezone.localdate())
+    from_date = date_param(request, 'from', to_date - timedelta(days=30))
+    if from_date > to_date:
+        raise ValueError("from must not be after to.")
+    return from_date, to_date
+
 # Manages the register of due payments.
 class DueRegisterViewSet(viewsets.ModelViewSet):
     queryset = DueRegister.objects.all()
@@ -531,12 +574,24 @@ class BalanceAdjustmentViewSet(viewsets.ModelViewSet):
 
 # =================================== Loan calculater ========================
 
+# Errors of a calculation the engine could not carry out, shaped like the serializer's validation errors
+def calculation_errors(error):
+    if isinstance(error, KeyError):
+        error = f"Unsupported tenure_type {error} for this repayment_schedule."
+    return {'non_field_errors': [str(error)]}
+
+
 # API endpoint for calculating loan repayment schedules
 
 class LoanCalculatorView(APIView):
     """
     API endpoint that allows users to calculate loan repayment schedules.
+    Long schedules, requests with offset/limit and requests accepting application/x-ndjson get the schedule
+    streamed, without building the whole plan in memory.
     """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+    renderer = JSONRenderer()
+    rows_per_chunk = 100  # Rows rendered into each chunk of a streamed schedule
 
     def get(self, request, *args, **kwargs):
         # Return empty data for form fields
@@ -545,10 +600,205 @@ class LoanCalculatorView(APIView):
 
     def post(self, request, *args, **kwargs):
         serializer = LoanCalculatorSerializer(data=request.data)
-        if serializer.is_valid():
-            repayment_schedule = serializer.calculate_repayment_schedule(serializer.validated_data)
-            return Response(repayment_schedule, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return self.calculate(request, serializer.validated_data, serializer)
+        except schedule_engine.CALCULATION_ERRORS as error:
+            return Response(calculation_errors(error), status=status.HTTP_400_BAD_REQUEST)
+
+    def calculate(self, request, validated_data, serializer):
+        if not validated_data['summary_only']:
+            # Windowed, NDJSON and very long schedules are streamed row by row instead of built in memory
+            schedule = serializer.iter_schedule(validated_data)
+            threshold = getattr(settings, 'LOAN_CALCULATOR_STREAM_THRESHOLD', 1000)
+            ndjson = isinstance(request.accepted_renderer, NDJSONRenderer)
+            if ndjson or 'offset' in validated_data or 'limit' in validated_data or schedule.periods > threshold:
+                return self.stream_schedule(schedule, ndjson)
+        # Identical quotes are served from the quote cache instead of recalculating the schedule
+        engine = getattr(settings, 'LOAN_CALCULATOR_ENGINE', 'decimal')
+        variant = 'summary' if validated_data.get('summary_only') else ''
+        repayment_schedule = quote_cache.get_or_calculate(
+            quote_cache.make_key(validated_data, engine, variant),
+            lambda: serializer.calculate_repayment_schedule(validated_data),
+        )
+        return Response(repayment_schedule, status=status.HTTP_200_OK)
+
+    def stream_schedule(self, schedule, ndjson=False):
+        # The first chunk is computed before the response starts, so the inputs the engine cannot calculate
+        # still get a 400 instead of a stream cut short
+        chunks = self.chunk_rows(schedule)
+        first_chunk = next(chunks, None)
+        if first_chunk is not None:
+            chunks = chain([first_chunk], chunks)
+        if ndjson:
+            return StreamingHttpResponse(self.render_ndjson(schedule, chunks), content_type='application/x-ndjson')
+        return StreamingHttpResponse(self.render_json(schedule, chunks), content_type='application/json')
+
+    # One NDJSON line per installment, then a line with the plan's totals
+    def render_ndjson(self, schedule, chunks):
+        for rows in chunks:
+            yield b''.join(self.renderer.render(row.as_dict()) + b'\n' for row in rows)
+        yield self.renderer.render(self.plan_details(schedule)) + b'\n'
+
+    # The usual calculator response, written out chunk by chunk
+    def render_json(self, schedule, chunks):
+        yield b'{"repayment_plan":['
+        separator = b''
+        for rows in chunks:
+            yield separator + b','.join(self.renderer.render(row.as_dict()) for row in rows)
+            separator = b','
+        yield b'],' + self.renderer.render(self.plan_details(schedule))[1:]
+
+    def chunk_rows(self, schedule):
+        rows = iter(schedule)
+        while True:
+            chunk = list(islice(rows, self.rows_per_chunk))
+            if not chunk:
+                break
+            yield chunk
+
+    def plan_details(self, schedule):
+        return {
+            'number_of_installments': schedule.periods,
+            'offset': schedule.offset,
+            'limit': schedule.limit,
+            **schedule.totals()
+        }
+
+
+# API endpoint for calculating many loan repayment schedules in one request
+
+class LoanCalculatorBatchView(APIView):
+    """
+    API endpoint that calculates repayment schedules for a whole portfolio.
+    Accepts a JSON array or an NDJSON stream of loan calculator inputs and streams back one NDJSON line
+    per loan, in input order: {"index": ..., "result": {...}} or {"index": ..., "errors": {...}}.
+    """
+    parser_classes = [JSONParser, NDJSONParser]
+    renderer = JSONRenderer()
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if isinstance(items, dict):
+            return Response({"error": "Expected a list of loan calculator inputs."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(self.stream_results(iter(items)), content_type='application/x-ndjson')
+
+    def stream_results(self, items):
+        # Loans are read and computed chunk by chunk, so results start flowing before the input is exhausted
+        chunk_size = getattr(settings, 'LOAN_CALCULATOR_BATCH_CHUNK_SIZE', 1000)
+        index = 0
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+            for line in self.calculate_chunk(chunk):
+                line['index'] += index
+                yield self.renderer.render(line) + b'\n'
+            index += len(chunk)
+
+    def calculate_chunk(self, chunk):
+        # One serializer validates the whole chunk, which avoids rebuilding its fields for every loan
+        serializer = LoanCalculatorSerializer()
+        output_lines = [None] * len(chunk)
+        validated = []
+        for position, item in enumerate(chunk):
+            if isinstance(item, ParseError):
+                output_lines[position] = self.error_line(position, item.detail)
+                continue
+            try:
+                validated.append((position, serializer.run_validation(item)))
+            except ValidationError as error:
+                output_lines[position] = {'index': position, 'errors': error.detail}
+
+        # Summaries are closed-form and cheap. The full schedules are computed with LOAN_CALCULATOR_BATCH_ENGINE,
+        # the vectorized engine by default, which computes loans with the same periods and method together as one
+        # matrix; its totals are those of the single loan calculator's decimal engine
+        schedule_inputs = []
+        for position, validated_data in validated:
+            calculator_inputs = serializer.calculator_inputs(validated_data)
+            if validated_data['summary_only']:
+                output_lines[position] = self.result_line(position, schedule_engine.calculate_summary,
+                                                          calculator_inputs)
+            else:
+                schedule_inputs.append((position, calculator_inputs))
+
+        engine = getattr(settings, 'LOAN_CALCULATOR_BATCH_ENGINE', 'vectorized')
+        schedules = schedule_engine.calculate_schedules(
+            [calculator_inputs for _, calculator_inputs in schedule_inputs], engine=engine,
+            business_calendar=get_business_calendar())
+        for (position, _), schedule in zip(schedule_inputs, schedules):
+            if isinstance(schedule, Exception):
+                output_lines[position] = self.error_line(position, schedule)
+            else:
+                output_lines[position] = {'index': position, 'result': schedule.as_dict()}
+        return output_lines
+
+    def result_line(self, position, calculate, calculator_inputs):
+        try:
+            return {'index': position, 'result': calculate(**calculator_inputs).as_dict()}
+        except schedule_engine.CALCULATION_ERRORS as error:
+            return self.error_line(position, error)
+
+    def error_line(self, position, error):
+        return {'index': position, 'errors': calculation_errors(error)}
+
+
+# API endpoint for importing the bank's daily payment files
+
+class PaymentImportView(APIView):
+    """
+    API endpoint that posts a file of loan repayments in bulk.
+    Accepts a CSV (with a header line), NDJSON or JSON array upload of lines with loan_account_id, amount and
+    optionally payment_date and payment_method, and returns one NDJSON line per payment line, in file order:
+    {"index": ..., "result": {...}} or {"index": ..., "errors": {...}}.
+    The whole file is posted before the response starts, so a client that disconnects cannot leave part of it unposted.
+    """
+    parser_classes = [CSVParser, NDJSONParser, JSONParser]
+    renderer = JSONRenderer()
+    spool_size = 1024 * 1024  # Bytes of result lines kept in memory before they are written to a temporary file
+    block_size = 64 * 1024  # Bytes per chunk of the streamed results
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if isinstance(items, dict):
+            return Response({"error": "Expected a list of payment lines."}, status=status.HTTP_400_BAD_REQUEST)
+        results = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        count = 0
+        try:
+            for line in payment_imports.import_payments(items):
+                results.write(self.renderer.render(line) + b'\n')
+                count += 1
+        except ValueError as error:
+            if not count:
+                results.close()
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            # The lines before were posted and keep their results; the rest of the file could not be read
+            results.write(self.renderer.render({'index': count, 'errors': {'non_field_errors': [
+                f"The rest of the file was not read: {error}"]}}) + b'\n')
+        results.seek(0)
+        return StreamingHttpResponse(self.stream_results(results), content_type='application/x-ndjson')
+
+    def stream_results(self, results):
+        with results:
+            yield from iter(lambda: results.read(self.block_size), b'')
+
+
+# API endpoint for the trial balance, as of any date
+
+class TrialBalanceView(APIView):
+    """
+    API endpoint that returns the trial balance at the end of a day (?date=YYYY-MM-DD, today by default): every
+    account's balance in its debit or credit column, from the latest EOD balance snapshot and the ledger rows since.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            day = date_param(request, 'date', timezone.localdate())
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(balances.trial_balance(day), status=status.HTTP_200_OK)
 
 
 #=================================== Documentation and Verification ==================================
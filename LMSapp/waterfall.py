@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RepaymentPriority
+
+logger = logging.getLogger(__name__)
+
+# Payment waterfalls. RepaymentPriority.priority_order ({"1": "interest", "2": "penalty", "3": "principal"}) sets the
+# order a loan type's due types are paid in. Each config is parsed once into a Waterfall, and the compiled set is kept
+# per process until a RepaymentPriority is added, changed or removed, so operations can change the allocation rules
+# without a deploy. A save or delete in this process drops the compiled set when it commits; changes made by other
+# processes are detected by one aggregate query, run once per batch job and at most once every
+# REPAYMENT_WATERFALL_CACHE_MAX_AGE seconds for single repayments. Loans are not linked to a company, so configs apply
+# per loan type; the oldest config of a loan type wins.
+
+# Order due types are paid in when the loan type has no RepaymentPriority: penalties first, then interest
+DEFAULT_PRIORITY = ('penalty', 'interest', 'principal')
+
+
+class Waterfall:
+
+    def __init__(self, priority=DEFAULT_PRIORITY):
+        self.priority = tuple(priority)
+        self.rank = {due_type: position for position, due_type in enumerate(self.priority)}
+        # Installments are paid whole, so the accrued penalty goes either before or after them: before when it ranks
+        # ahead of both their interest and principal
+        self.penalty_first = self.rank_of('penalty') < min(self.rank_of('interest'), self.rank_of('principal'))
+        self.interest_first = self.rank_of('interest') <= self.rank_of('principal')
+
+    @classmethod
+    def parse(cls, priority_order):
+        return cls(due_type for _, due_type in sorted(priority_order.items(), key=lambda item: int(item[0])))
+
+    def rank_of(self, due_type):
+        return self.rank.get(due_type, len(self.rank))  # Due types the config leaves out are paid last
+
+    # Splits funds over outstanding due items: by the priority of their due type, then the oldest first.
+    # dues are (due_id, due_type, due_date, outstanding) tuples; returns (due_id, amount) pairs.
+    def allocate(self, funds, dues):
+        def payment_order(due):
+            due_id, due_type, due_date, _ = due
+            return self.rank_of(due_type), due_date, due_id
+
+        allocations = []
+        for due_id, due_type, due_date, outstanding in sorted(dues, key=payment_order):
+            if funds <= 0:
+                break
+            amount = min(funds, outstanding)
+            allocations.append((due_id, amount))
+            funds -= amount
+        return allocations
+
+    # Splits a repayment over the accrued penalty and the pending installments, paid from the oldest, each one only if
+    # the rest of the amount covers it in full. schedules are (schedule_id, total_amount) pairs in due date order.
+    # Returns the penalty paid, the (schedule_id, total_amount) pairs of the installments paid and what is left over.
+    def allocate_repayment(self, amount, accrued_penalty, schedules):
+        penalty = max(accrued_penalty, Decimal('0.00'))
+        penalty_paid = min(amount, penalty) if self.penalty_first else Decimal('0.00')
+        remaining = amount - penalty_paid
+        paid = []
+        for schedule_id, total_amount in schedules:
+            if total_amount > remaining:
+                break
+            remaining -= total_amount
+            paid.append((schedule_id, total_amount))
+        if not self.penalty_first:
+            penalty_paid = min(remaining, penalty)
+            remaining -= penalty_paid
+        return penalty_paid, paid, remaining
+
+    # Splits a part payment of an installment over its interest and principal; returns (interest paid, principal paid)
+    def split_installment(self, amount, interest_amount, principal_amount):
+        if self.interest_first:
+            interest_paid = min(amount, interest_amount)
+            return interest_paid, amount - interest_paid
+        principal_paid = min(amount, principal_amount)
+        return amount - principal_paid, principal_paid
+
+
+DEFAULT_WATERFALL = Waterfall()
+
+
+# Compiles every RepaymentPriority into {loan_type: Waterfall}; configs that cannot be parsed are skipped
+def compile_waterfalls():
+    waterfalls = {}
+    for config_id, loan_type, priority_order in RepaymentPriority.objects.order_by('pk').values_list(
+            'pk', 'loan_type', 'priority_order'):
+        if loan_type in waterfalls:
+            continue
+        try:
+            waterfalls[loan_type] = Waterfall.parse(priority_order)
+        except (AttributeError, TypeError, ValueError):
+            logger.warning("Ignoring repayment priority %s with an invalid priority_order %r", config_id,
+                           priority_order)
+    return waterfalls
+
+
+class WaterfallCache:
+
+    def __init__(self):
+        self._version = None
+        self._checked_at = None
+        self._waterfalls = {}
+        self._lock = threading.Lock()
+
+    # Changes whenever a config is added, saved or deleted
+    def current_version(self):
+        version = RepaymentPriority.objects.aggregate(count=Count('pk'), last_id=Max('pk'), updated=Max('updated_at'))
+        return version['count'], version['last_id'], version['updated']
+
+    # The compiled waterfalls, {loan_type: Waterfall}, recompiled if the configs changed since they were compiled.
+    # A batch job takes one snapshot and uses it throughout; it must not be modified.
+    def snapshot(self):
+        version = self.current_version()
+        with self._lock:
+            if version != self._version:
+                self._waterfalls = compile_waterfalls()
+                self._version = version
+            self._checked_at = time.monotonic()
+            return self._waterfalls
+
+    # The waterfall of one loan type; the version is only checked again once the last check is max_age seconds old
+    def get(self, loan_type):
+        max_age = getattr(settings, 'REPAYMENT_WATERFALL_CACHE_MAX_AGE', 60)
+        with self._lock:
+            waterfalls = self._waterfalls
+            fresh = self._checked_at is not None and time.monotonic() - self._checked_at < max_age
+        if not fresh:
+            waterfalls = self.snapshot()
+        return waterfalls.get(loan_type, DEFAULT_WATERFALL)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = None
+            self._waterfalls = {}
+
+
+waterfall_cache = WaterfallCache()
+
+
+# Drops the compiled waterfalls once a config change commits, so that no other thread recompiles them from the
+# configs as they were before it
+@receiver([post_save, post_delete], sender=RepaymentPriority, dispatch_uid='clear_waterfall_cache')
+def clear_waterfall_cache(sender, **kwargs):
+    transaction.on_commit(waterfall_cache.clear)
@@ -123,3 +123,74 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Loan calculator engine used by ReusableLoanCalculator: 'decimal' or 'vectorized' (requires NumPy). They return the
+# same totals; a row can differ by a cent, see LMSapp/vectorized.py
+LOAN_CALCULATOR_ENGINE = 'decimal'
+
+# Number of loans the batch calculator endpoint reads and computes at a time
+LOAN_CALCULATOR_BATCH_CHUNK_SIZE = 1000
+
+# Engine of the batch calculator endpoint. The vectorized one computes loans with the same periods and method as one
+# matrix; without NumPy the batch falls back to the decimal engine
+LOAN_CALCULATOR_BATCH_ENGINE = 'vectorized'
+
+# Loan calculator quote cache: number of quotes kept per process (0 disables it), seconds a quote stays cached,
+# and an optional cache alias from CACHES to share quotes between worker processes
+LOAN_CALCULATOR_QUOTE_CACHE_SIZE = 1024
+LOAN_CALCULATOR_QUOTE_CACHE_TTL = 300
+LOAN_CALCULATOR_QUOTE_CACHE_BACKEND = None
+
+# Seconds a single repayment trusts the compiled repayment waterfalls before checking for configs changed by another
+# process; changes made in the same process apply at once
+REPAYMENT_WATERFALL_CACHE_MAX_AGE = 60
+
+# Schedules with more installments than this are streamed by the loan calculator instead of built in memory
+LOAN_CALCULATOR_STREAM_THRESHOLD = 1000
+
+# Rows per INSERT when repayment schedules are saved in bulk
+LOAN_SCHEDULE_BULK_BATCH_SIZE = 1000
+
+# Loan modifications rewrite only the future schedule rows that change instead of replacing them all
+LOAN_MODIFICATION_INCREMENTAL_RECALCULATION = True
+
+# Business-day calendar for repayment due dates: None leaves them as stepped, or e.g.
+# {'holidays': ['2025-12-25'], 'weekend': [5, 6], 'convention': 'following'}, or the dotted path of a
+# LMSapp.calendars.BusinessCalendar subclass or instance
+LOAN_BUSINESS_CALENDAR = None
+
+# Loan accounts read and written per batch by the end-of-day jobs
+EOD_BATCH_SIZE = 1000
+
+# Loan account id-range shards the end-of-day run is split into; None uses one per CPU, or one on SQLite
+EOD_SHARDS = None
+
+# Worker processes of the local end-of-day executor; None uses one per CPU, or one on SQLite
+EOD_WORKERS = None
+
+# 'celery' or 'local'; None uses Celery when CELERY_BROKER_URL is set and a local process pool otherwise
+EOD_EXECUTOR = None
+
+# account_number of the Account each posting engine role posts to (see LMSapp.postings.LEDGER_ROLES), e.g.
+# {'interest_income': '4000000000000001'}; roles left out use the first Account of the role's account type, which the
+# 0011_seed_ledger_accounts migration creates when a database has none
+LEDGER_ACCOUNTS = {}
+
+# account_number of the general ledger Account repayments are posted to; None uses the first 'repayment' Account
+REPAYMENT_ACCOUNT_NUMBER = None
+
+# Failed repayment collections are retried after REPAYMENT_RETRY_DELAY_DAYS, the delay growing by
+# REPAYMENT_RETRY_BACKOFF_FACTOR after every failure up to REPAYMENT_RETRY_MAX_DELAY_DAYS. After
+# REPAYMENT_MAX_ATTEMPTS attempts in all, the loan account is moved to FailedLoanRepayments.
+REPAYMENT_RETRY_DELAY_DAYS = 1
+REPAYMENT_RETRY_BACKOFF_FACTOR = 2
+REPAYMENT_RETRY_MAX_DELAY_DAYS = 30
+REPAYMENT_MAX_ATTEMPTS = 4
+
+# Payment file lines read and posted per transaction by the bulk payment import
+PAYMENT_IMPORT_CHUNK_SIZE = 1000
+
+# Late payment penalty accrued daily on pending installments past their due date, as an annual percentage of the
+# installment amount, once they are more than LATE_PAYMENT_GRACE_DAYS late
+LATE_PAYMENT_PENALTY_RATE = 24
+LATE_PAYMENT_GRACE_DAYS = 0